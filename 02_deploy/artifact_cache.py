@@ -0,0 +1,85 @@
+import os
+import shutil
+import hashlib
+import tarfile
+import tempfile
+
+import xgboost
+
+from concurrent.futures import ThreadPoolExecutor
+
+# Local cache of extracted model artifacts (model.tar.gz). Each artifact is
+# extracted once into a directory named after its S3 ETag (or the SHA-256 of a
+# local file), so loading the same training job output again is a directory
+# lookup. Downloads and extractions run concurrently and in-process.
+
+default_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'sagemaker-btd', 'artifacts')
+
+def get_s3_client():
+    import boto3
+    return boto3.session.Session().client('s3')
+
+def get_artifact_key(uri, s3_client=None):
+    if uri.startswith('s3://'):
+        bucket, key = uri[len('s3://'):].split('/', 1)
+        etag = (s3_client or get_s3_client()).head_object(Bucket=bucket, Key=key)['ETag'].strip('"')
+        return 'etag-' + etag.replace('-', '_')
+
+    sha256 = hashlib.sha256()
+    with open(uri, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha256.update(block)
+    return 'sha256-' + sha256.hexdigest()
+
+def _download(uri, path, s3_client=None):
+    if uri.startswith('s3://'):
+        bucket, key = uri[len('s3://'):].split('/', 1)
+        (s3_client or get_s3_client()).download_file(bucket, key, path)
+    else:
+        shutil.copyfile(uri, path)
+
+def fetch_artifact(uri, cache_dir=None, s3_client=None):
+    # Returns the directory holding the extracted artifact, downloading and
+    # extracting it only when it is not in the cache yet
+    cache_dir = cache_dir or os.environ.get('ARTIFACT_CACHE_DIR', default_cache_dir)
+    artifact_dir = os.path.join(cache_dir, get_artifact_key(uri, s3_client))
+    if os.path.isdir(artifact_dir):
+        print(f'Artifact cache hit for {uri}: {artifact_dir}\n', end='')
+        return artifact_dir
+
+    print(f'Artifact cache miss for {uri}\n', end='')
+    os.makedirs(cache_dir, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(dir=cache_dir, prefix='.staging-')
+    try:
+        archive_path = os.path.join(staging_dir, 'model.tar.gz')
+        _download(uri, archive_path, s3_client)
+        extract_dir = os.path.join(staging_dir, 'model')
+        with tarfile.open(archive_path, 'r:gz') as archive:
+            if hasattr(tarfile, 'data_filter'):
+                archive.extractall(extract_dir, filter='data')
+            else:
+                archive.extractall(extract_dir)
+        # Publish the extracted directory atomically, so a concurrent or interrupted
+        # fetch never leaves a partial artifact in the cache
+        try:
+            os.rename(extract_dir, artifact_dir)
+        except OSError:
+            if not os.path.isdir(artifact_dir):
+                raise
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    return artifact_dir
+
+def fetch_artifacts(uris, cache_dir=None):
+    # Clients are thread-safe, but creating them from the default boto3 session
+    # in several threads at once is not, so the workers share one client
+    s3_client = get_s3_client() if any(uri.startswith('s3://') for uri in uris) else None
+    with ThreadPoolExecutor(max_workers=max(1, len(uris))) as executor:
+        return list(executor.map(lambda uri: fetch_artifact(uri, cache_dir, s3_client), uris))
+
+def load_booster(model_path):
+    # Loads the native model file written by training. Skipping the joblib pickle
+    # is what makes this faster than the previous load_models
+    booster = xgboost.Booster()
+    booster.load_model(model_path)
+    return booster
@@ -0,0 +1,31 @@
+import sys
+import time
+import io
+
+from deploy import get_xgboost_request_translator
+from benchmark_utils import make_synthetic_features, train_synthetic_booster
+
+def run_benchmark(total_rows, batch_sizes):
+    booster = train_synthetic_booster()
+    translator = get_xgboost_request_translator()
+    features = make_synthetic_features(total_rows)
+
+    print(f'Scoring {total_rows} rows per batch size')
+    for batch_size in batch_sizes:
+        batches = [features[i:i + batch_size] for i in range(0, total_rows, batch_size)]
+
+        start = time.perf_counter()
+        scored_rows = 0
+        for batch in batches:
+            # Client side serialization, server side deserialization and prediction
+            payload = translator.serialize_payload_to_bytes(batch)
+            dmatrix = translator.deserialize_payload_from_stream(io.BytesIO(payload))
+            scored_rows += len(booster.predict(dmatrix))
+        elapsed = time.perf_counter() - start
+
+        print(f'Batch size {batch_size:>5}: {len(batches):>6} requests, '
+              f'{elapsed / len(batches) * 1000:8.3f} ms/request, {scored_rows / elapsed:12.0f} rows/s')
+
+if __name__ == "__main__":
+    total_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2 ** 16
+    run_benchmark(total_rows, batch_sizes=[1, 32, 256, 4096])
@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+import shutil
+import tarfile
+import tempfile
+import subprocess
+
+import joblib
+import xgboost
+import cloudpickle
+
+import artifact_cache
+import compiled_featurizer
+from deploy import get_fused_model_spec
+from benchmark_utils import fit_synthetic_models
+
+# Cold-start times of load_models and of an inference worker, before and after
+# the artifact cache. The two model.tar.gz artifacts are local files here, so
+# the S3 download itself is not included.
+
+def write_artifacts(work_dir, num_boost_round):
+    featurizer, booster = fit_synthetic_models(num_boost_round=num_boost_round)
+
+    sklearn_dir = os.path.join(work_dir, 'sklearn_artifact')
+    xgboost_dir = os.path.join(work_dir, 'xgboost_artifact')
+    os.makedirs(sklearn_dir)
+    os.makedirs(xgboost_dir)
+    joblib.dump(featurizer, os.path.join(sklearn_dir, 'sklearn_model.joblib'))
+    compiled_featurizer.save_compiled_featurizer(compiled_featurizer.compile_featurizer(featurizer),
+                                                 os.path.join(sklearn_dir, 'featurizer.npz'))
+    booster.save_model(os.path.join(xgboost_dir, 'xgboost_model.bin'))
+
+    archives = []
+    for artifact_dir in [sklearn_dir, xgboost_dir]:
+        archive_path = artifact_dir + '.tar.gz'
+        with tarfile.open(archive_path, 'w:gz') as archive:
+            for name in os.listdir(artifact_dir):
+                archive.add(os.path.join(artifact_dir, name), arcname=name)
+        archives.append(archive_path)
+    return archives
+
+# The previous load_models: one artifact after the other, extracted by shelling out to tar
+def load_models_subprocess(sklearn_archive, xgboost_archive, work_dir):
+    for name, archive in [('sklearn_model', sklearn_archive), ('xgboost_model', xgboost_archive)]:
+        model_dir = os.path.join(work_dir, name)
+        subprocess.call(['rm', '-rf', model_dir])
+        os.makedirs(model_dir)
+        shutil.copyfile(archive, os.path.join(model_dir, 'model.tar.gz'))
+        subprocess.call(['tar', '-xzf', os.path.join(model_dir, 'model.tar.gz'), '-C', model_dir])
+        subprocess.call(['rm', os.path.join(model_dir, 'model.tar.gz')])
+
+    featurizer = joblib.load(os.path.join(work_dir, 'sklearn_model', 'sklearn_model.joblib'))
+    booster = xgboost.Booster()
+    booster.load_model(os.path.join(work_dir, 'xgboost_model', 'xgboost_model.bin'))
+    return featurizer, booster
+
+def load_models_cached(sklearn_archive, xgboost_archive, cache_dir):
+    sklearn_model_dir, xgboost_model_dir = artifact_cache.fetch_artifacts([sklearn_archive, xgboost_archive], cache_dir)
+    featurizer = joblib.load(os.path.join(sklearn_model_dir, 'sklearn_model.joblib'))
+    booster = artifact_cache.load_booster(os.path.join(xgboost_model_dir, 'xgboost_model.bin'))
+    return featurizer, booster
+
+def time_call(func, *args):
+    start_time = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start_time
+
+# A fresh interpreter that unpickles the inference spec and loads the model, as a
+# TorchServe worker does when it starts
+worker_script = '''
+import sys, time
+start_time = time.perf_counter()
+import cloudpickle
+with open(sys.argv[1], 'rb') as file:
+    spec = cloudpickle.load(file)
+load_time = time.perf_counter()
+spec.load(sys.argv[2])
+end_time = time.perf_counter()
+print(load_time - start_time, end_time - load_time)
+'''
+
+def get_joblib_model_spec():
+    # Worker loading as before: the fitted ColumnTransformer through joblib and the booster from its file
+    class JoblibModelSpec:
+        def load(self, model_dir):
+            featurizer = joblib.load(model_dir + '/sklearn_model.joblib')
+            booster = xgboost.Booster()
+            booster.load_model(model_dir + '/xgboost_model.bin')
+            return featurizer, booster
+    return JoblibModelSpec()
+
+def time_worker_start(spec, model_dir, work_dir, repeats=5):
+    spec_path = os.path.join(work_dir, 'spec.pkl')
+    with open(spec_path, 'wb') as file:
+        cloudpickle.dump(spec, file)
+    times = [[float(value) for value in subprocess.run([sys.executable, '-c', worker_script, spec_path, model_dir],
+                                                       capture_output=True, text=True, check=True).stdout.split()[-2:]]
+             for _ in range(repeats)]
+    return min(times, key=sum)
+
+if __name__ == "__main__":
+    num_boost_round = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    work_dir = tempfile.mkdtemp()
+    cache_dir = os.path.join(work_dir, 'cache')
+    sklearn_archive, xgboost_archive = write_artifacts(work_dir, num_boost_round)
+    print(f'Booster with {num_boost_round} rounds, artifacts of '
+          f'{os.path.getsize(sklearn_archive) / 1024:.0f} KB and {os.path.getsize(xgboost_archive) / 1024:.0f} KB')
+
+    print(f'load_models with subprocess tar:     {time_call(load_models_subprocess, sklearn_archive, xgboost_archive, work_dir):6.3f} s')
+    print(f'load_models, empty artifact cache:   {time_call(load_models_cached, sklearn_archive, xgboost_archive, cache_dir):6.3f} s')
+    print(f'load_models, warm artifact cache:    {time_call(load_models_cached, sklearn_archive, xgboost_archive, cache_dir):6.3f} s')
+
+    # Fused model directory: sklearn_model.joblib, featurizer.npz and xgboost_model.bin
+    model_dir = os.path.join(work_dir, 'fused_model')
+    os.makedirs(model_dir)
+    for name in ['sklearn_model', 'xgboost_model']:
+        for file_name in os.listdir(os.path.join(work_dir, name)):
+            shutil.copy(os.path.join(work_dir, name, file_name), model_dir)
+
+    for name, spec in [('joblib and load_model', get_joblib_model_spec()), ('fused model spec', get_fused_model_spec())]:
+        unpickle_time, load_time = time_worker_start(spec, model_dir, work_dir)
+        print(f'worker start, {name + ":":<22} {unpickle_time + load_time:6.3f} s '
+              f'(imports and unpickling {unpickle_time:.3f} s, model load {load_time:.3f} s)')
+
+    shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,36 @@
+import io
+import sys
+
+import pandas as pd
+
+from deploy import get_sklearn_request_translator
+from benchmark_utils import make_synthetic_csv_rows, time_calls, print_latency_summary
+
+feature_columns_names = ['Type', 'Air temperature [K]', 'Process temperature [K]', 'Rotational speed [rpm]', 'Torque [Nm]', 'Tool wear [min]']
+
+# The per-request parsing done by the translator before the fast parser was added
+def parse_with_pandas(payload):
+    df = pd.read_csv(io.BytesIO(payload), header=None)
+    df.columns = feature_columns_names
+    return df
+
+def run_benchmark(num_requests, rows_per_request):
+    translator = get_sklearn_request_translator()
+    rows = make_synthetic_csv_rows(num_requests * rows_per_request)
+    payloads = [("\n".join(rows[i:i + rows_per_request]) + "\n").encode("utf-8")
+                for i in range(0, len(rows), rows_per_request)]
+
+    print(f'{rows_per_request} row(s) per request')
+    latencies = time_calls(parse_with_pandas, [(payload,) for payload in payloads])
+    print_latency_summary('pandas.read_csv', latencies)
+    latencies = time_calls(translator._parse_csv, [(payload,) for payload in payloads])
+    print_latency_summary('fast parser (arrays)', latencies)
+    latencies = time_calls(lambda payload: translator.deserialize_payload_from_stream(io.BytesIO(payload)),
+                           [(payload,) for payload in payloads])
+    print_latency_summary('fast parser (dataframe)', latencies)
+    print('')
+
+if __name__ == "__main__":
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    for rows_per_request in [1, 10, 100]:
+        run_benchmark(num_requests, rows_per_request)
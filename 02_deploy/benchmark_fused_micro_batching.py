@@ -0,0 +1,63 @@
+import io
+import os
+import sys
+import time
+import tempfile
+
+import joblib
+import cloudpickle
+
+from concurrent.futures import ThreadPoolExecutor
+
+import compiled_featurizer
+from deploy import get_sklearn_request_translator, get_fused_model_spec
+from benchmark_utils import fit_synthetic_models, make_synthetic_csv_rows
+
+# Micro-batching in the fused model as the container runs it: the spec is pickled
+# and loaded with the MICRO_BATCH_* variables that build_fused_sagemaker_model
+# passes on, then invoked either one request at a time, which is how a TorchServe
+# worker calls it, or from concurrent threads. Prints the throughput and the batch
+# sizes and queue waits that the container writes to its logs.
+
+def write_model_dir(model_dir):
+    featurizer, booster = fit_synthetic_models(num_boost_round=100)
+    joblib.dump(featurizer, os.path.join(model_dir, 'sklearn_model.joblib'))
+    compiled_featurizer.save_compiled_featurizer(compiled_featurizer.compile_featurizer(featurizer),
+                                                 os.path.join(model_dir, 'featurizer.npz'))
+    booster.save_model(os.path.join(model_dir, 'xgboost_model.bin'))
+
+def run(model_dir, payloads, max_batch_size, concurrency):
+    os.environ['MICRO_BATCH_MAX_SIZE'] = str(max_batch_size)
+    os.environ['MICRO_BATCH_REPORT_EVERY'] = '0'
+    spec = cloudpickle.loads(cloudpickle.dumps(get_fused_model_spec()))
+    model = spec.load(model_dir)
+    translator = get_sklearn_request_translator(as_dataframe=False)
+
+    def invoke(payload):
+        return spec.invoke(translator.deserialize_payload_from_stream(io.BytesIO(payload)), model)
+
+    start = time.perf_counter()
+    if concurrency == 1:
+        for payload in payloads:
+            invoke(payload)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(invoke, payloads))
+    elapsed = time.perf_counter() - start
+
+    line = f'max batch {max_batch_size:4d}, concurrency {concurrency:3d}: {len(payloads) / elapsed:8.0f} requests/s'
+    if spec.batcher is not None:
+        metrics = spec.batcher.metrics()
+        line += (f'   mean batch {metrics["mean_batch_requests"]:6.1f} requests'
+                 f'   queue wait mean {metrics["mean_queue_wait_ms"]:.3f} ms, max {metrics["max_queue_wait_ms"]:.3f} ms')
+    print(line)
+
+if __name__ == "__main__":
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    model_dir = tempfile.mkdtemp()
+    write_model_dir(model_dir)
+    payloads = [(row + "\n").encode("utf-8") for row in make_synthetic_csv_rows(num_requests, seed=1)]
+
+    for concurrency in [1, 32]:
+        for max_batch_size in [0, 64]:
+            run(model_dir, payloads, max_batch_size, concurrency)
@@ -0,0 +1,66 @@
+import io
+import os
+import sys
+import tempfile
+
+import joblib
+import numpy as np
+
+from deploy import get_sklearn_request_translator, get_xgboost_request_translator, get_fused_model_spec
+from benchmark_utils import fit_synthetic_models, make_synthetic_csv_rows, time_calls, print_latency_summary
+
+def to_npy_bytes(np_array):
+    buffer = io.BytesIO()
+    np.save(buffer, np_array)
+    return buffer.getvalue()
+
+# Emulates the PipelineModel: the featurizer container returns .npy bytes which
+# are deserialized again by the XGBoost container. The network hop between the
+# two containers is not included, so the real saving is larger than reported
+def two_stage_predict(payload, featurizer, booster, sklearn_translator, xgboost_translator):
+    df = sklearn_translator.deserialize_payload_from_stream(io.BytesIO(payload))
+    features = featurizer.transform(df)
+    dmatrix = xgboost_translator.deserialize_payload_from_stream(io.BytesIO(to_npy_bytes(features)))
+    return to_npy_bytes(booster.predict(dmatrix))
+
+def fused_predict(payload, model, fused_translator, fused_spec):
+    parsed = fused_translator.deserialize_payload_from_stream(io.BytesIO(payload))
+    return to_npy_bytes(fused_spec.invoke(parsed, model))
+
+def run_benchmark(model_dir, num_requests, rows_per_request):
+    featurizer = joblib.load(os.path.join(model_dir, 'sklearn_model.joblib'))
+    fused_spec = get_fused_model_spec()
+    model = fused_spec.load(model_dir)
+    booster = model["booster"]
+
+    sklearn_translator = get_sklearn_request_translator()
+    xgboost_translator = get_xgboost_request_translator()
+    fused_translator = get_sklearn_request_translator(as_dataframe=False)
+
+    rows = make_synthetic_csv_rows(num_requests * rows_per_request, seed=1)
+    payloads = [("\n".join(rows[i:i + rows_per_request]) + "\n").encode("utf-8")
+                for i in range(0, len(rows), rows_per_request)]
+
+    two_stage = np.load(io.BytesIO(two_stage_predict(payloads[0], featurizer, booster, sklearn_translator, xgboost_translator)))
+    fused = np.load(io.BytesIO(fused_predict(payloads[0], model, fused_translator, fused_spec)))
+    assert np.allclose(two_stage, fused), "Fused predictor does not match the two-stage chain"
+
+    print(f'{rows_per_request} row(s) per request')
+    latencies = time_calls(two_stage_predict, [(payload, featurizer, booster, sklearn_translator, xgboost_translator) for payload in payloads])
+    print_latency_summary('two-stage chain (without network hop)', latencies)
+    latencies = time_calls(fused_predict, [(payload, model, fused_translator, fused_spec) for payload in payloads])
+    print_latency_summary('fused predictor', latencies)
+    print('')
+
+if __name__ == "__main__":
+    # Optionally pass a directory holding sklearn_model.joblib and xgboost_model.bin
+    if len(sys.argv) > 1:
+        model_dir = sys.argv[1]
+    else:
+        model_dir = tempfile.mkdtemp()
+        featurizer, booster = fit_synthetic_models()
+        joblib.dump(featurizer, os.path.join(model_dir, 'sklearn_model.joblib'))
+        booster.save_model(os.path.join(model_dir, 'xgboost_model.bin'))
+
+    for rows_per_request in [1, 100]:
+        run_benchmark(model_dir, num_requests=2000, rows_per_request=rows_per_request)
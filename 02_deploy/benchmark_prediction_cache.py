@@ -0,0 +1,51 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+import compiled_featurizer
+from local_server import LocalPipelineModel
+from benchmark_utils import fit_synthetic_models, make_synthetic_csv_rows, time_calls, print_latency_summary
+
+# Single-row requests from a fleet of machines that keep reporting the same
+# readings, with a small jitter below the cache quantum on some of them. Compares
+# the local pipeline model with and without the prediction cache.
+
+def write_model_dirs(work_dir):
+    featurizer, booster = fit_synthetic_models()
+    sklearn_model_dir = os.path.join(work_dir, 'sklearn_model')
+    xgboost_model_dir = os.path.join(work_dir, 'xgboost_model')
+    os.makedirs(sklearn_model_dir)
+    os.makedirs(xgboost_model_dir)
+    compiled_featurizer.save_compiled_featurizer(compiled_featurizer.compile_featurizer(featurizer),
+                                                 os.path.join(sklearn_model_dir, 'featurizer.npz'))
+    booster.save_model(os.path.join(xgboost_model_dir, 'xgboost_model.bin'))
+    return sklearn_model_dir, xgboost_model_dir
+
+def make_fleet_payloads(num_machines, num_requests, jitter, seed=0):
+    rng = np.random.default_rng(seed)
+    readings = [row.split(',') for row in make_synthetic_csv_rows(num_machines, seed)]
+    payloads = []
+    for machine in rng.integers(0, num_machines, num_requests):
+        row = readings[machine]
+        air_temperature = float(row[1]) + rng.uniform(-jitter, jitter)
+        payloads.append(f'{row[0]},{air_temperature:.4f},{",".join(row[2:])}\n'.encode('utf-8'))
+    return payloads
+
+if __name__ == "__main__":
+    num_machines = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    num_requests = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+    work_dir = tempfile.mkdtemp()
+    sklearn_model_dir, xgboost_model_dir = write_model_dirs(work_dir)
+    payloads = make_fleet_payloads(num_machines, num_requests, jitter=0.004)
+
+    print(f'{num_requests} single-row requests from {num_machines} machines')
+    for name, cache_size in [('without prediction cache', 0), ('with prediction cache', 10000)]:
+        model = LocalPipelineModel(sklearn_model_dir, xgboost_model_dir, prediction_cache_size=cache_size)
+        latencies = time_calls(model.predict, [(payload,) for payload in payloads])
+        print_latency_summary(name, latencies)
+        if model.cache is not None:
+            metrics = model.cache.metrics()
+            print(f'{"":<40} hit rate: {metrics["hit_rate"]:.3f}   entries: {metrics["entries"]}')
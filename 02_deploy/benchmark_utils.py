@@ -0,0 +1,72 @@
+import time
+
+import numpy as np
+import pandas as pd
+import xgboost
+
+from sklearn.preprocessing import StandardScaler, OneHotEncoder
+from sklearn.compose import ColumnTransformer
+
+feature_columns_names = ['Type', 'Air temperature [K]', 'Process temperature [K]', 'Rotational speed [rpm]', 'Torque [Nm]', 'Tool wear [min]']
+
+def make_synthetic_features(n_rows, n_features=8, seed=0):
+    rng = np.random.default_rng(seed)
+    features = rng.standard_normal((n_rows, n_features))
+    # Last three columns mimic the one-hot encoded 'Type'
+    if n_features >= 3:
+        features[:, -3:] = 0.0
+        features[np.arange(n_rows), n_features - 3 + rng.integers(0, 3, n_rows)] = 1.0
+    return features
+
+def make_synthetic_csv_rows(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    types = rng.choice(['L', 'M', 'H'], n_rows)
+    air_temperature = rng.normal(300.0, 2.0, n_rows)
+    process_temperature = air_temperature + rng.normal(10.0, 1.0, n_rows)
+    rotational_speed = rng.normal(1540, 180, n_rows).astype(int)
+    torque = rng.normal(40.0, 10.0, n_rows)
+    tool_wear = rng.integers(0, 250, n_rows)
+    return [f'{t},{a:.1f},{p:.1f},{r},{q:.1f},{w}'
+            for t, a, p, r, q, w in zip(types, air_temperature, process_temperature, rotational_speed, torque, tool_wear)]
+
+def train_synthetic_booster(n_rows=10000, n_features=8, num_boost_round=5, max_depth=8, seed=0):
+    rng = np.random.default_rng(seed)
+    features = make_synthetic_features(n_rows, n_features, seed)
+    labels = (features[:, 0] + 0.5 * features[:, 3] + 0.3 * rng.standard_normal(n_rows) > 1.5).astype(int)
+    dtrain = xgboost.DMatrix(features, label=labels)
+    params = {"max_depth": max_depth, "eta": 0.3, "objective": "binary:logistic", "verbosity": 0}
+    return xgboost.train(params=params, dtrain=dtrain, num_boost_round=num_boost_round)
+
+def make_synthetic_dataframe(n_rows, seed=0):
+    rows = [row.split(',') for row in make_synthetic_csv_rows(n_rows, seed)]
+    df = pd.DataFrame(rows, columns=feature_columns_names)
+    df[feature_columns_names[1:]] = df[feature_columns_names[1:]].astype(np.float64)
+    return df
+
+# Fits the same ColumnTransformer as the preprocessing step, and a booster on its output
+def fit_synthetic_models(n_rows=10000, num_boost_round=5, max_depth=8, seed=0):
+    df = make_synthetic_dataframe(n_rows, seed)
+    transformer = ColumnTransformer(transformers=[('numeric', StandardScaler(), feature_columns_names[1:]),
+                                                  ('categorical', OneHotEncoder(), feature_columns_names[:1])],
+                                    remainder='passthrough')
+    featurizer = transformer.fit(df)
+    features = featurizer.transform(df)
+
+    rng = np.random.default_rng(seed)
+    labels = (features[:, 3] + features[:, 4] + 0.5 * rng.standard_normal(n_rows) > 2.0).astype(int)
+    dtrain = xgboost.DMatrix(features, label=labels)
+    params = {"max_depth": max_depth, "eta": 0.3, "objective": "binary:logistic", "verbosity": 0}
+    booster = xgboost.train(params=params, dtrain=dtrain, num_boost_round=num_boost_round)
+    return featurizer, booster
+
+def time_calls(func, args_list):
+    latencies = np.empty(len(args_list))
+    for i, args in enumerate(args_list):
+        start = time.perf_counter()
+        func(*args)
+        latencies[i] = time.perf_counter() - start
+    return latencies
+
+def print_latency_summary(name, latencies):
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    print(f'{name:<40} p50: {p50:8.3f} ms   p99: {p99:8.3f} ms   ({len(latencies)} requests)')
@@ -0,0 +1,69 @@
+import numpy as np
+
+# The featurizer fitted in preprocess() is a ColumnTransformer with a StandardScaler
+# on the numeric columns followed by a OneHotEncoder on 'Type'. Compiling it into
+# mean/scale vectors and a sorted category table lets inference featurize rows with
+# a handful of NumPy operations instead of going through ColumnTransformer.transform.
+
+def compile_featurizer(featurizer_model, sample_df=None):
+    transformers = {name: (transformer, columns) for name, transformer, columns in featurizer_model.transformers_}
+    scaler, numeric_columns = transformers['numeric']
+    encoder, categorical_columns = transformers['categorical']
+
+    if 'remainder' in transformers and len(transformers['remainder'][1]) > 0:
+        raise ValueError(f"Cannot compile a featurizer with remainder columns {transformers['remainder'][1]}")
+    if not (scaler.with_mean and scaler.with_std):
+        raise ValueError("Cannot compile a StandardScaler fitted without with_mean or with_std")
+    if len(categorical_columns) != 1 or encoder.drop is not None:
+        raise ValueError("Cannot compile a OneHotEncoder with several columns or dropped categories")
+
+    compiled_featurizer = {
+        "numeric_columns": np.array(numeric_columns, dtype=str),
+        "categorical_column": np.array(categorical_columns[0], dtype=str),
+        "mean": np.asarray(scaler.mean_, dtype=np.float64),
+        "scale": np.asarray(scaler.scale_, dtype=np.float64),
+        "categories": np.array(encoder.categories_[0], dtype=str),
+    }
+
+    # Optionally check the compiled featurizer against the fitted one
+    if sample_df is not None:
+        expected = featurizer_model.transform(sample_df)
+        if not np.array_equal(apply_compiled_featurizer_to_dataframe(compiled_featurizer, sample_df), expected):
+            raise ValueError("Compiled featurizer output does not match the fitted featurizer")
+
+    return compiled_featurizer
+
+def save_compiled_featurizer(compiled_featurizer, path):
+    with open(path, 'wb') as file:
+        np.savez(file, **compiled_featurizer)
+    return path
+
+def load_compiled_featurizer(path):
+    with np.load(path, allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+def apply_compiled_featurizer(compiled_featurizer, types, numeric):
+    categories = compiled_featurizer["categories"]
+    num_rows, num_numeric = numeric.shape
+
+    types = np.asarray(types).astype(str)
+    category_index = np.searchsorted(categories, types)
+    category_index[category_index == len(categories)] = 0
+    unknown = categories[category_index] != types
+    if unknown.any():
+        raise ValueError(f"Found unknown categories {np.unique(types[unknown]).tolist()} in column "
+                         f"'{compiled_featurizer['categorical_column']}'")
+
+    # Same operations, in the same order, as StandardScaler.transform so the
+    # output is bit-identical, followed by the one-hot block
+    features = np.zeros((num_rows, num_numeric + len(categories)), dtype=np.float64)
+    scaled = features[:, :num_numeric]
+    np.subtract(numeric, compiled_featurizer["mean"], out=scaled)
+    np.divide(scaled, compiled_featurizer["scale"], out=scaled)
+    features[np.arange(num_rows), num_numeric + category_index] = 1.0
+    return features
+
+def apply_compiled_featurizer_to_dataframe(compiled_featurizer, df):
+    types = df[str(compiled_featurizer["categorical_column"])].to_numpy()
+    numeric = df[compiled_featurizer["numeric_columns"].tolist()].to_numpy(dtype=np.float64)
+    return apply_compiled_featurizer(compiled_featurizer, types, numeric)
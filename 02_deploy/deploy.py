@@ -1,7 +1,8 @@
 import io
 import os
+import time
 import joblib
-import subprocess
+import cloudpickle
 
 import xgboost
 import numpy as np
@@ -11,7 +12,6 @@ import boto3
 
 import sagemaker
 from sagemaker import get_execution_role
-from sagemaker.s3 import S3Downloader
 from sagemaker.pipeline import PipelineModel
 from sagemaker.utils import unique_name_from_base
 from sagemaker.image_uris import retrieve as get_image_uri
@@ -22,6 +22,21 @@ from sagemaker.serve.builder.model_builder import ModelBuilder
 from sagemaker.serve.builder.schema_builder import SchemaBuilder
 from sagemaker.serve import CustomPayloadTranslator
 
+import artifact_cache
+import latency_metrics
+import micro_batching
+import prediction_cache
+import compiled_featurizer
+
+# Ship the compiled featurizer, artifact cache, latency metrics, micro-batching and
+# prediction cache code with the pickled inference specs, since these modules are
+# not installed in the inference containers
+cloudpickle.register_pickle_by_value(artifact_cache)
+cloudpickle.register_pickle_by_value(latency_metrics)
+cloudpickle.register_pickle_by_value(micro_batching)
+cloudpickle.register_pickle_by_value(prediction_cache)
+cloudpickle.register_pickle_by_value(compiled_featurizer)
+
 session = boto3.session.Session()
 current_region = session.region_name
 
@@ -50,29 +65,24 @@ def get_model_artifacts_for_last_job(job_name_prefix):
     return search_response['Results'][0]['TrainingJob']['ModelArtifacts']['S3ModelArtifacts']
 
 def load_models(sklearn_job_prefix, xgboost_job_prefix):
-    subprocess.call(['rm', '-rf', 'sklearn_model/'])
-    subprocess.call(['rm', '-rf', 'xgboost_model/'])
-    
     sklearn_s3_model_artifacts = get_model_artifacts_for_last_job(sklearn_job_prefix)
     print(f"SKLearn S3 model artifacts: {sklearn_s3_model_artifacts}")
     xgboost_s3_model_artifacts = get_model_artifacts_for_last_job(xgboost_job_prefix)
     print(f"XGBoost S3 model artifacts: {xgboost_s3_model_artifacts}")
 
-    print(S3Downloader.download(sklearn_s3_model_artifacts, "sklearn_model/"))
-    print(S3Downloader.download(xgboost_s3_model_artifacts, "xgboost_model/"))
-
-    subprocess.call(['tar', '-xvzf', 'sklearn_model/model.tar.gz', '-C', 'sklearn_model/'])
-    subprocess.call(['rm', 'sklearn_model/model.tar.gz'])
-    subprocess.call(['tar', '-xvzf', 'xgboost_model/model.tar.gz', '-C', 'xgboost_model/'])
-    subprocess.call(['rm', 'xgboost_model/model.tar.gz'])
+    # Both artifacts are downloaded and extracted concurrently, and reused from the
+    # local artifact cache when their ETag did not change
+    start_time = time.perf_counter()
+    sklearn_model_dir, xgboost_model_dir = artifact_cache.fetch_artifacts(
+        [sklearn_s3_model_artifacts, xgboost_s3_model_artifacts])
 
-    featurizer = joblib.load('sklearn_model/sklearn_model.joblib')
-    booster = xgboost.Booster()
-    booster.load_model('xgboost_model/xgboost_model.bin')
+    featurizer = joblib.load(os.path.join(sklearn_model_dir, 'sklearn_model.joblib'))
+    booster = artifact_cache.load_booster(os.path.join(xgboost_model_dir, 'xgboost_model.bin'))
+    print(f"Models loaded in {time.perf_counter() - start_time:.2f} s")
 
     return featurizer, booster
 
-def build_sklearn_sagemaker_model(role, featurizer, project_prefix):
+def get_sklearn_request_translator(as_dataframe=True):
     feature_columns_names = ['Type', 'Air temperature [K]', 'Process temperature [K]', 'Rotational speed [rpm]', 'Torque [Nm]', 'Tool wear [min]']
     
     class SklearnRequestTranslator(CustomPayloadTranslator):
@@ -82,30 +92,98 @@ def build_sklearn_sagemaker_model(role, featurizer, project_prefix):
             
         # Converts the request byte stream to dataframe - runs on the server side
         def deserialize_payload_from_stream(self, stream) -> pd.DataFrame:
-            df = pd.read_csv(io.BytesIO(stream.read()), header=None)
-            df.columns = feature_columns_names
-            return df
-    
+            start = time.perf_counter()
+            parsed = self._deserialize(stream.read())
+            latency_metrics.observe('featurizer_deserialize', time.perf_counter() - start)
+            return parsed
+
+        def _deserialize(self, payload: bytes):
+            parsed = self._parse_csv(payload)
+            if parsed is None:
+                df = pd.read_csv(io.BytesIO(payload), header=None)
+                df.columns = feature_columns_names
+                if as_dataframe:
+                    return df
+                parsed = (df[feature_columns_names[0]].to_numpy(dtype=object),
+                          df[feature_columns_names[1:]].to_numpy(dtype=np.float64))
+            if not as_dataframe:
+                return parsed
+            types, numeric = parsed
+            return pd.DataFrame(dict(zip(feature_columns_names, [types, *numeric.T])))
+
+        # Fast path for the fixed schema: one categorical 'Type' followed by five
+        # numeric columns per line. Returns None when the payload does not match
+        # that layout (e.g. quoted fields), so the caller can fall back to pandas
+        def _parse_csv(self, payload: bytes):
+            if isinstance(payload, bytes):
+                payload = payload.decode("utf-8")
+            if '"' in payload:
+                return None
+            lines = [line for line in payload.splitlines() if line]
+            num_rows = len(lines)
+            num_columns = len(feature_columns_names)
+            cells = ",".join(lines).split(",")
+            if num_rows == 0 or len(cells) != num_rows * num_columns:
+                return None
+            
+            types = np.empty(num_rows, dtype=object)
+            numeric = np.empty((num_rows, num_columns - 1), dtype=np.float64)
+            grid = np.array(cells, dtype=object).reshape((num_rows, num_columns))
+            types[:] = grid[:, 0]
+            try:
+                numeric[:] = grid[:, 1:]
+            except ValueError:
+                return None
+            return types, numeric
+
+    return SklearnRequestTranslator()
+
+def get_sklearn_model_spec():
+
     class SklearnModelSpec(InferenceSpec):
+        # Featurizes with the compiled featurizer (see compiled_featurizer.py),
+        # which matches ColumnTransformer.transform without its DataFrame overhead
         def invoke(self, input_object: object, model: object):
-            features = model.transform(input_object)
+            start = time.perf_counter()
+            features = self._invoke(input_object, model)
+            latency_metrics.observe('featurizer_invoke', time.perf_counter() - start)
             return features
+
+        def _invoke(self, input_object, model):
+            if isinstance(input_object, pd.DataFrame):
+                return compiled_featurizer.apply_compiled_featurizer_to_dataframe(model, input_object)
+            types, numeric = input_object
+            featurize = lambda types, numeric: compiled_featurizer.apply_compiled_featurizer(model, types, numeric)
+            if self.cache is None:
+                return featurize(types, numeric)
+            return self.cache.predict(types, numeric, featurize)
     
         def load(self, model_dir: str):
+            # Optional cache of feature rows, enabled with PREDICTION_CACHE_SIZE
+            self.cache = prediction_cache.get_prediction_cache()
+            artifact_path = model_dir + '/featurizer.npz'
+            if os.path.exists(artifact_path):
+                return compiled_featurizer.load_compiled_featurizer(artifact_path)
             model_path = model_dir+'/sklearn_model.joblib'
             print(model_path)
             model = joblib.load(model_path)
-            return model
+            return compiled_featurizer.compile_featurizer(model)
+
+    return SklearnModelSpec()
+
+def build_sklearn_sagemaker_model(role, featurizer, project_prefix):
     
     schema_builder=SchemaBuilder(
         sample_input="L,298.4,308.2,1582,70.7,216",
         sample_output=np.array([0.647088,0.467287,-0.191472,0.720195,-0.536976,0.0,1.0,0.0]),
-        input_translator=SklearnRequestTranslator()
+        input_translator=get_sklearn_request_translator(as_dataframe=False)
     )
 
     model_file_path="sklearn_model/sklearn_model.joblib"
     os.makedirs(os.path.dirname(model_file_path), exist_ok=True)
     joblib.dump(featurizer, model_file_path)
+    compiled_featurizer.save_compiled_featurizer(
+        compiled_featurizer.compile_featurizer(featurizer), "sklearn_model/featurizer.npz")
 
 
     bucket_name = sagemaker.Session().default_bucket()
@@ -118,31 +196,56 @@ def build_sklearn_sagemaker_model(role, featurizer, project_prefix):
         image_uri=get_image_uri(framework="sklearn", region=current_region, version="1.2-1"),
         schema_builder=schema_builder,
         model_server=ModelServer.TORCHSERVE,
-        inference_spec=SklearnModelSpec(),
+        inference_spec=get_sklearn_model_spec(),
+        env_vars={**prediction_cache.get_cache_env_vars(), **latency_metrics.get_latency_env_vars()},
         role_arn=role,
         s3_model_data_url=bucket_prefix)
     
     return model_builder.build()
 
-def build_xgboost_sagemaker_model(role, booster, project_prefix):
+def get_xgboost_request_translator():
 
     class RequestTranslator(CustomPayloadTranslator):
-        # Convert the request dataframe to bytes - runs on the client side
+        # Convert the request array(s) to bytes - runs on the client side.
+        # A list of arrays is sent as a stream of concatenated .npy arrays
         def serialize_payload_to_bytes(self, payload: object) -> bytes:
             buffer = io.BytesIO()
-            np.save(buffer, payload)
+            if isinstance(payload, (list, tuple)):
+                for np_array in payload:
+                    np.save(buffer, np_array)
+            else:
+                np.save(buffer, payload)
             return buffer.getvalue()
             
         # Convert the byte stream to XGBoost data matrix - runs on the server side
         def deserialize_payload_from_stream(self, stream) -> xgboost.DMatrix:
-            np_array = np.load(io.BytesIO(stream.read())).reshape((1, -1))
+            start = time.perf_counter()
+            np_array = self._load_rows(stream.read())
             dmatrix = xgboost.DMatrix(np_array)
+            latency_metrics.observe('xgboost_deserialize', time.perf_counter() - start)
             return dmatrix
 
+        # Accepts a single feature row, an N x 8 batch, or several arrays saved
+        # back to back, and returns all rows as one 2-D array
+        def _load_rows(self, payload: bytes) -> np.ndarray:
+            if not payload:
+                raise ValueError("Empty request payload: expected one or more arrays saved with np.save")
+            buffer = io.BytesIO(payload)
+            arrays = []
+            while buffer.tell() < len(payload):
+                arrays.append(np.atleast_2d(np.load(buffer)))
+            if len(arrays) == 1:
+                return arrays[0]
+            return np.concatenate(arrays)
+
+    return RequestTranslator()
+
+def build_xgboost_sagemaker_model(role, booster, project_prefix):
+
     schema_builder=SchemaBuilder(
         sample_input=np.array([0.647088,0.467287,-0.191472,0.720195,-0.536976,0.0,1.0,0.0]),
         sample_output=np.array([0.15388985]),
-        input_translator=RequestTranslator()
+        input_translator=get_xgboost_request_translator()
     )
 
     model_file_path = 'xgboost_model/xgboost_model.bin'
@@ -157,6 +260,7 @@ def build_xgboost_sagemaker_model(role, booster, project_prefix):
         model_path="xgboost_model/",
         dependencies={"requirements": "requirements_inference.txt"},
         schema_builder=schema_builder,
+        env_vars=latency_metrics.get_latency_env_vars(),
         role_arn=role,
         s3_model_data_url=bucket_prefix,
         image_uri=get_image_uri(framework="xgboost", region=current_region, version="1.7-1")
@@ -164,6 +268,76 @@ def build_xgboost_sagemaker_model(role, booster, project_prefix):
 
     return model_builder.build()
 
+def get_fused_model_spec():
+
+    class FusedModelSpec(InferenceSpec):
+        # Featurizes the parsed (types, numeric) arrays and scores them with the
+        # booster in the same process, instead of chaining two containers
+        def invoke(self, input_object: object, model: object):
+            types, numeric = input_object
+
+            def predict(types, numeric):
+                start = time.perf_counter()
+                features = compiled_featurizer.apply_compiled_featurizer(model["featurizer"], types, numeric)
+                featurized = time.perf_counter()
+                # With MICRO_BATCH_MAX_SIZE, concurrent requests share one booster call
+                if self.batcher is None:
+                    predictions = model["booster"].inplace_predict(features)
+                else:
+                    predictions = self.batcher.predict(features)
+                latency_metrics.observe('featurizer_invoke', featurized - start)
+                latency_metrics.observe('xgboost_predict', time.perf_counter() - featurized)
+                return predictions
+
+            # Rows already scored recently skip the featurizer and the booster
+            if self.cache is None:
+                return predict(types, numeric)
+            return self.cache.predict(types, numeric, predict)
+
+        def load(self, model_dir: str):
+            # Optional cache of predictions, enabled with PREDICTION_CACHE_SIZE
+            self.cache = prediction_cache.get_prediction_cache()
+            booster = artifact_cache.load_booster(model_dir + '/xgboost_model.bin')
+            # Optional micro-batching of the booster calls, enabled with MICRO_BATCH_MAX_SIZE
+            self.batcher = micro_batching.get_micro_batcher(booster.inplace_predict)
+            return {
+                "featurizer": get_sklearn_model_spec().load(model_dir),
+                "booster": booster,
+            }
+
+    return FusedModelSpec()
+
+def build_fused_sagemaker_model(role, featurizer, booster, project_prefix):
+    schema_builder=SchemaBuilder(
+        sample_input="L,298.4,308.2,1582,70.7,216",
+        sample_output=np.array([0.15388985]),
+        input_translator=get_sklearn_request_translator(as_dataframe=False)
+    )
+
+    os.makedirs("fused_model/", exist_ok=True)
+    joblib.dump(featurizer, "fused_model/sklearn_model.joblib")
+    compiled_featurizer.save_compiled_featurizer(
+        compiled_featurizer.compile_featurizer(featurizer), "fused_model/featurizer.npz")
+    booster.save_model("fused_model/xgboost_model.bin")
+
+    bucket_name = sagemaker.Session().default_bucket()
+    bucket_prefix = f"s3://{bucket_name}/{project_prefix}"
+
+    model_builder = ModelBuilder(
+        model_path="fused_model/",
+        name="fused_featurizer_xgboost",
+        dependencies={"requirements": "requirements_inference.txt"},
+        image_uri=get_image_uri(framework="sklearn", region=current_region, version="1.2-1"),
+        schema_builder=schema_builder,
+        model_server=ModelServer.TORCHSERVE,
+        inference_spec=get_fused_model_spec(),
+        env_vars={**prediction_cache.get_cache_env_vars(), **latency_metrics.get_latency_env_vars(),
+                  **micro_batching.get_micro_batch_env_vars()},
+        role_arn=role,
+        s3_model_data_url=bucket_prefix)
+
+    return model_builder.build()
+
 def build_pipeline_model(role, project_prefix, sklearn_model, xgboost_model):
     pipeline_model_name = unique_name_from_base(f"{project_prefix}-sm-btd-pipeline-model")
 
@@ -194,9 +368,14 @@ if __name__ == "__main__":
 
     featurizer, booster = load_models(sklearn_job_prefix, xgboost_job_prefix)
     
-    sklearn_model = build_sklearn_sagemaker_model(role, featurizer, project_prefix)
-    xgboost_model = build_xgboost_sagemaker_model(role, booster, project_prefix)
+    if os.getenv('FUSED_MODEL', '0').lower() in ('1', 'true', 'yes'):
+        # Single container running featurizer and booster in the same process
+        fused_model = build_fused_sagemaker_model(role, featurizer, booster, project_prefix)
+        deploy_model(fused_model, project_prefix, "ml.m5.xlarge", wait=False)
+    else:
+        sklearn_model = build_sklearn_sagemaker_model(role, featurizer, project_prefix)
+        xgboost_model = build_xgboost_sagemaker_model(role, booster, project_prefix)
 
-    pipeline_model = build_pipeline_model(role, project_prefix, sklearn_model, xgboost_model)
+        pipeline_model = build_pipeline_model(role, project_prefix, sklearn_model, xgboost_model)
 
-    deploy_model(pipeline_model, project_prefix, "ml.m5.xlarge", wait=False)
\ No newline at end of file
+        deploy_model(pipeline_model, project_prefix, "ml.m5.xlarge", wait=False)
\ No newline at end of file
@@ -0,0 +1,204 @@
+import os
+import sys
+import json
+import time
+import socket
+import threading
+
+import numpy as np
+
+# Per-stage latency histograms for the inference hot path (request parsing,
+# featurizing, deserialization, tree evaluation). The translators and specs call
+#
+#   start = time.perf_counter()
+#   ...
+#   latency_metrics.observe('featurizer_invoke', time.perf_counter() - start)
+#
+# which costs a bucket index computation and an increment. The histograms can be
+# exported in the Prometheus text format (local_server.py serves them on
+# GET /metrics) or as CloudWatch Embedded Metric Format (EMF) events every
+# LATENCY_METRICS_EMF_INTERVAL seconds (60 by default, 0 to disable).
+#
+# CloudWatch only extracts metrics from log events that are bare EMF JSON. The
+# model server of the deployed endpoints (TorchServe) prefixes every line its
+# workers write to stdout or stderr, so in the containers the EMF events must be
+# sent to a CloudWatch agent listening for EMF: set LATENCY_METRICS_EMF_ENDPOINT
+# to its address (tcp://host:port or udp://host:port, the agent's default is
+# tcp://127.0.0.1:25888). Without an endpoint the events are written to stdout,
+# which only yields metrics where stdout reaches CloudWatch unchanged.
+#
+# The registry is created on first use in the serving process. This module is
+# pickled by value with the inference specs, so a registry that already exists
+# at that point is pickled empty.
+
+class LatencyHistogram:
+    # HDR-style histogram of latencies in microseconds: each power of two is split
+    # into sub_buckets linear buckets, so every recorded value is known to within
+    # 1/sub_buckets of its magnitude, from 1 us up to about a minute
+    sub_bucket_bits = 4
+    sub_buckets = 1 << sub_bucket_bits
+    max_exponent = 22
+
+    def __init__(self):
+        # A list, since incrementing a Python int is cheaper than a NumPy element
+        self.counts = [0] * ((self.max_exponent + 2) * self.sub_buckets)
+        self.sum = 0.0
+
+    def index(self, microseconds):
+        exponent = max(0, microseconds.bit_length() - self.sub_bucket_bits - 1)
+        if exponent > self.max_exponent:
+            return len(self.counts) - 1
+        return exponent * self.sub_buckets + (microseconds >> exponent)
+
+    def bucket_bounds(self):
+        # Lower and upper bound in microseconds of every bucket
+        indices = np.arange(len(self.counts))
+        exponents = np.maximum(indices // self.sub_buckets - 1, 0)
+        lower = (indices - exponents * self.sub_buckets) << exponents
+        return lower, lower + (1 << exponents)
+
+    def record(self, seconds):
+        self.counts[self.index(int(seconds * 1e6))] += 1
+        self.sum += seconds
+
+    def count(self):
+        return sum(self.counts)
+
+    def percentiles(self, quantiles, counts=None):
+        # Upper bound of the bucket holding each quantile, in seconds
+        counts = np.asarray(self.counts if counts is None else counts)
+        total = counts.sum()
+        if total == 0:
+            return [0.0 for _ in quantiles]
+        cumulative = np.cumsum(counts)
+        _, upper = self.bucket_bounds()
+        return [float(upper[np.searchsorted(cumulative, max(1, np.ceil(q * total)))]) / 1e6 for q in quantiles]
+
+    def cumulative_counts(self, boundaries):
+        # Number of values at or below each boundary (seconds), for Prometheus buckets
+        lower, _ = self.bucket_bounds()
+        cumulative = np.cumsum(self.counts)
+        positions = np.searchsorted(lower, np.asarray(boundaries) * 1e6, side='left')
+        return [int(cumulative[position - 1]) if position > 0 else 0 for position in positions]
+
+class LatencyMetrics:
+    prometheus_buckets = [0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                          0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+    quantiles = [0.5, 0.9, 0.99, 0.999]
+
+    def __init__(self, emf_interval=60.0, namespace='SageMakerBTD/Inference', emf_endpoint=None):
+        self.emf_interval = emf_interval
+        self.namespace = namespace
+        self.emf_endpoint = emf_endpoint
+        self._histograms = {}
+        self._emitted_counts = {}
+        self._emitted_sums = {}
+        self._lock = threading.Lock()
+        self._next_emf = time.monotonic() + emf_interval
+
+    def __reduce__(self):
+        # Locks cannot be pickled, and the recorded latencies are of no use elsewhere
+        return LatencyMetrics, (self.emf_interval, self.namespace, self.emf_endpoint)
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = LatencyHistogram()
+            histogram.record(seconds)
+        if self.emf_interval > 0 and time.monotonic() >= self._next_emf:
+            self._next_emf = time.monotonic() + self.emf_interval
+            self.emit_emf(self.to_emf())
+
+    def emit_emf(self, lines):
+        if not lines:
+            return
+        if not self.emf_endpoint:
+            sys.stdout.write(''.join(line + '\n' for line in lines))
+            sys.stdout.flush()
+            return
+        # The agent reads one EMF event per line
+        protocol, address = self.emf_endpoint.split('://', 1)
+        host, port = address.rsplit(':', 1)
+        try:
+            if protocol == 'udp':
+                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as connection:
+                    for line in lines:
+                        connection.sendto((line + '\n').encode('utf-8'), (host, int(port)))
+            else:
+                with socket.create_connection((host, int(port)), timeout=1.0) as connection:
+                    connection.sendall(''.join(line + '\n' for line in lines).encode('utf-8'))
+        except OSError as e:
+            print(f'Could not send latency metrics to {self.emf_endpoint}: {e}')
+
+    def summary(self):
+        with self._lock:
+            return {stage: dict(zip(['p50', 'p90', 'p99', 'p999'], histogram.percentiles(self.quantiles)),
+                                count=histogram.count(), sum=histogram.sum)
+                    for stage, histogram in self._histograms.items()}
+
+    def to_prometheus(self, name='inference_stage_latency_seconds'):
+        lines = [f'# HELP {name} Latency of each inference stage',
+                 f'# TYPE {name} histogram']
+        quantile_lines = [f'# HELP {name}_quantile Latency quantiles of each inference stage',
+                          f'# TYPE {name}_quantile gauge']
+        with self._lock:
+            for stage, histogram in sorted(self._histograms.items()):
+                labels = f'stage="{stage}"'
+                for boundary, count in zip(self.prometheus_buckets, histogram.cumulative_counts(self.prometheus_buckets)):
+                    lines.append(f'{name}_bucket{{{labels},le="{boundary}"}} {count}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count()}')
+                lines.append(f'{name}_sum{{{labels}}} {histogram.sum:.9f}')
+                lines.append(f'{name}_count{{{labels}}} {histogram.count()}')
+                for quantile, value in zip(self.quantiles, histogram.percentiles(self.quantiles)):
+                    quantile_lines.append(f'{name}_quantile{{{labels},quantile="{quantile}"}} {value:.9f}')
+        return '\n'.join(lines + quantile_lines) + '\n'
+
+    def to_emf(self):
+        # One EMF line per stage with the quantiles of the latencies recorded since
+        # the previous call, so each CloudWatch datapoint covers one interval
+        lines = []
+        timestamp = int(time.time() * 1000)
+        with self._lock:
+            for stage, histogram in sorted(self._histograms.items()):
+                counts = np.asarray(histogram.counts) - self._emitted_counts.get(stage, 0)
+                total = int(counts.sum())
+                if total == 0:
+                    continue
+                interval_sum = histogram.sum - self._emitted_sums.get(stage, 0.0)
+                self._emitted_counts[stage] = np.asarray(histogram.counts)
+                self._emitted_sums[stage] = histogram.sum
+                p50, p90, p99, p999 = histogram.percentiles(self.quantiles, counts)
+                metrics = {"LatencyP50": p50 * 1000, "LatencyP90": p90 * 1000, "LatencyP99": p99 * 1000,
+                           "LatencyP999": p999 * 1000, "LatencyMean": interval_sum / total * 1000}
+                lines.append(json.dumps({
+                    "_aws": {
+                        "Timestamp": timestamp,
+                        "CloudWatchMetrics": [{
+                            "Namespace": self.namespace,
+                            "Dimensions": [["Stage"]],
+                            "Metrics": [{"Name": metric, "Unit": "Milliseconds"} for metric in metrics]
+                                       + [{"Name": "Count", "Unit": "Count"}],
+                        }],
+                    },
+                    "Stage": stage,
+                    "Count": total,
+                    **metrics,
+                }))
+        return lines
+
+_registry = None
+
+def get_latency_metrics():
+    global _registry
+    if _registry is None:
+        _registry = LatencyMetrics(emf_interval=float(os.environ.get('LATENCY_METRICS_EMF_INTERVAL', 60)),
+                                   emf_endpoint=os.environ.get('LATENCY_METRICS_EMF_ENDPOINT'))
+    return _registry
+
+def observe(stage, seconds):
+    get_latency_metrics().observe(stage, seconds)
+
+def get_latency_env_vars():
+    # LATENCY_METRICS_* variables of the deploying environment, passed on to the container
+    return {name: value for name, value in os.environ.items() if name.startswith('LATENCY_METRICS_')}
@@ -0,0 +1,140 @@
+import sys
+import json
+import time
+import random
+import itertools
+import argparse
+import threading
+import http.client
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ThreadPoolExecutor
+
+# Load generator for the inference endpoint. Requests go either to a SageMaker
+# endpoint through a shared sagemaker-runtime client, or to any HTTP URL serving
+# /invocations (such as a locally served PipelineModel) through one keep-alive
+# connection per thread. Latencies are measured from the scheduled send time, so
+# a server that falls behind the requested rate shows up in the percentiles.
+
+feature_columns_names = ['Type', 'Air temperature [K]', 'Process temperature [K]', 'Rotational speed [rpm]', 'Torque [Nm]', 'Tool wear [min]']
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--endpoint-name', help='SageMaker endpoint name')
+    target.add_argument('--url', help='HTTP URL of an /invocations route, e.g. http://localhost:8080/invocations')
+    payloads = parser.add_mutually_exclusive_group()
+    payloads.add_argument('--payloads', help='JSONL file with one {"body": ..., "content_type": ...} request per line')
+    payloads.add_argument('--dataset', help='CSV dataset with a header row to sample request rows from')
+    parser.add_argument('--rows-per-request', default=1, type=int)
+    parser.add_argument('--concurrency', default=8, type=int)
+    parser.add_argument('--rate', default=0.0, type=float, help='Requests per second for all threads, 0 for as fast as possible')
+    parser.add_argument('--duration', default=30.0, type=float, help='Seconds to run for')
+    parser.add_argument('--requests', default=0, type=int, help='Number of requests to send, instead of --duration')
+    parser.add_argument('--seed', default=0, type=int)
+    return parser.parse_args()
+
+def load_payloads(args):
+    if args.payloads:
+        with open(args.payloads) as file:
+            requests = [json.loads(line) for line in file if line.strip()]
+        return [(request['body'], request.get('content_type', 'text/csv')) for request in requests]
+
+    if args.dataset:
+        rows = pd.read_csv(args.dataset)[feature_columns_names].to_csv(header=False, index=False).splitlines()
+    else:
+        rows = ["L,298.4,308.2,1582,70.7,216", "M,298.4,308.2,1582,30.2,214"]
+    rng = random.Random(args.seed)
+    return [('\n'.join(rng.choice(rows) for _ in range(args.rows_per_request)), 'text/csv') for _ in range(1000)]
+
+def get_http_invoker(url):
+    parsed_url = urllib.parse.urlparse(url)
+    connection_class = http.client.HTTPSConnection if parsed_url.scheme == 'https' else http.client.HTTPConnection
+    local = threading.local()
+
+    def invoke(body, content_type):
+        if getattr(local, 'connection', None) is None:
+            local.connection = connection_class(parsed_url.netloc, timeout=60)
+        try:
+            local.connection.request('POST', parsed_url.path or '/', body=body, headers={'Content-Type': content_type})
+            response = local.connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            local.connection.close()
+            local.connection = None
+            raise
+        if response.status != 200:
+            raise RuntimeError(f'HTTP {response.status}')
+    return invoke
+
+def get_endpoint_invoker(endpoint_name, concurrency):
+    import boto3
+    from botocore.config import Config
+
+    client = boto3.client('sagemaker-runtime', config=Config(max_pool_connections=concurrency, retries={'max_attempts': 0}))
+
+    def invoke(body, content_type):
+        client.invoke_endpoint(EndpointName=endpoint_name, Body=body, ContentType=content_type)['Body'].read()
+    return invoke
+
+def run_load_test(invoke, payloads, concurrency=8, rate=0.0, duration=30.0, num_requests=0):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(num_requests)) if num_requests else itertools.count()
+    start_time = time.perf_counter()
+    end_time = start_time + duration if not num_requests else float('inf')
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            scheduled_time = start_time + i / rate if rate else time.perf_counter()
+            if scheduled_time >= end_time:
+                return
+            delay = scheduled_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            body, content_type = payloads[i % len(payloads)]
+            try:
+                invoke(body, content_type)
+                latency = time.perf_counter() - scheduled_time
+                with lock:
+                    latencies.append(latency)
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(worker)
+    elapsed = time.perf_counter() - start_time
+    return np.array(latencies), errors, elapsed
+
+def print_report(latencies, errors, elapsed):
+    print(f'Requests: {len(latencies)} succeeded, {len(errors)} failed in {elapsed:.1f} s')
+    print(f'Throughput: {len(latencies) / elapsed:.1f} requests/s')
+    if len(latencies):
+        p50, p90, p99, p999 = np.percentile(latencies, [50, 90, 99, 99.9]) * 1000
+        print(f'Latency p50: {p50:.2f} ms   p90: {p90:.2f} ms   p99: {p99:.2f} ms   p999: {p999:.2f} ms   max: {latencies.max() * 1000:.2f} ms')
+    for error in sorted(set(errors))[:5]:
+        print(f'Error: {error} ({errors.count(error)} times)')
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    payloads = load_payloads(args)
+    if args.url:
+        invoke = get_http_invoker(args.url)
+    else:
+        invoke = get_endpoint_invoker(args.endpoint_name, args.concurrency)
+
+    print(f'Sending requests with concurrency {args.concurrency}' + (f' at {args.rate} requests/s' if args.rate else ''))
+    latencies, errors, elapsed = run_load_test(invoke, payloads, args.concurrency, args.rate, args.duration, args.requests)
+    print_report(latencies, errors, elapsed)
+    sys.exit(1 if errors and not len(latencies) else 0)
@@ -0,0 +1,195 @@
+import io
+import time
+import argparse
+
+import xgboost
+import numpy as np
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from deploy import get_sklearn_request_translator, get_sklearn_model_spec, get_xgboost_request_translator
+from micro_batching import MicroBatcher
+from artifact_cache import load_booster
+from prediction_cache import PredictionCache
+import latency_metrics
+
+# Serves the featurizer and the XGBoost model on a laptop the same way the
+# PipelineModel chains its two containers: the featurizer container parses the
+# CSV request and returns the features as .npy bytes, which the XGBoost container
+# deserializes again before predicting. Each response carries a Server-Timing
+# header with the time spent in every stage.
+#
+# GET /metrics returns the latency histogram of every stage in the Prometheus
+# text format (see latency_metrics.py).
+#
+# With --max-batch-size, concurrent requests share one XGBoost predict call
+# through a MicroBatcher (see micro_batching.py), and GET /metrics also returns
+# the achieved batch sizes and queue waits.
+#
+# With --prediction-cache-size, rows seen recently (within --prediction-cache-quantum
+# per reading) are answered from a PredictionCache (see prediction_cache.py) without
+# running the chain, and GET /metrics also returns the cache hit rate.
+#
+#   python local_server.py --sklearn-model-dir sklearn_model/ --xgboost-model-dir xgboost_model/
+#   curl -i -H "Content-Type: text/csv" -d "L,298.4,308.2,1582,70.7,216" http://localhost:8080/invocations
+
+def to_npy_bytes(np_array):
+    buffer = io.BytesIO()
+    np.save(buffer, np_array)
+    return buffer.getvalue()
+
+class LocalPipelineModel:
+    def __init__(self, sklearn_model_dir, xgboost_model_dir, max_batch_size=0, max_batch_delay_ms=2.0,
+                 prediction_cache_size=0, prediction_cache_ttl=300.0, prediction_cache_quantum=0.01):
+        # Same translators and inference spec as build_sklearn_sagemaker_model and
+        # build_xgboost_sagemaker_model, loading the artifacts they write
+        self.sklearn_translator = get_sklearn_request_translator(as_dataframe=False)
+        self.sklearn_spec = get_sklearn_model_spec()
+        self.featurizer = self.sklearn_spec.load(sklearn_model_dir.rstrip('/'))
+
+        self.xgboost_translator = get_xgboost_request_translator()
+        self.booster = load_booster(xgboost_model_dir.rstrip('/') + '/xgboost_model.bin')
+
+        self.batcher = None
+        if max_batch_size > 0:
+            self.batcher = MicroBatcher(lambda rows: self.booster.predict(xgboost.DMatrix(rows)),
+                                        max_batch_size=max_batch_size, max_delay_ms=max_batch_delay_ms)
+
+        self.cache = None
+        if prediction_cache_size > 0:
+            self.cache = PredictionCache(max_entries=prediction_cache_size, ttl_seconds=prediction_cache_ttl,
+                                         quantum=prediction_cache_quantum)
+
+    def predict(self, payload):
+        timings = []
+        start = time.perf_counter()
+
+        # Stages the translators and specs already time themselves are not observed again
+        def record(name, observe=True):
+            nonlocal start
+            now = time.perf_counter()
+            timings.append((name, now - start))
+            if observe:
+                latency_metrics.observe(name.replace('-', '_'), now - start)
+            start = now
+
+        # Featurizer container
+        parsed = self.sklearn_translator.deserialize_payload_from_stream(io.BytesIO(payload))
+        record('featurizer-deserialize', observe=False)
+
+        if self.cache is None:
+            predictions = self._score(parsed, record)
+        else:
+            predictions = self.cache.predict(*parsed, lambda types, numeric: self._score((types, numeric), record))
+            record('prediction-cache')
+        response = to_npy_bytes(predictions)
+        record('xgboost-serialize')
+
+        return response, timings
+
+    def _score(self, parsed, record):
+        features = self.sklearn_spec.invoke(parsed, self.featurizer)
+        record('featurizer-invoke', observe=False)
+        features_payload = to_npy_bytes(features)
+        record('featurizer-serialize')
+
+        # XGBoost container
+        if self.batcher is None:
+            dmatrix = self.xgboost_translator.deserialize_payload_from_stream(io.BytesIO(features_payload))
+            record('xgboost-deserialize', observe=False)
+            predictions = self.booster.predict(dmatrix)
+            record('xgboost-predict')
+        else:
+            rows = self.xgboost_translator._load_rows(features_payload)
+            record('xgboost-deserialize')
+            predictions = self.batcher.predict(rows)
+            record('xgboost-batched-predict')
+        return predictions
+
+    def metrics(self):
+        # Prometheus text format: stage latency histograms, then batcher and cache gauges
+        lines = [latency_metrics.get_latency_metrics().to_prometheus()]
+        if self.batcher is not None:
+            lines.append(format_gauges('micro_batcher', self.batcher.metrics()))
+        if self.cache is not None:
+            lines.append(format_gauges('prediction_cache', self.cache.metrics()))
+        return ''.join(lines)
+
+def format_gauges(prefix, metrics):
+    return ''.join(f'# TYPE {prefix}_{name} gauge\n{prefix}_{name} {value}\n' for name, value in metrics.items())
+
+def get_request_handler(model):
+
+    class InvocationsHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Buffer the headers and the body so each response goes out in one write
+        wbufsize = -1
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            if self.path == '/ping':
+                self._respond(200, b'', 'text/plain')
+            elif self.path == '/metrics':
+                self._respond(200, model.metrics().encode('utf-8'), 'text/plain; version=0.0.4')
+            else:
+                self._respond(404, b'Not found', 'text/plain')
+
+        def do_POST(self):
+            payload = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if self.path != '/invocations':
+                self._respond(404, b'Not found', 'text/plain')
+                return
+            start = time.perf_counter()
+            try:
+                response, timings = model.predict(payload)
+            except Exception as e:
+                self._respond(400, str(e).encode('utf-8'), 'text/plain')
+                return
+            latency_metrics.observe('request', time.perf_counter() - start)
+            server_timing = ', '.join(f'{name};dur={seconds * 1000:.3f}' for name, seconds in timings)
+            self._respond(200, response, 'application/x-npy', {'Server-Timing': server_timing})
+
+        def _respond(self, status, body, content_type, headers={}):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return InvocationsHandler
+
+class LocalServer(ThreadingHTTPServer):
+    # The default listen backlog of 5 drops connections when many clients connect at once
+    request_queue_size = 128
+    daemon_threads = True
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sklearn-model-dir', default='sklearn_model/')
+    parser.add_argument('--xgboost-model-dir', default='xgboost_model/')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', default=8080, type=int)
+    parser.add_argument('--max-batch-size', default=0, type=int, help='Rows per batched XGBoost predict, 0 to disable batching')
+    parser.add_argument('--max-batch-delay-ms', default=2.0, type=float)
+    parser.add_argument('--prediction-cache-size', default=0, type=int, help='Rows kept in the prediction cache, 0 to disable caching')
+    parser.add_argument('--prediction-cache-ttl', default=300.0, type=float, help='Seconds before a cached prediction expires')
+    parser.add_argument('--prediction-cache-quantum', default=0.01, type=float, help='Readings are rounded to this step in the cache key')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    model = LocalPipelineModel(args.sklearn_model_dir, args.xgboost_model_dir,
+                               args.max_batch_size, args.max_batch_delay_ms, args.prediction_cache_size,
+                               args.prediction_cache_ttl, args.prediction_cache_quantum)
+    server = LocalServer((args.host, args.port), get_request_handler(model))
+    print(f'Serving the pipeline model on http://{args.host}:{args.port}/invocations')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import queue
+import threading
+
+import numpy as np
+
+from concurrent.futures import Future
+
+# Dynamic batching in front of a vectorized predict function. Concurrent requests
+# submit their feature rows and wait on a future; a background thread collects
+# requests until it has max_batch_size rows, the oldest request has waited
+# max_delay_ms or every caller currently waiting is already in the batch, runs one predict on the concatenated rows and scatters the
+# predictions back to the futures. Requests with a different number of columns
+# are predicted separately, so a malformed request only fails itself.
+#
+# local_server.py and the fused model (FusedModelSpec in deploy.py) use it. In the
+# fused model it is enabled with MICRO_BATCH_MAX_SIZE, and the achieved batch sizes
+# and queue waits are written to the logs every MICRO_BATCH_REPORT_EVERY batches.
+
+class MicroBatcher:
+    def __init__(self, predict_fn, max_batch_size=256, max_delay_ms=2.0, report_every=0):
+        self.predict_fn = predict_fn
+        self.report_every = report_every
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._num_batches = 0
+        self._num_requests = 0
+        self._num_rows = 0
+        self._max_batch_rows = 0
+        self._queue_wait_sum = 0.0
+        self._queue_wait_max = 0.0
+        # Requests submitted and not answered yet
+        self._pending = 0
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, rows):
+        future = Future()
+        rows = np.atleast_2d(rows)
+        if rows.ndim != 2:
+            future.set_exception(ValueError(f'Expected a 1-D or 2-D array of features, got {rows.ndim} dimensions'))
+            return future
+        with self._lock:
+            self._pending += 1
+        self._queue.put((rows, future, time.perf_counter()))
+        return future
+
+    def predict(self, rows):
+        return self.submit(rows).result()
+
+    def _collect(self):
+        # Blocks for the first request, then waits for more until the batch is
+        # full or the first request has been queued for max_delay. A caller that
+        # sends one request at a time is answered without waiting, since no other
+        # request can join its batch
+        requests = [self._queue.get()]
+        num_rows = len(requests[0][0])
+        deadline = requests[0][2] + self.max_delay
+        while num_rows < self.max_batch_size and len(requests) < self._pending:
+            timeout = deadline - time.perf_counter()
+            try:
+                request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            requests.append(request)
+            num_rows += len(request[0])
+        return requests, num_rows
+
+    def _run(self):
+        while True:
+            requests, num_rows = self._collect()
+            start = time.perf_counter()
+            groups = {}
+            for request in requests:
+                groups.setdefault(request[0].shape[1], []).append(request)
+            for group in groups.values():
+                self._predict_group(group)
+
+            queue_waits = [start - queued_time for _, _, queued_time in requests]
+            with self._lock:
+                self._num_batches += 1
+                self._num_requests += len(requests)
+                self._num_rows += num_rows
+                self._max_batch_rows = max(self._max_batch_rows, num_rows)
+                self._queue_wait_sum += sum(queue_waits)
+                self._queue_wait_max = max(self._queue_wait_max, max(queue_waits))
+                num_batches = self._num_batches
+            if self.report_every and num_batches % self.report_every == 0:
+                print(f'Micro-batcher: {json.dumps(self.metrics())}')
+
+    def _predict_group(self, requests):
+        # requests all have the same number of columns. They stop counting as pending
+        # before they are answered, so a caller's next request is not held back
+        with self._lock:
+            self._pending -= len(requests)
+        try:
+            batch = requests[0][0] if len(requests) == 1 else np.concatenate([rows for rows, _, _ in requests])
+            predictions = self.predict_fn(batch)
+            offset = 0
+            for rows, future, _ in requests:
+                future.set_result(predictions[offset:offset + len(rows)])
+                offset += len(rows)
+        except Exception as e:
+            for _, future, _ in requests:
+                future.set_exception(e)
+
+    def metrics(self):
+        with self._lock:
+            num_batches = max(self._num_batches, 1)
+            num_requests = max(self._num_requests, 1)
+            return {
+                "batches": self._num_batches,
+                "requests": self._num_requests,
+                "rows": self._num_rows,
+                "mean_batch_rows": self._num_rows / num_batches,
+                "mean_batch_requests": self._num_requests / num_batches,
+                "max_batch_rows": self._max_batch_rows,
+                "mean_queue_wait_ms": self._queue_wait_sum / num_requests * 1000,
+                "max_queue_wait_ms": self._queue_wait_max * 1000,
+            }
+
+def get_micro_batcher(predict_fn):
+    # Batcher configured from the container environment, or None when disabled
+    max_batch_size = int(os.environ.get('MICRO_BATCH_MAX_SIZE', 0))
+    if max_batch_size <= 0:
+        return None
+    return MicroBatcher(predict_fn, max_batch_size=max_batch_size,
+                        max_delay_ms=float(os.environ.get('MICRO_BATCH_MAX_DELAY_MS', 2.0)),
+                        report_every=int(os.environ.get('MICRO_BATCH_REPORT_EVERY', 1000)))
+
+def get_micro_batch_env_vars():
+    # MICRO_BATCH_* variables of the deploying environment, passed on to the container
+    return {name: value for name, value in os.environ.items() if name.startswith('MICRO_BATCH_')}
@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import threading
+
+import numpy as np
+
+from collections import OrderedDict
+
+# Cache of model outputs keyed on the raw feature row (Type and the five numeric
+# readings). Machines often report the same or nearly the same readings for long
+# periods, so the numeric values are rounded to a multiple of `quantum` before
+# they become part of the key: readings within the tolerance share one entry.
+# Entries expire after ttl_seconds and the least recently used entry is evicted
+# once the cache holds max_entries rows.
+#
+# The inference specs create the cache in load() when PREDICTION_CACHE_SIZE is
+# set in the container environment (see get_prediction_cache).
+
+class PredictionCache:
+    def __init__(self, max_entries=100000, ttl_seconds=300.0, quantum=0.01, report_every=0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.quantum = np.asarray(quantum, dtype=np.float64)
+        self.report_every = report_every
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def keys(self, types, numeric):
+        # Canonical key per row: the Type string and the quantized readings as bytes
+        quantized = np.rint(np.asarray(numeric, dtype=np.float64) / self.quantum).astype(np.int64)
+        quantized = np.ascontiguousarray(quantized)
+        row_bytes = quantized.view(np.dtype((np.void, quantized.dtype.itemsize * quantized.shape[1]))).ravel()
+        return [(str(row_type), key.tobytes()) for row_type, key in zip(types, row_bytes)]
+
+    def lookup(self, keys):
+        # Returns the cached value of every key (None on a miss)
+        now = time.monotonic()
+        values = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] < now:
+                    del self._entries[key]
+                    self._expirations += 1
+                    entry = None
+                if entry is None:
+                    self._misses += 1
+                    values.append(None)
+                else:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    values.append(entry[0])
+            num_lookups = self._hits + self._misses
+        if self.report_every and num_lookups // self.report_every != (num_lookups - len(keys)) // self.report_every:
+            print(f'Prediction cache: {json.dumps(self.metrics())}')
+        return values
+
+    def store(self, keys, values):
+        expiry = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            for key, value in zip(keys, values):
+                self._entries[key] = (value, expiry)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def predict(self, types, numeric, predict_fn):
+        # Runs predict_fn(types, numeric) only on the rows that miss the cache and
+        # returns the outputs of all rows in request order
+        if len(types) == 0:
+            return predict_fn(types, numeric)
+        keys = self.keys(types, numeric)
+        values = self.lookup(keys)
+        misses = [i for i, value in enumerate(values) if value is None]
+        if not misses:
+            return np.stack(values)
+
+        if len(misses) == len(values):
+            outputs = predict_fn(types, numeric)
+        else:
+            outputs = predict_fn(np.asarray(types)[misses], np.asarray(numeric)[misses])
+        self.store([keys[i] for i in misses], outputs)
+        if len(misses) == len(values):
+            return outputs
+
+        for i, output in zip(misses, outputs):
+            values[i] = output
+        return np.stack(values)
+
+    def metrics(self):
+        with self._lock:
+            num_lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / num_lookups if num_lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
+
+def get_prediction_cache():
+    # Cache configured from the container environment, or None when disabled
+    max_entries = int(os.environ.get('PREDICTION_CACHE_SIZE', 0))
+    if max_entries <= 0:
+        return None
+    return PredictionCache(max_entries=max_entries,
+                           ttl_seconds=float(os.environ.get('PREDICTION_CACHE_TTL', 300)),
+                           quantum=float(os.environ.get('PREDICTION_CACHE_QUANTUM', 0.01)),
+                           report_every=int(os.environ.get('PREDICTION_CACHE_REPORT_EVERY', 10000)))
+
+def get_cache_env_vars():
+    # PREDICTION_CACHE_* variables of the deploying environment, passed on to the container
+    return {name: value for name, value in os.environ.items() if name.startswith('PREDICTION_CACHE_')}
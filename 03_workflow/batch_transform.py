@@ -0,0 +1,215 @@
+import io
+import os
+import time
+import tarfile
+import argparse
+import tempfile
+
+import numpy as np
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from steps.preprocess import columns, target_column
+from steps.lazy_imports import lazy_import
+
+pd = lazy_import('pandas')
+boto3 = lazy_import('boto3')
+xgboost = lazy_import('xgboost')
+
+# Offline scoring of a whole fleet snapshot with the featurizer and booster that
+# register() packages, instead of sending it row by row to the real-time endpoint.
+#
+# Local mode streams the CSV or Parquet input in chunks of --chunk-rows, scores
+# the chunks in a process pool and writes one output shard per chunk:
+#
+#   python batch_transform.py --input-data fleet.csv --output-path scores/ --model-package-arn <arn>
+#   python batch_transform.py --input-data fleet.parquet --output-path scores/ \
+#       --sklearn-model-dir sklearn_model/ --xgboost-model-dir xgboost_model/
+#
+# SageMaker mode submits the same model package as a SageMaker Batch Transform job.
+# The input must be headerless CSV with the six feature columns, as for the endpoint:
+#
+#   python batch_transform.py --mode sagemaker --model-package-arn <arn> \
+#       --input-data s3://bucket/fleet/ --output-path s3://bucket/scores/
+
+feature_columns = [column for column in columns if column != target_column]
+
+def get_model_data_urls(model_package_arn):
+    # model.tar.gz of the featurizer and of the XGBoost container, in pipeline order
+    sagemaker_client = boto3.client("sagemaker")
+    response = sagemaker_client.describe_model_package(ModelPackageName=model_package_arn)
+    return [container["ModelDataUrl"] for container in response["InferenceSpecification"]["Containers"]]
+
+def download_model_artifacts(model_package_arn, model_dir):
+    model_dirs = []
+    for i, model_data_url in enumerate(get_model_data_urls(model_package_arn)):
+        bucket, key = model_data_url[len('s3://'):].split('/', 1)
+        body = boto3.client("s3").get_object(Bucket=bucket, Key=key)["Body"].read()
+        container_dir = os.path.join(model_dir, f'container_{i}')
+        with tarfile.open(fileobj=io.BytesIO(body), mode='r:gz') as archive:
+            if hasattr(tarfile, 'data_filter'):
+                archive.extractall(container_dir, filter='data')
+            else:
+                archive.extractall(container_dir)
+        model_dirs.append(container_dir)
+    return model_dirs
+
+def list_input_files(input_data):
+    import fsspec
+
+    fs, path = fsspec.core.url_to_fs(input_data)
+    protocol = input_data.split('://')[0] + '://' if '://' in input_data else ''
+    if fs.isdir(path):
+        paths = sorted(fs.glob(f'{path.rstrip("/")}/*.csv') + fs.glob(f'{path.rstrip("/")}/*.parquet'))
+    else:
+        paths = sorted(fs.glob(path))
+    return [protocol + path for path in paths]
+
+def read_chunks(input_paths, chunk_rows, keep_columns):
+    # Yields DataFrames of at most chunk_rows rows with the feature columns and the
+    # columns to copy to the output, without loading a whole file
+    usecols = feature_columns + [column for column in keep_columns if column not in feature_columns]
+    for input_path in input_paths:
+        if input_path.endswith('.parquet'):
+            import fsspec
+            import pyarrow.parquet as pq
+
+            with fsspec.open(input_path, 'rb') as file:
+                parquet_file = pq.ParquetFile(file)
+                for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=usecols):
+                    yield batch.to_pandas()
+        else:
+            for df in pd.read_csv(input_path, usecols=usecols, chunksize=chunk_rows):
+                yield df
+
+_worker_model = {}
+
+def _init_worker(sklearn_model_dir, xgboost_model_dir, nthread):
+    from steps.register import get_sklearn_model_spec
+
+    # Same inference spec as the featurizer container of the endpoint
+    spec = get_sklearn_model_spec()
+    booster = xgboost.Booster()
+    booster.load_model(os.path.join(xgboost_model_dir, 'xgboost_model.bin'))
+    booster.set_param('nthread', nthread)
+    _worker_model["spec"] = spec
+    _worker_model["featurizer"] = spec.load(sklearn_model_dir.rstrip('/'))
+    _worker_model["booster"] = booster
+    _worker_model["decision_threshold"] = float(booster.attr('decision_threshold') or 0.5)
+
+def _score_chunk(chunk_index, df, output_path, output_format, keep_columns):
+    spec, booster = _worker_model["spec"], _worker_model["booster"]
+    features = spec.invoke(df[feature_columns], _worker_model["featurizer"])
+    scores = booster.inplace_predict(features)
+
+    output_df = df[keep_columns].reset_index(drop=True)
+    output_df['score'] = scores
+    output_df['predicted_failure'] = (scores > _worker_model["decision_threshold"]).astype(np.int8)
+
+    shard_path = f'{output_path.rstrip("/")}/part-{chunk_index:05d}.{output_format}'
+    if output_format == 'parquet':
+        output_df.to_parquet(shard_path, index=False)
+    else:
+        output_df.to_csv(shard_path, index=False)
+    return chunk_index, len(output_df)
+
+def transform_local(input_data, output_path, sklearn_model_dir, xgboost_model_dir, chunk_rows=100000,
+                    max_workers=None, output_format='csv', keep_columns=()):
+    max_workers = max_workers or os.cpu_count()
+    nthread = max(1, os.cpu_count() // max_workers)
+    keep_columns = list(keep_columns)
+    if '://' not in output_path:
+        os.makedirs(output_path, exist_ok=True)
+
+    input_paths = list_input_files(input_data)
+    print(f'Scoring {len(input_paths)} input file(s) in chunks of {chunk_rows} rows with {max_workers} workers')
+
+    start = time.perf_counter()
+    num_rows = 0
+    num_shards = 0
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(sklearn_model_dir, xgboost_model_dir, nthread)) as executor:
+        # At most two chunks per worker are in flight, so memory stays bounded
+        # however large the input is
+        pending = deque()
+        for chunk_index, df in enumerate(read_chunks(input_paths, chunk_rows, keep_columns)):
+            if len(pending) >= 2 * max_workers:
+                num_rows += pending.popleft().result()[1]
+                num_shards += 1
+            pending.append(executor.submit(_score_chunk, chunk_index, df, output_path, output_format, keep_columns))
+        while pending:
+            num_rows += pending.popleft().result()[1]
+            num_shards += 1
+
+    elapsed = time.perf_counter() - start
+    print(f'Scored {num_rows} rows into {num_shards} shard(s) in {output_path} '
+          f'in {elapsed:.1f} s ({num_rows / max(elapsed, 1e-9):.0f} rows/s)')
+    return num_rows
+
+def transform_sagemaker(role, model_package_arn, input_data, output_path, instance_type="ml.c5.xlarge",
+                        instance_count=1, max_payload_mb=6, wait=True):
+    from sagemaker.model import ModelPackage
+
+    model_package = ModelPackage(role=role, model_package_arn=model_package_arn)
+
+    # Each mini-batch of CSV lines goes through the featurizer and the XGBoost
+    # container, which returns the predictions as .npy bytes. The outputs are
+    # assembled without separators, so load_transform_output() can read them back
+    transformer = model_package.transformer(
+        instance_count=instance_count,
+        instance_type=instance_type,
+        strategy="MultiRecord",
+        max_payload=max_payload_mb,
+        assemble_with="None",
+        accept="application/x-npy",
+        output_path=output_path)
+
+    transformer.transform(data=input_data, content_type="text/csv", split_type="Line", wait=wait)
+    print(f'Batch Transform job {transformer.latest_transform_job.name} writes to {output_path}')
+    return transformer
+
+def load_transform_output(payload):
+    # Scores of a Batch Transform output file: the .npy arrays of all mini-batches back to back
+    buffer = io.BytesIO(payload)
+    arrays = []
+    while buffer.tell() < len(payload):
+        arrays.append(np.atleast_1d(np.load(buffer)))
+    return np.concatenate(arrays) if arrays else np.empty(0, dtype=np.float32)
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', default='local', choices=['local', 'sagemaker'])
+    parser.add_argument('--input-data', required=True, help='CSV or Parquet file, glob or directory, local or s3://')
+    parser.add_argument('--output-path', required=True)
+    parser.add_argument('--model-package-arn', default=None)
+    parser.add_argument('--sklearn-model-dir', default='sklearn_model/')
+    parser.add_argument('--xgboost-model-dir', default='xgboost_model/')
+    parser.add_argument('--chunk-rows', default=100000, type=int)
+    parser.add_argument('--max-workers', default=None, type=int)
+    parser.add_argument('--output-format', default='csv', choices=['csv', 'parquet'])
+    parser.add_argument('--keep-columns', default='', help='Comma separated input columns copied to the output, e.g. UDI')
+    parser.add_argument('--instance-type', default='ml.c5.xlarge')
+    parser.add_argument('--instance-count', default=1, type=int)
+    parser.add_argument('--no-wait', action='store_true')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.mode == 'sagemaker':
+        from sagemaker import get_execution_role
+
+        if args.model_package_arn is None:
+            raise ValueError('--model-package-arn is required in sagemaker mode')
+        transform_sagemaker(get_execution_role(), args.model_package_arn, args.input_data, args.output_path,
+                            instance_type=args.instance_type, instance_count=args.instance_count, wait=not args.no_wait)
+    else:
+        with tempfile.TemporaryDirectory() as model_dir:
+            sklearn_model_dir, xgboost_model_dir = args.sklearn_model_dir, args.xgboost_model_dir
+            if args.model_package_arn is not None:
+                sklearn_model_dir, xgboost_model_dir = download_model_artifacts(args.model_package_arn, model_dir)
+            keep_columns = [column for column in args.keep_columns.split(',') if column]
+            transform_local(args.input_data, args.output_path, sklearn_model_dir, xgboost_model_dir,
+                            chunk_rows=args.chunk_rows, max_workers=args.max_workers,
+                            output_format=args.output_format, keep_columns=keep_columns)
@@ -0,0 +1,48 @@
+import os
+import sys
+import argparse
+import subprocess
+
+# Import time of each step module, measured with python -X importtime in a fresh
+# interpreter. Exits with an error when a module exceeds the budget, so it can be
+# used as a regression guard for the lazy imports in the steps package.
+
+step_modules = ['steps.preprocess', 'steps.train', 'steps.test', 'steps.tune',
+                'steps.register', 'steps.deploy', 'steps.metrics']
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('modules', nargs='*', default=step_modules)
+    parser.add_argument('--budget-ms', default=500.0, type=float, help='Maximum cumulative import time per module')
+    parser.add_argument('--repeats', default=3, type=int)
+    parser.add_argument('--top', default=3, type=int, help='Number of heaviest imports to show per module')
+    return parser.parse_args()
+
+def measure_import(module):
+    # Returns the cumulative import time of the module and of everything it imported, in ms
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True).stderr
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports[name.strip()] = int(cumulative) / 1000.0
+    return imports[module], imports
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    over_budget = []
+    for module in args.modules:
+        measurements = [measure_import(module) for _ in range(args.repeats)]
+        total, imports = min(measurements, key=lambda measurement: measurement[0])
+        heaviest = sorted(((ms, name) for name, ms in imports.items() if name != module and '.' not in name), reverse=True)[:args.top]
+        print(f'{module:<20} {total:8.1f} ms   ' + ', '.join(f'{name} {ms:.0f} ms' for ms, name in heaviest))
+        if total > args.budget_ms:
+            over_budget.append(module)
+
+    if over_budget:
+        print(f'Over the {args.budget_ms:.0f} ms budget: {", ".join(over_budget)}')
+        sys.exit(1)
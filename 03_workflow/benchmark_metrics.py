@@ -0,0 +1,49 @@
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from sklearn.metrics import roc_auc_score
+from sklearn.metrics import accuracy_score
+from sklearn.metrics import precision_score
+from sklearn.metrics import recall_score
+
+from steps.metrics import binary_classification_metrics
+
+# Compares the metrics engine used by the Train and Evaluate steps with the
+# separate pd.crosstab and sklearn metric calls it replaces
+
+def sklearn_metrics(y_true, y_score):
+    rounded_predict = np.round(y_score)
+    crosstab = pd.crosstab(index=y_true, columns=rounded_predict, rownames=['Actuals'], colnames=['Predictions'], margins=True)
+    return {
+        "confusion_matrix": crosstab.values,
+        "accuracy": accuracy_score(y_true, rounded_predict),
+        "precision": precision_score(y_true, rounded_predict),
+        "recall": recall_score(y_true, rounded_predict),
+        "auc": roc_auc_score(y_true, y_score),
+    }
+
+def time_call(func, *args):
+    start_time = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start_time, result
+
+if __name__ == "__main__":
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000000
+
+    rng = np.random.default_rng(0)
+    y_true = (rng.random(num_rows) < 0.05).astype(np.int64)
+    y_score = np.clip(rng.normal(0.2 + 0.5 * y_true, 0.2), 0, 1).astype(np.float32)
+
+    sklearn_time, expected = time_call(sklearn_metrics, y_true, y_score)
+    engine_time, metrics = time_call(binary_classification_metrics, y_true, y_score)
+
+    for name in ["accuracy", "precision", "recall", "auc"]:
+        assert np.isclose(metrics[name], expected[name]), name
+    assert np.array_equal(metrics["confusion_matrix"], expected["confusion_matrix"])
+
+    print(f'{num_rows} predictions')
+    print(f'sklearn and pd.crosstab: {sklearn_time:8.2f} s')
+    print(f'metrics engine:          {engine_time:8.2f} s   ({sklearn_time / engine_time:.1f}x)')
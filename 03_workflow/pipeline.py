@@ -1,12 +1,16 @@
 import os
+import hashlib
+import tempfile
 import urllib
 
 import boto3
+from botocore.exceptions import ClientError
 from steps.preprocess import preprocess
 from steps.train import train
 from steps.test import test
 from steps.register import register
 from steps.deploy import deploy
+from step_cache import StepCache
 
 from sagemaker.s3 import S3Uploader
 from sagemaker.session import Session
@@ -34,7 +38,23 @@ def download_data_and_upload_to_s3(bucket_name):
     os.makedirs(os.path.dirname(input_data_path), exist_ok=True)
     
     dataset_url = "http://archive.ics.uci.edu/ml/machine-learning-databases/00601/ai4i2020.csv"
-    urllib.request.urlretrieve(dataset_url, input_data_path)
+    if not os.path.exists(input_data_path):
+        urllib.request.urlretrieve(dataset_url, input_data_path)
+
+    # Skip the upload when the same file is already in S3 (the ETag of a single part upload is its MD5)
+    s3_key = f"{s3_prefix}/{file_name}"
+    try:
+        etag = boto3.client("s3").head_object(Bucket=bucket_name, Key=s3_key)["ETag"].strip('"')
+    except ClientError as e:
+        # Only a missing object means the dataset has to be uploaded
+        if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+            raise
+        etag = None
+    with open(input_data_path, "rb") as file:
+        md5 = hashlib.md5(file.read()).hexdigest()
+    if etag == md5:
+        print("Dataset already in Amazon S3")
+        return f"s3://{bucket_name}/{s3_key}"
 
     upload_s3_uri = S3Uploader.upload(input_data_path, s3_uri)
     print("Downloading dataset and uploading to Amazon S3...")
@@ -77,6 +97,44 @@ def create_steps(role, input_data_s3_uri, project_prefix, bucket_name,
 
     return [deploy_result]
 
+def run_steps_locally(step_cache, role, input_data_s3_uri, project_prefix, bucket_name,
+                      model_package_group_name, model_approval_status,
+                      eta, max_depth, deploy_model, experiment_name, run_name):
+    # Runs the same steps in this process. Preprocess, Train and Evaluate are served
+    # from the step cache when their code, arguments and input data did not change.
+    # The MLflow run is started here rather than by preprocess, so every local run
+    # gets its own run even when preprocess is a cache hit, and only the data and
+    # model outputs of the steps are cached
+    # The steps write their model files to /opt/ml/model in the pipeline containers,
+    # and to a temporary directory here unless MODEL_DIR is set
+    os.environ.setdefault('MODEL_DIR', tempfile.mkdtemp(prefix='sagemaker-btd-model-'))
+    print(f"Writing model files to {os.environ['MODEL_DIR']}")
+
+    mlflow.set_tracking_uri(os.environ['MLFLOW_TRACKING_ARN'])
+    mlflow.set_experiment(experiment_name)
+    with mlflow.start_run(run_name=run_name) as run:
+        run_id = run.info.run_id
+
+    X_train, y_train, X_val, y_val, X_test, y_test, featurizer_model = step_cache.cached(
+        preprocess, output=lambda result: result[:7])(input_data_s3_uri, experiment_name, run_name, run_id=run_id)
+
+    booster = step_cache.cached(train)(X_train=X_train, y_train=y_train, X_val=X_val, y_val=y_val,
+                                       eta=eta, max_depth=max_depth, experiment_name=experiment_name, run_id=run_id)
+
+    report_dict = step_cache.cached(test)(featurizer_model=featurizer_model, booster=booster,
+                                          X_test=X_test, y_test=y_test, experiment_name=experiment_name, run_id=run_id)
+
+    model_package_arn = register(role, featurizer_model=featurizer_model, booster=booster,
+                                 bucket_name=bucket_name, model_report_dict=report_dict,
+                                 model_package_group_name=model_package_group_name,
+                                 model_approval_status=model_approval_status, experiment_name=experiment_name, run_id=run_id)
+
+    deploy(role, project_prefix, model_package_arn=model_package_arn,
+           deploy_model=deploy_model, experiment_name=experiment_name, run_id=run_id)
+
+    step_cache.report()
+    return run_id
+
 def get_mlflow_server_arn():
     r = boto3.client("sagemaker").list_mlflow_tracking_servers()['TrackingServerSummaries']
 
@@ -117,24 +175,34 @@ if __name__ == "__main__":
     )
     
     input_data_s3_uri = download_data_and_upload_to_s3(bucket_name)    
-    
-    steps=create_steps(role, input_data_s3_uri, project_prefix, bucket_name, 
-                       model_package_group_name, model_approval_status,
-                       eta_parameter, max_depth_parameter, deploy_model_parameter, pipeline_name, run_name, mlflow_arn)
 
-    local_pipeline_session = LocalPipelineSession()
+    # With STEP_CACHE_DIR set (a local directory or an s3:// prefix), the steps run in
+    # this process and reuse cached outputs instead of starting a pipeline execution
+    step_cache_dir = os.getenv('STEP_CACHE_DIR')
+    if step_cache_dir:
+        step_cache = StepCache(step_cache_dir, max_size_bytes=int(os.getenv('STEP_CACHE_MAX_MB', 5120)) * 1024 ** 2)
+        run_steps_locally(step_cache, role, input_data_s3_uri, project_prefix, bucket_name,
+                          model_package_group_name, model_approval_status,
+                          eta_parameter.default_value, max_depth_parameter.default_value,
+                          deploy_model_parameter.default_value, pipeline_name, "LocalCachedRun")
+    else:
+        steps=create_steps(role, input_data_s3_uri, project_prefix, bucket_name, 
+                           model_package_group_name, model_approval_status,
+                           eta_parameter, max_depth_parameter, deploy_model_parameter, pipeline_name, run_name, mlflow_arn)
+
+        local_pipeline_session = LocalPipelineSession()
 
-    more_params = {}
-    if local_mode:
-        more_params["sagemaker_session"] = local_pipeline_session 
+        more_params = {}
+        if local_mode:
+            more_params["sagemaker_session"] = local_pipeline_session 
     
-    pipeline = Pipeline(
-        name=pipeline_name,
-        parameters=[deploy_model_parameter, eta_parameter, max_depth_parameter],
-        steps=steps,
-        pipeline_definition_config=PipelineDefinitionConfig(use_custom_job_prefix=True),        
-        **more_params
-    )
-
-    pipeline.upsert(role_arn=role)
-    pipeline.start()
+        pipeline = Pipeline(
+            name=pipeline_name,
+            parameters=[deploy_model_parameter, eta_parameter, max_depth_parameter],
+            steps=steps,
+            pipeline_definition_config=PipelineDefinitionConfig(use_custom_job_prefix=True),        
+            **more_params
+        )
+
+        pipeline.upsert(role_arn=role)
+        pipeline.start()
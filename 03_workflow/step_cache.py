@@ -0,0 +1,155 @@
+import os
+import io
+import sys
+import json
+import time
+import inspect
+import hashlib
+import functools
+
+import joblib
+import fsspec
+
+# Content-addressed cache for the outputs of the pipeline steps when they run
+# locally. The key of a call is a hash of the step function source, the source
+# of every module of its package (helpers such as steps/metrics.py), its
+# arguments and the digest of the input data it references (S3 ETag or SHA-256
+# of a local file), so a step is only rerun when one of them changes. Entries are
+# stored as joblib files in any fsspec location (local directory or s3://) and
+# evicted least recently used first when the store exceeds max_size_bytes.
+
+# Arguments that identify the MLflow run rather than the computation
+ignored_arguments = ('experiment_name', 'run_id', 'run_name')
+
+def file_digest(path):
+    if path.startswith('s3://'):
+        import boto3
+        bucket, key = path[len('s3://'):].split('/', 1)
+        return boto3.client('s3').head_object(Bucket=bucket, Key=key)['ETag'].strip('"')
+
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def function_source(func):
+    try:
+        return inspect.getsource(func)
+    except OSError:
+        # Functions defined interactively have no source file
+        return func.__code__.co_code
+
+@functools.lru_cache(maxsize=None)
+def package_digest(module_name):
+    # SHA-256 of the source files of the package holding module_name, or of the
+    # module itself when it is not part of a package
+    module = sys.modules[module_name]
+    module_file = getattr(module, '__file__', None)
+    if module_file is None:
+        return ''
+    if module.__package__:
+        package_dir = os.path.dirname(sys.modules[module.__package__.split('.')[0]].__file__)
+        paths = sorted(os.path.join(root, name) for root, _, names in os.walk(package_dir)
+                       for name in names if name.endswith('.py'))
+    else:
+        package_dir, paths = os.path.dirname(module_file), [module_file]
+
+    sha256 = hashlib.sha256()
+    for path in paths:
+        sha256.update(os.path.relpath(path, package_dir).encode('utf-8'))
+        with open(path, 'rb') as file:
+            sha256.update(file.read())
+    return sha256.hexdigest()
+
+def _is_data_path(value):
+    return isinstance(value, str) and (value.startswith('s3://') or os.path.isfile(value))
+
+class StepCache:
+    def __init__(self, store_uri, max_size_bytes=5 * 1024 ** 3):
+        self.fs, self.root = fsspec.core.url_to_fs(store_uri)
+        self.fs.makedirs(self.root, exist_ok=True)
+        self.max_size_bytes = max_size_bytes
+        self.hits = {}
+        self.misses = {}
+
+    def _path(self, name):
+        return f'{self.root.rstrip("/")}/{name}'
+
+    def _load_index(self):
+        if not self.fs.exists(self._path('index.json')):
+            return {}
+        with self.fs.open(self._path('index.json'), 'r') as file:
+            return json.load(file)
+
+    def _save_index(self, index):
+        with self.fs.open(self._path('index.json'), 'w') as file:
+            json.dump(index, file, indent=1)
+
+    def key(self, func, args, kwargs):
+        bound = inspect.signature(func).bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = {name: value for name, value in bound.arguments.items() if name not in ignored_arguments}
+        digests = {name: file_digest(value) for name, value in arguments.items() if _is_data_path(value)}
+        return joblib.hash([func.__module__, func.__qualname__, function_source(func),
+                            package_digest(func.__module__), arguments, digests])
+
+    def get(self, key):
+        index = self._load_index()
+        if key not in index or not self.fs.exists(self._path(f'{key}.joblib')):
+            return False, None
+        with self.fs.open(self._path(f'{key}.joblib'), 'rb') as file:
+            value = joblib.load(io.BytesIO(file.read()))
+        index[key]['last_access'] = time.time()
+        self._save_index(index)
+        return True, value
+
+    def put(self, key, value, name=''):
+        buffer = io.BytesIO()
+        joblib.dump(value, buffer)
+        with self.fs.open(self._path(f'{key}.joblib'), 'wb') as file:
+            file.write(buffer.getvalue())
+
+        index = self._load_index()
+        index[key] = {'name': name, 'size': buffer.tell(), 'created': time.time(), 'last_access': time.time()}
+        self._evict(index)
+        self._save_index(index)
+
+    def _evict(self, index):
+        total_size = sum(entry['size'] for entry in index.values())
+        for key in sorted(index, key=lambda key: index[key]['last_access']):
+            if total_size <= self.max_size_bytes:
+                break
+            print(f"Evicting cached {index[key]['name']} output {key} ({index[key]['size'] / 1024 ** 2:.1f} MB)")
+            self.fs.rm(self._path(f'{key}.joblib'))
+            total_size -= index.pop(key)['size']
+
+    def cached(self, func, output=None):
+        # output selects the part of the result that is cached and returned, for
+        # steps that also return something tied to the call (such as an MLflow run id)
+        output = output or (lambda value: value)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            name = func.__name__
+            key = self.key(func, args, kwargs)
+            hit, value = self.get(key)
+            if hit:
+                self.hits[name] = self.hits.get(name, 0) + 1
+                print(f'Step cache hit for {name} ({key})')
+                return value
+
+            self.misses[name] = self.misses.get(name, 0) + 1
+            print(f'Step cache miss for {name} ({key})')
+            value = output(func(*args, **kwargs))
+            self.put(key, value, name)
+            return value
+        return wrapper
+
+    def report(self):
+        index = self._load_index()
+        print('Step cache report')
+        for name in sorted(set(self.hits) | set(self.misses)):
+            print(f'  {name}: {self.hits.get(name, 0)} hit(s), {self.misses.get(name, 0)} miss(es)')
+        total_size = sum(entry['size'] for entry in index.values())
+        print(f'  {len(index)} cached output(s), {total_size / 1024 ** 2:.1f} MB of {self.max_size_bytes / 1024 ** 2:.1f} MB')
@@ -1,8 +1,10 @@
 import os
-import boto3
-from sagemaker.model import ModelPackage
-from sagemaker.utils import unique_name_from_base
-import mlflow
+
+from steps.lazy_imports import lazy_import
+from steps.profiling import profile_step, phase
+
+boto3 = lazy_import('boto3')
+mlflow = lazy_import('mlflow')
 
 def deploy(role, project_prefix, model_package_arn, deploy_model, experiment_name="main_experiment", run_id="run-01"):
 
@@ -10,15 +12,19 @@ def deploy(role, project_prefix, model_package_arn, deploy_model, experiment_nam
     mlflow.set_tracking_uri(os.environ['MLFLOW_TRACKING_ARN'])    
     mlflow.set_experiment(experiment_name)
     with mlflow.start_run(run_id=run_id) as run:        
-        with mlflow.start_run(run_name="Deploy", nested=True):    
+        with mlflow.start_run(run_name="Deploy", nested=True), profile_step("deploy"):
             mlflow.autolog()
             if deploy_model:
+                from sagemaker.model import ModelPackage
+                from sagemaker.utils import unique_name_from_base
+
                 sagemaker_client = boto3.client("sagemaker")
             
-                response = sagemaker_client.update_model_package(
-                    ModelPackageArn=model_package_arn,
-                    ModelApprovalStatus='Approved',
-                    ApprovalDescription='Auto-approved via SageMaker Pipelines')
+                with phase("approve_model_package"):
+                    response = sagemaker_client.update_model_package(
+                        ModelPackageArn=model_package_arn,
+                        ModelApprovalStatus='Approved',
+                        ApprovalDescription='Auto-approved via SageMaker Pipelines')
             
                 model_package = ModelPackage(
                     role = role,
@@ -26,8 +32,9 @@ def deploy(role, project_prefix, model_package_arn, deploy_model, experiment_nam
         
                 endpoint_name = unique_name_from_base(f"{project_prefix}-sm-btd-endpoint")
                 
-                model_package.deploy(initial_instance_count=1,
-                                     instance_type="ml.c5.xlarge",
-                                     endpoint_name=endpoint_name)
+                with phase("deploy_endpoint"):
+                    model_package.deploy(initial_instance_count=1,
+                                         instance_type="ml.c5.xlarge",
+                                         endpoint_name=endpoint_name)
             else:
                 print("Skipped deploy model step based on parameter configuration.")
@@ -0,0 +1,25 @@
+import sys
+import importlib.util
+
+# Each step runs as its own remote job, and importing the steps modules used to
+# import mlflow, sagemaker, xgboost and sklearn up front whether the step needed
+# them or not. lazy_import() returns a module whose import only runs on the first
+# attribute access, so a step only pays for the libraries it actually uses.
+#
+# Lazy modules must not end up in the globals of classes pickled by value (the
+# inference specs and translators in register.py), which import what they need
+# in their factory functions instead.
+
+def lazy_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
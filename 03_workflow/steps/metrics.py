@@ -0,0 +1,154 @@
+import os
+import time
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+# Binary classification metrics computed from a single sort of the scores: the
+# cumulative count of positives along the descending scores gives the confusion
+# matrix at any threshold and the ROC curve, so accuracy, precision, recall and
+# AUC do not each re-validate and re-scan the predictions like the sklearn calls.
+
+def sort_scores(y_true, y_score):
+    y_true = np.asarray(y_true).reshape(-1) != 0
+    y_score = np.asarray(y_score).reshape(-1)
+    # The order within tied scores does not matter, since ties are grouped below
+    order = np.argsort(y_score)[::-1]
+    sorted_scores = y_score[order]
+    true_positives = np.cumsum(y_true[order], dtype=np.int64)
+    return sorted_scores, true_positives
+
+def roc_auc(sorted_scores, true_positives):
+    # One ROC point per distinct score (the last row of each group of tied scores)
+    num_rows = len(sorted_scores)
+    last_of_ties = np.r_[np.flatnonzero(sorted_scores[1:] != sorted_scores[:-1]), num_rows - 1]
+    tps = np.r_[0, true_positives[last_of_ties]]
+    fps = np.r_[0, last_of_ties + 1 - tps[1:]]
+    num_positives, num_negatives = tps[-1], fps[-1]
+    if num_positives == 0 or num_negatives == 0:
+        raise ValueError("AUC is not defined when only one class is present in y_true")
+    return float(np.sum(np.diff(fps) * (tps[1:] + tps[:-1])) / (2.0 * num_positives * num_negatives))
+
+def confusion_matrix(sorted_scores, true_positives, threshold=0.5):
+    # Predictions are score > threshold, which is what np.round does for threshold 0.5.
+    # Rows are the actuals (0, 1, All) and columns the predictions (0, 1, All), like
+    # pd.crosstab(..., margins=True)
+    num_rows = len(sorted_scores)
+    num_predicted_positives = int(np.searchsorted(-sorted_scores, -threshold, side='left'))
+    num_positives = int(true_positives[-1]) if num_rows else 0
+    tp = int(true_positives[num_predicted_positives - 1]) if num_predicted_positives else 0
+    fp = num_predicted_positives - tp
+    fn = num_positives - tp
+    tn = num_rows - num_positives - fp
+    return np.array([[tn, fp, tn + fp],
+                     [fn, tp, fn + tp],
+                     [tn + fn, fp + tp, num_rows]], dtype=np.int64)
+
+def threshold_sweep(y_true, y_score):
+    # Precision, recall and F1 when predicting score > threshold, for a threshold between
+    # every pair of consecutive distinct scores (one sort, then one pass over the groups)
+    sorted_scores, true_positives = sort_scores(y_true, y_score)
+    num_rows = len(sorted_scores)
+    last_of_ties = np.r_[np.flatnonzero(sorted_scores[1:] != sorted_scores[:-1]), num_rows - 1]
+    tps = true_positives[last_of_ties]
+    predicted_positives = last_of_ties + 1
+    num_positives = true_positives[-1]
+
+    distinct_scores = sorted_scores[last_of_ties].astype(np.float64)
+    thresholds = np.r_[(distinct_scores[:-1] + distinct_scores[1:]) / 2.0, np.nextafter(distinct_scores[-1], -np.inf)]
+
+    precision = tps / predicted_positives
+    recall = tps / num_positives if num_positives else np.zeros(len(tps))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    return {"thresholds": thresholds, "precision": precision, "recall": recall, "f1": f1}
+
+def optimal_threshold(y_true, y_score, metric="f1"):
+    sweep = threshold_sweep(y_true, y_score)
+    best = int(np.argmax(sweep[metric]))
+    return float(sweep["thresholds"][best]), {name: float(values[best]) for name, values in sweep.items() if name != "thresholds"}
+
+def binary_classification_metrics(y_true, y_score, threshold=0.5):
+    sorted_scores, true_positives = sort_scores(y_true, y_score)
+    matrix = confusion_matrix(sorted_scores, true_positives, threshold)
+    (tn, fp, _), (fn, tp, _), (_, predicted_positives, num_rows) = matrix
+    return {
+        "confusion_matrix": matrix,
+        "accuracy": float((tp + tn) / num_rows),
+        "precision": float(tp / predicted_positives) if predicted_positives else 0.0,
+        "recall": float(tp / (tp + fn)) if tp + fn else 0.0,
+        "auc": roc_auc(sorted_scores, true_positives),
+    }
+
+def format_confusion_matrix(matrix):
+    labels = ['0', '1', 'All']
+    lines = ['Predictions' + ''.join(f'{label:>10}' for label in labels),
+             'Actuals']
+    for label, row in zip(labels, matrix):
+        lines.append(f'{label:<11}' + ''.join(f'{value:>10}' for value in row))
+    return '\n'.join(lines)
+
+def _bootstrap_worker(group_codes, num_groups, num_predicted_groups, num_resamples, min_resamples, seed, time_budget):
+    # Each resample is a (batch, num_rows) matrix of row indices. Counting the resampled
+    # rows per (tie group, label) gives the positives and negatives of every group, and
+    # the metrics of all the resamples in the batch follow from cumulative sums over groups.
+    # The time budget starts when the worker does, so the pool start-up does not eat into it
+    deadline = time.time() + time_budget
+    rng = np.random.default_rng(seed)
+    num_rows = len(group_codes)
+    batch_size = max(1, min(num_resamples, 2000000 // num_rows))
+    samples = []
+    done = 0
+    while done < num_resamples and (done < min_resamples or time.time() < deadline):
+        batch = min(batch_size, num_resamples - done)
+        indices = rng.integers(0, num_rows, size=(batch, num_rows))
+        codes = group_codes[indices] + (2 * num_groups) * np.arange(batch)[:, None]
+        counts = np.bincount(codes.ravel(), minlength=batch * 2 * num_groups).reshape(batch, num_groups, 2)
+        negatives, positives = counts[:, :, 0], counts[:, :, 1]
+
+        tps = np.cumsum(positives, axis=1)
+        fps = np.cumsum(negatives, axis=1)
+        num_positives, num_negatives = tps[:, -1], fps[:, -1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            auc = np.sum(negatives * (tps - positives / 2.0), axis=1) / (num_positives * num_negatives)
+            if num_predicted_groups:
+                tp = tps[:, num_predicted_groups - 1]
+                fp = fps[:, num_predicted_groups - 1]
+            else:
+                tp = fp = np.zeros(batch, dtype=np.int64)
+            precision = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+            recall = np.where(num_positives > 0, tp / num_positives, 0.0)
+        accuracy = (tp + num_negatives - fp) / num_rows
+
+        samples.append(np.stack([recall, precision, accuracy, auc], axis=1))
+        done += batch
+    return np.concatenate(samples) if samples else np.empty((0, 4))
+
+def bootstrap_metrics(y_true, y_score, num_resamples=2000, threshold=0.5, time_budget=60.0, max_workers=None, seed=0,
+                      min_resamples=100):
+    # Returns the mean and standard deviation of recall, precision, accuracy and AUC over
+    # bootstrap resamples of the predictions. The resamples are split across a process
+    # pool, and each worker stops at the time budget, so more cores get more resamples.
+    # min_resamples are drawn whatever the budget, so the estimates are never empty
+    sorted_scores, true_positives = sort_scores(y_true, y_score)
+    sorted_labels = np.diff(np.r_[0, true_positives])
+    group_index = np.r_[0, np.cumsum(sorted_scores[1:] != sorted_scores[:-1])]
+    group_codes = 2 * group_index + sorted_labels
+    num_groups = int(group_index[-1]) + 1
+    num_predicted_groups = int(np.unique(group_index[sorted_scores > threshold]).size)
+
+    max_workers = max_workers or os.cpu_count()
+    min_resamples = min(min_resamples, num_resamples)
+    shares = [num_resamples // max_workers + (worker < num_resamples % max_workers) for worker in range(max_workers)]
+    min_shares = [min_resamples // max_workers + (worker < min_resamples % max_workers) for worker in range(max_workers)]
+    seeds = np.random.SeedSequence(seed).spawn(max_workers)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_bootstrap_worker, group_codes, num_groups, num_predicted_groups, share, min_share,
+                                   worker_seed, time_budget)
+                   for share, min_share, worker_seed in zip(shares, min_shares, seeds) if share > 0]
+        samples = np.concatenate([future.result() for future in futures])
+
+    results = {"num_resamples": len(samples)}
+    for i, name in enumerate(["recall", "precision", "accuracy", "auc"]):
+        results[name] = {"mean": float(np.nanmean(samples[:, i])), "standard_deviation": float(np.nanstd(samples[:, i]))}
+    return results
@@ -0,0 +1,10 @@
+import os
+
+# Directory the steps write their model files to. Inside the pipeline containers
+# that is /opt/ml/model; run_steps_locally in pipeline.py sets MODEL_DIR to a
+# directory the user can write to when the steps run in the local process.
+
+def get_model_dir():
+    model_dir = os.environ.get('MODEL_DIR', '/opt/ml/model')
+    os.makedirs(model_dir, exist_ok=True)
+    return model_dir
@@ -1,38 +1,41 @@
 import os
-import joblib
 
-import pandas as pd
+import numpy as np
 
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import StandardScaler, OneHotEncoder
-from sklearn.compose import ColumnTransformer
-from sklearn.exceptions import DataConversionWarning
+from steps.lazy_imports import lazy_import
+from steps.profiling import profile_step, phase
+from steps.compiled_featurizer import compile_featurizer, save_compiled_featurizer
+from steps.model_dir import get_model_dir
 
-from sklearn.metrics import roc_auc_score
-from sklearn.metrics import accuracy_score
-from sklearn.metrics import precision_score
-from sklearn.metrics import recall_score
-import mlflow
+pd = lazy_import('pandas')
+joblib = lazy_import('joblib')
+mlflow = lazy_import('mlflow')
 
-def preprocess(input_data_s3_uri: str, experiment_name="main_experiment", run_name="run-01") -> tuple :
+columns = ['Type', 'Air temperature [K]', 'Process temperature [K]', 'Rotational speed [rpm]', 'Torque [Nm]', 'Tool wear [min]', 'Machine failure']
+cat_columns = ['Type']
+num_columns = ['Air temperature [K]', 'Process temperature [K]', 'Rotational speed [rpm]', 'Torque [Nm]', 'Tool wear [min]']
+target_column = 'Machine failure'
+
+def preprocess(input_data_s3_uri: str, experiment_name="main_experiment", run_name="run-01", run_id=None) -> tuple :
+    from sklearn.model_selection import train_test_split
+    from sklearn.preprocessing import StandardScaler, OneHotEncoder
+    from sklearn.compose import ColumnTransformer
         
 
     # Enable autologging in MLflow
     mlflow.set_tracking_uri(os.environ['MLFLOW_TRACKING_ARN'])    
     mlflow.set_experiment(experiment_name)
-    with mlflow.start_run(run_name=run_name) as run:
+    # The pipeline starts its MLflow run here, while a local run (see run_steps_locally
+    # in pipeline.py) passes the run it started
+    with (mlflow.start_run(run_id=run_id) if run_id else mlflow.start_run(run_name=run_name)) as run:
         run_id = run.info.run_id
         print(run)
-        with mlflow.start_run(run_name="DataPreprocessing", nested=True):    
+        with mlflow.start_run(run_name="DataPreprocessing", nested=True), profile_step("preprocess"):
             mlflow.autolog()            
             
-            columns = ['Type', 'Air temperature [K]', 'Process temperature [K]', 'Rotational speed [rpm]', 'Torque [Nm]', 'Tool wear [min]', 'Machine failure']
-            cat_columns = ['Type']
-            num_columns = ['Air temperature [K]', 'Process temperature [K]', 'Rotational speed [rpm]', 'Torque [Nm]', 'Tool wear [min]']
-            target_column = 'Machine failure'
-            
-            df = pd.read_csv(input_data_s3_uri)
-            df = df[columns]
+            with phase("read_csv"):
+                df = pd.read_csv(input_data_s3_uri)
+                df = df[columns]
         
             training_ratio = 0.8
             validation_ratio = 0.1
@@ -45,16 +48,19 @@ def preprocess(input_data_s3_uri: str, experiment_name="main_experiment", run_na
             mlflow.log_param("training_ratio",training_ratio)
             mlflow.log_param("test_ratio",training_ratio)
             
-            X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_ratio, random_state=0, stratify=y)
-            X_train, X_val, y_train, y_val = train_test_split(X_train, y_train, test_size=validation_ratio/(validation_ratio+training_ratio), random_state=2, stratify=y_train)
+            with phase("split"):
+                X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_ratio, random_state=0, stratify=y)
+                X_train, X_val, y_train, y_val = train_test_split(X_train, y_train, test_size=validation_ratio/(validation_ratio+training_ratio), random_state=2, stratify=y_train)
         
             # Apply transformations
             transformer = ColumnTransformer(transformers=[('numeric', StandardScaler(), num_columns),
                                                           ('categorical', OneHotEncoder(), cat_columns)],
                                             remainder='passthrough')
-            featurizer_model = transformer.fit(X_train)
-            X_train = featurizer_model.transform(X_train)
-            X_val = featurizer_model.transform(X_val)
+            with phase("fit"):
+                featurizer_model = transformer.fit(X_train)
+            with phase("transform"):
+                X_train = featurizer_model.transform(X_train)
+                X_val = featurizer_model.transform(X_val)
         
             print(f'Shape of train features after preprocessing: {X_train.shape}')
             print(f'Shape of validation features after preprocessing: {X_val.shape}')
@@ -67,8 +73,121 @@ def preprocess(input_data_s3_uri: str, experiment_name="main_experiment", run_na
             print(f'Shape of validation labels after preprocessing: {y_val.shape}')
             print(f'Shape of test labels after preprocessing: {y_test.shape}')
         
-            model_file_path="/opt/ml/model/sklearn_model.joblib"
-            os.makedirs(os.path.dirname(model_file_path), exist_ok=True)
-            joblib.dump(featurizer_model, model_file_path)
+            with phase("serialization"):
+                model_dir = get_model_dir()
+                model_file_path=os.path.join(model_dir, "sklearn_model.joblib")
+                joblib.dump(featurizer_model, model_file_path)
+                
+                # Compact NumPy version of the featurizer used at inference time
+                compiled_featurizer = compile_featurizer(featurizer_model, sample_df=X_test.head(1000))
+                save_compiled_featurizer(compiled_featurizer, os.path.join(model_dir, "featurizer.npz"))
 
     return X_train, y_train, X_val, y_val, X_test, y_test, featurizer_model, run_id
+
+def hash_split(keys, training_ratio, validation_ratio):
+    # Deterministic split membership from a hash of the row key: a row always lands
+    # in the same split regardless of chunking, and since the hash is independent of
+    # the label every class is split in the same train/validation/test proportions
+    # in expectation
+    buckets = (pd.util.hash_pandas_object(keys, index=False).to_numpy() % 10000) / 10000.0
+    return np.where(buckets < training_ratio, 'train',
+                    np.where(buckets < training_ratio + validation_ratio, 'val', 'test'))
+
+def read_csv_chunks(input_data_path, chunk_size, key_column):
+    usecols = columns + [key_column] if key_column else columns
+    reader = pd.read_csv(input_data_path, usecols=usecols, chunksize=chunk_size)
+    while True:
+        with phase("read_csv"):
+            chunk = next(reader, None)
+        if chunk is None:
+            break
+        # Without a key column the chunk index, which continues across chunks, is the row key
+        keys = chunk[key_column] if key_column else chunk.index.to_series()
+        yield chunk[columns], keys
+
+def fit_featurizer_streaming(input_data_path, chunk_size, key_column, training_ratio, validation_ratio):
+    from sklearn.preprocessing import StandardScaler, OneHotEncoder
+    from sklearn.compose import ColumnTransformer
+
+    scaler = StandardScaler()
+    categories = set()
+    for chunk, keys in read_csv_chunks(input_data_path, chunk_size, key_column):
+        train_chunk = chunk[hash_split(keys, training_ratio, validation_ratio) == 'train']
+        if len(train_chunk) > 0:
+            scaler.partial_fit(train_chunk[num_columns])
+            categories.update(train_chunk[cat_columns[0]].unique())
+
+    # Fit the usual ColumnTransformer on one row per category, then put the
+    # incrementally fitted scaler in place of the numeric transformer it fitted
+    categories = sorted(categories)
+    seed_df = pd.DataFrame({cat_columns[0]: categories})
+    for i, column in enumerate(num_columns):
+        seed_df[column] = scaler.mean_[i]
+    transformer = ColumnTransformer(transformers=[('numeric', StandardScaler(), num_columns),
+                                                  ('categorical', OneHotEncoder(categories=[categories]), cat_columns)],
+                                    remainder='passthrough')
+    featurizer_model = transformer.fit(seed_df[num_columns + cat_columns])
+    featurizer_model.transformers_ = [(name, scaler if name == 'numeric' else fitted, transformer_columns)
+                                      for name, fitted, transformer_columns in featurizer_model.transformers_]
+    return featurizer_model
+
+def preprocess_streaming(input_data_s3_uri: str, output_dir: str, chunk_size=100000, key_column='UDI',
+                         experiment_name="main_experiment", run_name="run-01") -> tuple :
+    # Streaming alternative to preprocess() for inputs larger than memory: the CSV is
+    # read twice in chunks, first to fit the featurizer and then to write each split
+    # as shards of features and labels under output_dir/{train,val,test}/
+
+    # Enable autologging in MLflow
+    mlflow.set_tracking_uri(os.environ['MLFLOW_TRACKING_ARN'])    
+    mlflow.set_experiment(experiment_name)
+    with mlflow.start_run(run_name=run_name) as run:
+        run_id = run.info.run_id
+        print(run)
+        with mlflow.start_run(run_name="DataPreprocessing", nested=True), profile_step("preprocess"):
+            mlflow.autolog()            
+        
+            training_ratio = 0.8
+            validation_ratio = 0.1
+            test_ratio = 0.1
+        
+            print(f'Streaming {input_data_s3_uri} in chunks of {chunk_size} rows')
+            print(f'Splitting data training ({training_ratio}), validation ({validation_ratio}), and test ({test_ratio}) sets ')
+            mlflow.log_param("training_ratio",training_ratio)
+            mlflow.log_param("test_ratio",test_ratio)
+            mlflow.log_param("chunk_size",chunk_size)
+
+            with phase("fit"):
+                featurizer_model = fit_featurizer_streaming(input_data_s3_uri, chunk_size, key_column,
+                                                            training_ratio, validation_ratio)
+
+            split_dirs = {split: f'{output_dir}/{split}' for split in ['train', 'val', 'test']}
+            split_rows = {split: 0 for split in split_dirs}
+            if not output_dir.startswith('s3://'):
+                for split_dir in split_dirs.values():
+                    os.makedirs(split_dir, exist_ok=True)
+
+            for shard, (chunk, keys) in enumerate(read_csv_chunks(input_data_s3_uri, chunk_size, key_column)):
+                with phase("split"):
+                    splits = hash_split(keys, training_ratio, validation_ratio)
+                for split, split_dir in split_dirs.items():
+                    split_chunk = chunk[splits == split]
+                    if len(split_chunk) == 0:
+                        continue
+                    with phase("transform"):
+                        features = featurizer_model.transform(split_chunk.drop(target_column, axis=1))
+                    with phase("serialization"):
+                        pd.DataFrame(features).to_csv(f'{split_dir}/{split}_features_{shard:05d}.csv', header=False, index=False)
+                        split_chunk[[target_column]].to_csv(f'{split_dir}/{split}_labels_{shard:05d}.csv', header=False, index=False)
+                    split_rows[split] += len(split_chunk)
+        
+            for split, num_rows in split_rows.items():
+                print(f'Number of {split} rows after preprocessing: {num_rows}')
+                mlflow.log_metric(f'{split}_rows', num_rows)
+
+            model_dir = get_model_dir()
+            model_file_path=os.path.join(model_dir, "sklearn_model.joblib")
+            with phase("serialization"):
+                joblib.dump(featurizer_model, model_file_path)
+                save_compiled_featurizer(compile_featurizer(featurizer_model), os.path.join(model_dir, "featurizer.npz"))
+
+    return split_dirs['train'], split_dirs['val'], split_dirs['test'], featurizer_model, run_id
@@ -0,0 +1,154 @@
+import os
+import time
+import pstats
+import cProfile
+import resource
+import tempfile
+
+from contextlib import contextmanager
+from steps.lazy_imports import lazy_import
+
+mlflow = lazy_import('mlflow')
+
+# Resource usage of a pipeline step, logged as metrics on its nested MLflow run:
+#
+#   with mlflow.start_run(run_name="Train", nested=True), profile_step("train"):
+#       with phase("dmatrix_build"):
+#           ...
+#
+# profile_step records the wall and CPU time, the peak RSS and the bytes read and
+# written by the process, and phase() the time spent in each named sub-phase
+# (phases with the same name add up). With PROFILE_STEPS=1 the step also runs
+# under cProfile, and the profile is logged as an artifact (open the .prof file
+# with snakeviz or flameprof).
+
+_active_profilers = []
+
+def read_io_counters():
+    # rchar/wchar count every read()/write() call, network included, while
+    # read_bytes/write_bytes only count what reached the storage layer
+    counters = {}
+    try:
+        with open('/proc/self/io') as file:
+            for line in file:
+                name, value = line.split(':')
+                counters[name] = int(value)
+    except OSError:
+        pass
+    return counters
+
+class StepProfiler:
+    def __init__(self, step_name, profile_cpu=None):
+        self.step_name = step_name
+        if profile_cpu is None:
+            profile_cpu = os.environ.get('PROFILE_STEPS', '0') not in ('', '0')
+        self.profile_cpu = profile_cpu
+        self.phases = {}
+        self.metrics = {}
+        self._profile = None
+
+    def __enter__(self):
+        self._start_io = read_io_counters()
+        self._start_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self._start_cpu = time.process_time()
+        self._start_wall = time.perf_counter()
+        if self.profile_cpu:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        _active_profilers.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _active_profilers.remove(self)
+        if self._profile is not None:
+            self._profile.disable()
+
+        wall_seconds = time.perf_counter() - self._start_wall
+        end_io = read_io_counters()
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self.metrics.update({
+            "step_wall_seconds": wall_seconds,
+            "step_cpu_seconds": time.process_time() - self._start_cpu,
+            # Worker processes (process pools) that have exited during the step
+            "step_children_cpu_seconds": (children.ru_utime + children.ru_stime)
+                                         - (self._start_children.ru_utime + self._start_children.ru_stime),
+            # Peak of the whole process, in KB on Linux
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        })
+        for counter, name in [('rchar', 'read_bytes'), ('wchar', 'write_bytes'),
+                              ('read_bytes', 'disk_read_bytes'), ('write_bytes', 'disk_write_bytes')]:
+            if counter in end_io:
+                self.metrics[name] = end_io[counter] - self._start_io.get(counter, 0)
+        for name, seconds in self.phases.items():
+            self.metrics[f"phase_{name}_seconds"] = seconds
+
+        self.report()
+        self.log()
+        return False
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def report(self):
+        print(f'Profile of step {self.step_name}:')
+        for name, value in self.metrics.items():
+            print(f'  {name:<40} {value:14.3f}' if isinstance(value, float) else f'  {name:<40} {value:14d}')
+
+    def log(self):
+        mlflow.log_metrics(self.metrics)
+        if self._profile is None:
+            return
+
+        with tempfile.TemporaryDirectory() as profile_dir:
+            profile_path = os.path.join(profile_dir, f'{self.step_name}.prof')
+            self._profile.dump_stats(profile_path)
+            summary_path = os.path.join(profile_dir, f'{self.step_name}_profile.txt')
+            with open(summary_path, 'w') as file:
+                pstats.Stats(self._profile, stream=file).sort_stats('cumulative').print_stats(50)
+            mlflow.log_artifact(profile_path, artifact_path='profile')
+            mlflow.log_artifact(summary_path, artifact_path='profile')
+
+def profile_step(step_name, profile_cpu=None):
+    return StepProfiler(step_name, profile_cpu)
+
+@contextmanager
+def phase(name):
+    # Times a sub-phase on the innermost active step profiler, if any
+    if not _active_profilers:
+        yield
+        return
+    with _active_profilers[-1].phase(name):
+        yield
+
+def get_boost_round_timer():
+    # XGBoost callback recording the time of each boosting round on the active profiler
+    import xgboost
+
+    class BoostRoundTimer(xgboost.callback.TrainingCallback):
+        def before_training(self, model):
+            self._round_seconds = []
+            return model
+
+        def before_iteration(self, model, epoch, evals_log):
+            self._round_start = time.perf_counter()
+            return False
+
+        def after_iteration(self, model, epoch, evals_log):
+            self._round_seconds.append(time.perf_counter() - self._round_start)
+            return False
+
+        def after_training(self, model):
+            if _active_profilers and self._round_seconds:
+                _active_profilers[-1].metrics.update({
+                    "boost_rounds": len(self._round_seconds),
+                    "boost_round_mean_seconds": sum(self._round_seconds) / len(self._round_seconds),
+                    "boost_round_max_seconds": max(self._round_seconds),
+                })
+            return model
+
+    return BoostRoundTimer()
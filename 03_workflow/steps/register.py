@@ -1,36 +1,37 @@
 import io
 import os
 import json
-import s3fs
-import joblib
+import time
+import cloudpickle
 
-import xgboost
-import sklearn
 import numpy as np
-import pandas as pd
 
-import boto3
+from concurrent.futures import ThreadPoolExecutor
 
-import sagemaker
-from sagemaker.pipeline import PipelineModel
-from sagemaker import ModelMetrics, MetricsSource
-from sagemaker.s3_utils import s3_path_join
-from sagemaker.utils import unique_name_from_base
-from sagemaker.image_uris import retrieve as get_image_uri
+from steps import compiled_featurizer, latency_metrics, prediction_cache
+from steps.lazy_imports import lazy_import
+from steps.profiling import profile_step, phase
 
-from sagemaker.serve import ModelServer
-from sagemaker.serve import InferenceSpec
-from sagemaker.serve.builder.model_builder import ModelBuilder
-from sagemaker.serve.builder.schema_builder import SchemaBuilder
-from sagemaker.serve import CustomPayloadTranslator
+boto3 = lazy_import('boto3')
+mlflow = lazy_import('mlflow')
 
-import mlflow
+# Ship the compiled featurizer, latency metrics and prediction cache code with the
+# pickled inference spec, since the steps package is not installed in the inference container
+cloudpickle.register_pickle_by_value(compiled_featurizer)
+cloudpickle.register_pickle_by_value(latency_metrics)
+cloudpickle.register_pickle_by_value(prediction_cache)
+
+# The translator and spec classes below are pickled by value, so their factories
+# import what the classes use instead of relying on lazily imported globals
 
 # AWS Region
-session = boto3.session.Session()
-current_region = session.region_name
+def get_current_region():
+    return boto3.session.Session().region_name
+
+def get_sklearn_request_translator(as_dataframe=True):
+    import pandas as pd
+    from sagemaker.serve import CustomPayloadTranslator
 
-def build_sklearn_sagemaker_model(role, featurizer):
     feature_columns_names = ['Type', 'Air temperature [K]', 'Process temperature [K]', 'Rotational speed [rpm]', 'Torque [Nm]', 'Tool wear [min]']
     
     class SklearnRequestTranslator(CustomPayloadTranslator):
@@ -40,54 +41,137 @@ def build_sklearn_sagemaker_model(role, featurizer):
             
         # This function converts the bytes to payload - happens on server side
         def deserialize_payload_from_stream(self, stream) -> pd.DataFrame:
-            df = pd.read_csv(io.BytesIO(stream.read()), header=None)
-            df.columns = feature_columns_names
-            return df
-    
+            start = time.perf_counter()
+            parsed = self._deserialize(stream.read())
+            latency_metrics.observe('featurizer_deserialize', time.perf_counter() - start)
+            return parsed
+
+        def _deserialize(self, payload: bytes):
+            parsed = self._parse_csv(payload)
+            if parsed is None:
+                df = pd.read_csv(io.BytesIO(payload), header=None)
+                df.columns = feature_columns_names
+                if as_dataframe:
+                    return df
+                parsed = (df[feature_columns_names[0]].to_numpy(dtype=object),
+                          df[feature_columns_names[1:]].to_numpy(dtype=np.float64))
+            if not as_dataframe:
+                return parsed
+            types, numeric = parsed
+            return pd.DataFrame(dict(zip(feature_columns_names, [types, *numeric.T])))
+
+        # Fast path for the fixed schema: one categorical 'Type' followed by five
+        # numeric columns per line. Returns None when the payload does not match
+        # that layout (e.g. quoted fields), so the caller can fall back to pandas
+        def _parse_csv(self, payload: bytes):
+            if isinstance(payload, bytes):
+                payload = payload.decode("utf-8")
+            if '"' in payload:
+                return None
+            lines = [line for line in payload.splitlines() if line]
+            num_rows = len(lines)
+            num_columns = len(feature_columns_names)
+            cells = ",".join(lines).split(",")
+            if num_rows == 0 or len(cells) != num_rows * num_columns:
+                return None
+            
+            types = np.empty(num_rows, dtype=object)
+            numeric = np.empty((num_rows, num_columns - 1), dtype=np.float64)
+            grid = np.array(cells, dtype=object).reshape((num_rows, num_columns))
+            types[:] = grid[:, 0]
+            try:
+                numeric[:] = grid[:, 1:]
+            except ValueError:
+                return None
+            return types, numeric
+
+    return SklearnRequestTranslator()
+
+def get_sklearn_model_spec():
+    import joblib
+    import pandas as pd
+    from sagemaker.serve import InferenceSpec
+
     class SklearnModelSpec(InferenceSpec):
-        def invoke(self, input_object: object, model: object):       
-            features = model.transform(input_object)
+        # Featurizes with the compiled featurizer (see compiled_featurizer.py),
+        # which matches ColumnTransformer.transform without its DataFrame overhead
+        def invoke(self, input_object: object, model: object):
+            start = time.perf_counter()
+            features = self._invoke(input_object, model)
+            latency_metrics.observe('featurizer_invoke', time.perf_counter() - start)
             return features
+
+        def _invoke(self, input_object, model):
+            if isinstance(input_object, pd.DataFrame):
+                return compiled_featurizer.apply_compiled_featurizer_to_dataframe(model, input_object)
+            types, numeric = input_object
+            featurize = lambda types, numeric: compiled_featurizer.apply_compiled_featurizer(model, types, numeric)
+            if self.cache is None:
+                return featurize(types, numeric)
+            return self.cache.predict(types, numeric, featurize)
     
         def load(self, model_dir: str):
+            # Optional cache of feature rows, enabled with PREDICTION_CACHE_SIZE
+            self.cache = prediction_cache.get_prediction_cache()
+            artifact_path = model_dir + '/featurizer.npz'
+            if os.path.exists(artifact_path):
+                return compiled_featurizer.load_compiled_featurizer(artifact_path)
             model_path = model_dir+'/sklearn_model.joblib'
             print(model_path)
             model = joblib.load(model_path)
-            return model
+            return compiled_featurizer.compile_featurizer(model)
+
+    return SklearnModelSpec()
+
+def build_sklearn_sagemaker_model(role, featurizer):
+    import joblib
+    from sagemaker.serve import ModelServer
+    from sagemaker.serve.builder.model_builder import ModelBuilder
+    from sagemaker.serve.builder.schema_builder import SchemaBuilder
+    from sagemaker.image_uris import retrieve as get_image_uri
     
     schema_builder=SchemaBuilder(
         sample_input="L,298.4,308.2,1582,70.7,216",
         sample_output=np.array([0.647088,0.467287,-0.191472,0.720195,-0.536976,0.0,1.0,0.0]),
-        input_translator=SklearnRequestTranslator()
+        input_translator=get_sklearn_request_translator(as_dataframe=False)
     )
 
     model_file_path="sklearn_model/sklearn_model.joblib"
     os.makedirs(os.path.dirname(model_file_path), exist_ok=True)
     joblib.dump(featurizer, model_file_path)
+    compiled_featurizer.save_compiled_featurizer(
+        compiled_featurizer.compile_featurizer(featurizer), "sklearn_model/featurizer.npz")
 
     model_builder = ModelBuilder(
         model_path="sklearn_model/",
         name="sklearn_featurizer",
         dependencies={"requirements": "requirements_inference.txt"},
-        image_uri=get_image_uri(framework="sklearn", region=current_region, version="1.2-1"),
+        image_uri=get_image_uri(framework="sklearn", region=get_current_region(), version="1.2-1"),
         schema_builder=schema_builder,
         model_server=ModelServer.TORCHSERVE,
-        inference_spec=SklearnModelSpec(),
+        inference_spec=get_sklearn_model_spec(),
+        env_vars={**prediction_cache.get_cache_env_vars(), **latency_metrics.get_latency_env_vars()},
         role_arn=role)
     
     return model_builder.build()
 
-def build_xgboost_sagemaker_model(role, booster):
+def get_xgboost_request_translator():
+    import xgboost
+    from sagemaker.serve import CustomPayloadTranslator
 
     class RequestTranslator(CustomPayloadTranslator):
         # This function converts the payload to bytes - happens on client side
         def serialize_payload_to_bytes(self, payload: object) -> bytes:
+            if isinstance(payload, (list, tuple)):
+                return b"".join(self._convert_numpy_to_bytes(np_array) for np_array in payload)
             return self._convert_numpy_to_bytes(payload)
             
         # This function converts the bytes to payload - happens on server side
         def deserialize_payload_from_stream(self, stream) -> xgboost.DMatrix:
-            np_array = np.load(io.BytesIO(stream.read())).reshape((1, -1))
+            start = time.perf_counter()
+            np_array = self._load_rows(stream.read())
             dmatrix = xgboost.DMatrix(np_array)
+            latency_metrics.observe('xgboost_deserialize', time.perf_counter() - start)
             return dmatrix
             
         def _convert_numpy_to_bytes(self, np_array: np.ndarray) -> bytes:
@@ -95,10 +179,30 @@ def build_xgboost_sagemaker_model(role, booster):
             np.save(buffer, np_array)
             return buffer.getvalue()
 
+        # Accepts a single feature row, an N x 8 batch, or several arrays saved
+        # back to back, and returns all rows as one 2-D array
+        def _load_rows(self, payload: bytes) -> np.ndarray:
+            if not payload:
+                raise ValueError("Empty request payload: expected one or more arrays saved with np.save")
+            buffer = io.BytesIO(payload)
+            arrays = []
+            while buffer.tell() < len(payload):
+                arrays.append(np.atleast_2d(np.load(buffer)))
+            if len(arrays) == 1:
+                return arrays[0]
+            return np.concatenate(arrays)
+
+    return RequestTranslator()
+
+def build_xgboost_sagemaker_model(role, booster):
+    from sagemaker.serve.builder.model_builder import ModelBuilder
+    from sagemaker.serve.builder.schema_builder import SchemaBuilder
+    from sagemaker.image_uris import retrieve as get_image_uri
+
     schema_builder=SchemaBuilder(
         sample_input=np.array([0.647088,0.467287,-0.191472,0.720195,-0.536976,0.0,1.0,0.0]),
         sample_output=np.array([0.15388985]),
-        input_translator=RequestTranslator()
+        input_translator=get_xgboost_request_translator()
     )
 
     model_file_path = 'xgboost_model/xgboost_model.bin'
@@ -110,27 +214,59 @@ def build_xgboost_sagemaker_model(role, booster):
         model_path="xgboost_model/",
         dependencies={"requirements": "requirements_inference.txt"},
         schema_builder=schema_builder,
+        env_vars=latency_metrics.get_latency_env_vars(),
         role_arn=role,
-        image_uri=get_image_uri(framework="xgboost", region=current_region, version="1.7-1")
+        image_uri=get_image_uri(framework="xgboost", region=get_current_region(), version="1.7-1")
         )
     
     return model_builder.build()
 
+def upload_report(model_report_dict, eval_report_s3_uri, s3_client):
+    # A single put_object through boto3, which also honours AWS_ENDPOINT_URL_S3
+    # (e.g. a local moto server)
+    with phase("upload_report"):
+        bucket, key = eval_report_s3_uri[len("s3://"):].split("/", 1)
+        s3_client.put_object(Bucket=bucket, Key=key, Body=json.dumps(model_report_dict).encode("utf-8"),
+                             ContentType="application/json")
+
+def build_timed(phase_name, build_function, *args):
+    with phase(phase_name):
+        return build_function(*args)
+
+def build_models_and_upload_report(role, featurizer_model, booster, model_report_dict, eval_report_s3_uri):
+    # The S3 client is created here, before the pool starts: the builder threads create
+    # their own boto3 sessions, and creating clients from the default session (or the
+    # first access to the lazily imported boto3) in several threads at once is not safe
+    s3_client = boto3.session.Session().client("s3")
+
+    # Both models package and upload their artifacts independently, so they
+    # build in parallel while the evaluation report is uploaded
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        report_future = executor.submit(upload_report, model_report_dict, eval_report_s3_uri, s3_client)
+        sklearn_future = executor.submit(build_timed, "build_sklearn_model",
+                                         build_sklearn_sagemaker_model, role, featurizer_model)
+        xgboost_future = executor.submit(build_timed, "build_xgboost_model",
+                                         build_xgboost_sagemaker_model, role, booster)
+        sklearn_model = sklearn_future.result()
+        xgboost_model = xgboost_future.result()
+        report_future.result()
+    return sklearn_model, xgboost_model
+
 def register(role, featurizer_model, booster, 
              bucket_name, model_report_dict,
              model_package_group_name, model_approval_status, experiment_name="main_experiment", run_id="run-01"):
+    from sagemaker.pipeline import PipelineModel
+    from sagemaker import ModelMetrics, MetricsSource
+    from sagemaker.s3_utils import s3_path_join
+    from sagemaker.utils import unique_name_from_base
 
     # Enable autologging in MLflow
     mlflow.set_tracking_uri(os.environ['MLFLOW_TRACKING_ARN'])    
     mlflow.set_experiment(experiment_name)
     with mlflow.start_run(run_id=run_id) as run:        
-        with mlflow.start_run(run_name="Register", nested=True):    
+        with mlflow.start_run(run_name="Register", nested=True), profile_step("register"):
             mlflow.autolog()
-            
-            sklearn_model = build_sklearn_sagemaker_model(role, featurizer_model)
-            xgboost_model = build_xgboost_sagemaker_model(role, booster)
-        
-            # Upload evaluation report to s3
+
             eval_file_name = unique_name_from_base("evaluation")
             eval_report_s3_uri = s3_path_join(
                 "s3://",
@@ -138,12 +274,10 @@ def register(role, featurizer_model, booster,
                 model_package_group_name,
                 f"evaluation-report/{eval_file_name}.json",
             )
-            
-            s3_fs = s3fs.S3FileSystem()
-            eval_report_str = json.dumps(model_report_dict)
-            with s3_fs.open(eval_report_s3_uri, "wb") as file:
-                file.write(eval_report_str.encode("utf-8"))
-            
+
+            sklearn_model, xgboost_model = build_models_and_upload_report(
+                role, featurizer_model, booster, model_report_dict, eval_report_s3_uri)
+
             # Create model_metrics as per evaluation report in Amazon S3
             model_metrics = ModelMetrics(
                 model_statistics=MetricsSource(
@@ -151,7 +285,7 @@ def register(role, featurizer_model, booster,
                     content_type="application/json",
                 )
             )
-        
+
             pipeline_model_name = unique_name_from_base("sagemaker-btd-pipeline-model")
             pipeline_model = PipelineModel(
                 name=pipeline_model_name,
@@ -160,26 +294,16 @@ def register(role, featurizer_model, booster,
                 models=[
                     sklearn_model, 
                     xgboost_model])
-        
-            pipeline_model.register(
-                content_types=["text/csv"],
-                response_types=["application/x-npy"],
-                model_package_group_name=model_package_group_name,
-                approval_status=model_approval_status,
-                model_metrics=model_metrics)
-        
-            sagemaker_client = boto3.client("sagemaker")
-            
-            response = sagemaker_client.list_model_packages(
-                MaxResults=100,
-                ModelPackageGroupName=model_package_group_name,
-                ModelPackageType='Versioned',
-                SortBy='CreationTime',
-                SortOrder='Descending'
-            )
-        
-            model_package_arn = response["ModelPackageSummaryList"][0]["ModelPackageArn"]
-        
+
+            with phase("register_model_package"):
+                model_package = pipeline_model.register(
+                    content_types=["text/csv"],
+                    response_types=["application/x-npy"],
+                    model_package_group_name=model_package_group_name,
+                    approval_status=model_approval_status,
+                    model_metrics=model_metrics)
+
+            model_package_arn = model_package.model_package_arn
             print(f"Successfully registered model package {model_package_arn}.")
 
     return model_package_arn
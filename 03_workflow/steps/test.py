@@ -1,58 +1,81 @@
-import pandas as pd
-import numpy as np
 import os
-import xgboost
+import math
 
-from sklearn.metrics import roc_auc_score
-from sklearn.metrics import accuracy_score
-from sklearn.metrics import precision_score
-from sklearn.metrics import recall_score
-import mlflow
+from steps.lazy_imports import lazy_import
+from steps.profiling import profile_step, phase
+from steps.metrics import binary_classification_metrics, bootstrap_metrics, format_confusion_matrix
 
-def test(featurizer_model, booster, X_test, y_test, experiment_name="main_experiment", run_id="run-01"):
+xgboost = lazy_import('xgboost')
+mlflow = lazy_import('mlflow')
+
+def test(featurizer_model, booster, X_test, y_test, num_resamples=2000, time_budget=60.0,
+         experiment_name="main_experiment", run_id="run-01"):
     
     # Enable autologging in MLflow
     mlflow.set_tracking_uri(os.environ['MLFLOW_TRACKING_ARN'])    
     mlflow.set_experiment(experiment_name)
     with mlflow.start_run(run_id=run_id) as run:        
-        with mlflow.start_run(run_name="Test", nested=True):    
+        with mlflow.start_run(run_name="Test", nested=True), profile_step("test"):
             
             mlflow.autolog()
-            X_test = featurizer_model.transform(X_test)
-            y_test = y_test.values.reshape(-1)
+            with phase("transform"):
+                X_test = featurizer_model.transform(X_test)
+                y_test = y_test.values.reshape(-1)
         
-            dtest = xgboost.DMatrix(X_test, label=y_test)
-            test_predictions = booster.predict(dtest)
+            with phase("dmatrix_build"):
+                dtest = xgboost.DMatrix(X_test, label=y_test)
+            with phase("predict"):
+                test_predictions = booster.predict(dtest)
+            
+            # Operating point tuned on the validation set in train()
+            decision_threshold = float(booster.attr("decision_threshold") or 0.5)
+            print(f"Decision threshold: {decision_threshold:.4f}")
+            metrics = binary_classification_metrics(y_test, test_predictions, threshold=decision_threshold)
             
             print ("===Metrics for Test Set===")
             print('')
-            print (pd.crosstab(index=y_test, columns=np.round(test_predictions), 
-                                             rownames=['Actuals'], 
-                                             colnames=['Predictions'], 
-                                             margins=True))
+            print (format_confusion_matrix(metrics["confusion_matrix"]))
             print('')
         
-            rounded_predict = np.round(test_predictions)
-        
-            accuracy = accuracy_score(y_test, rounded_predict)
-            precision = precision_score(y_test, rounded_predict)
-            recall = recall_score(y_test, rounded_predict)
+            accuracy = metrics["accuracy"]
+            precision = metrics["precision"]
+            recall = metrics["recall"]
             print('')
         
             print("Accuracy Model A: %.2f%%" % (accuracy * 100.0))
             print("Precision Model A: %.2f" % (precision))
             print("Recall Model A: %.2f" % (recall))
         
-            auc = roc_auc_score(y_test, test_predictions)
+            auc = metrics["auc"]
             print("AUC A: %.2f" % (auc))
         
+            # Bootstrap the test predictions to estimate the variability of each metric
+            with phase("bootstrap"):
+                bootstrap = bootstrap_metrics(y_test, test_predictions, num_resamples=num_resamples,
+                                              threshold=decision_threshold, time_budget=time_budget)
+            print(f'Bootstrap resamples: {bootstrap["num_resamples"]}')
+            mlflow.log_metric("bootstrap_resamples", bootstrap["num_resamples"])
+            for name in ["recall", "precision", "accuracy", "auc"]:
+                print(f'{name}: mean {bootstrap[name]["mean"]:.4f}, standard deviation {bootstrap[name]["standard_deviation"]:.4f}')
+                mlflow.log_metric(f"bootstrap_{name}_mean", bootstrap[name]["mean"])
+                mlflow.log_metric(f"bootstrap_{name}_std", bootstrap[name]["standard_deviation"])
+        
+            # A metric that is undefined on every resample (AUC without both classes) has a
+            # NaN standard deviation, which is not valid JSON in the registered ModelMetrics
+            def metric_entry(name, value):
+                entry = {"value": value}
+                if math.isfinite(bootstrap[name]["standard_deviation"]):
+                    entry["standard_deviation"] = bootstrap[name]["standard_deviation"]
+                return entry
+        
             report_dict = {
                 "binary_classification_metrics": {
-                    "recall": {"value": recall, "standard_deviation": ""},
-                    "precision": {"value": precision, "standard_deviation": ""},
-                    "accuracy": {"value": accuracy, "standard_deviation": ""},
-                    "auc": {"value": auc, "standard_deviation": ""},
-                }
+                    "recall": metric_entry("recall", recall),
+                    "precision": metric_entry("precision", precision),
+                    "accuracy": metric_entry("accuracy", accuracy),
+                    "auc": metric_entry("auc", auc),
+                },
+                "decision_threshold": decision_threshold
             }
             print(f"evaluation report: {report_dict}")
 
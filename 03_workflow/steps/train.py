@@ -1,13 +1,56 @@
 import os
 import shutil
-import xgboost
 import numpy as np
-import pandas as pd
 
-from sklearn.metrics import roc_auc_score
-from sklearn.metrics import accuracy_score
-from sklearn.metrics import precision_score
-from sklearn.metrics import recall_score
+from steps.lazy_imports import lazy_import
+from steps.profiling import profile_step, phase, get_boost_round_timer
+from steps.model_dir import get_model_dir
+from steps.metrics import binary_classification_metrics, format_confusion_matrix, optimal_threshold
+
+xgboost = lazy_import('xgboost')
+pd = lazy_import('pandas')
+
+def fit_booster(dtrain, dval, y_val, param_dist, num_boost_round):
+    watchlist = [(dtrain, "train"), (dval, "validation")]
+    with phase("boost_rounds"):
+        xgb = xgboost.train(
+            params=param_dist,
+            dtrain=dtrain,
+            evals=watchlist,
+            num_boost_round=num_boost_round,
+            callbacks=[get_boost_round_timer()])
+
+    with phase("evaluate"):
+        predictions = xgb.predict(dval)
+
+        # Tune the decision threshold on the validation set and store it with the model,
+        # where test() and the inference code read it
+        decision_threshold, best = optimal_threshold(y_val, predictions, metric="f1")
+        xgb.set_attr(decision_threshold=str(decision_threshold))
+        print(f"Decision threshold: {decision_threshold:.4f} (validation F1 {best['f1']:.2f})")
+        metrics = binary_classification_metrics(y_val, predictions, threshold=decision_threshold)
+
+    print ("Metrics for validation set")
+    print('')
+    print (format_confusion_matrix(metrics["confusion_matrix"]))
+    print('')
+
+    val_accuracy = metrics["accuracy"]
+    val_precision = metrics["precision"]
+    val_recall = metrics["recall"]
+
+    print("Accuracy Model A: %.2f%%" % (val_accuracy * 100.0))
+    print("Precision Model A: %.2f" % (val_precision))
+    print("Recall Model A: %.2f" % (val_recall))
+
+    val_auc = metrics["auc"]
+    print("Validation AUC A: %.2f" % (val_auc))
+
+    model_file_path=os.path.join(get_model_dir(), "xgboost_model.bin")
+    with phase("serialization"):
+        xgb.save_model(model_file_path)
+
+    return xgb
 
 def train(X_train, y_train, X_val, y_val,
           eta=0.1, 
@@ -20,13 +63,12 @@ def train(X_train, y_train, X_val, y_val,
           num_boost_round=5, experiment_name="main_experiment", run_id="run-01"):
 
     import mlflow
-    import pandas as pd
 
     # Enable autologging in MLflow
     mlflow.set_tracking_uri(os.environ['MLFLOW_TRACKING_ARN'])    
     mlflow.set_experiment(experiment_name)
     with mlflow.start_run(run_id=run_id) as run:        
-        with mlflow.start_run(run_name="Train", nested=True):    
+        with mlflow.start_run(run_name="Train", nested=True), profile_step("train"):
             mlflow.autolog()
             print('Train features shape: {}'.format(X_train.shape))
             print('Train labels shape: {}'.format(y_train.shape))
@@ -34,9 +76,9 @@ def train(X_train, y_train, X_val, y_val,
             print('Validation labels shape: {}'.format(y_val.shape))
         
             # Creating DMatrix(es)
-            dtrain = xgboost.DMatrix(X_train, label=y_train)
-            dval = xgboost.DMatrix(X_val, label=y_val)
-            watchlist = [(dtrain, "train"), (dval, "validation")]
+            with phase("dmatrix_build"):
+                dtrain = xgboost.DMatrix(X_train, label=y_train)
+                dval = xgboost.DMatrix(X_val, label=y_val)
         
             print('')
             print (f'===Starting training with max_depth {max_depth}===')
@@ -51,35 +93,99 @@ def train(X_train, y_train, X_val, y_val,
                 "eval_metric": eval_metric
             }
             mlflow.log_dict(param_dist, "xgboost_params.json")
-            xgb = xgboost.train(
-                params=param_dist,
-                dtrain=dtrain,
-                evals=watchlist,
-                num_boost_round=num_boost_round)
-        
-            predictions = xgb.predict(dval)
-        
-            print ("Metrics for validation set")
-            print('')
-            print (pd.crosstab(index=y_val, columns=np.round(predictions),
-                               rownames=['Actuals'], colnames=['Predictions'], margins=True))
+            xgb = fit_booster(dtrain, dval, y_val, param_dist, num_boost_round)
+            mlflow.log_metric("decision_threshold", float(xgb.attr("decision_threshold")))
+
+    return xgb
+
+def list_shards(data_dir, split):
+    # Shards written by preprocess_streaming(): {split}_features_NNNNN.csv and {split}_labels_NNNNN.csv
+    import fsspec
+
+    fs, path = fsspec.core.url_to_fs(data_dir)
+    features_paths = sorted(fs.glob(f'{path.rstrip("/")}/{split}_features_*.csv'))
+    protocol = data_dir.split('://')[0] + '://' if '://' in data_dir else ''
+    return [(protocol + features_path, protocol + features_path.replace(f'{split}_features_', f'{split}_labels_'))
+            for features_path in features_paths]
+
+def get_shard_iter(shards, cache_prefix):
+
+    class ShardIter(xgboost.DataIter):
+        # Feeds one shard at a time to XGBoost. With a cache_prefix, XGBoost writes the
+        # quantized pages to local disk and only keeps the current page in memory
+        def __init__(self, shards, cache_prefix):
+            self._shards = shards
+            self._index = 0
+            super().__init__(cache_prefix=cache_prefix)
+
+        def next(self, input_data):
+            if self._index == len(self._shards):
+                return 0
+            features_path, labels_path = self._shards[self._index]
+            features = pd.read_csv(features_path, header=None, dtype=np.float32).values
+            labels = pd.read_csv(labels_path, header=None).values.reshape(-1)
+            input_data(data=features, label=labels)
+            self._index += 1
+            return 1
+
+        def reset(self):
+            self._index = 0
+
+    return ShardIter(shards, cache_prefix)
+
+def train_external_memory(train_dir, val_dir,
+                          eta=0.1,
+                          max_depth=3,
+                          gamma=0.0,
+                          min_child_weight=1,
+                          verbosity=0,
+                          objective='binary:logistic',
+                          eval_metric='auc',
+                          num_boost_round=5, cache_dir="/tmp/xgboost_cache",
+                          experiment_name="main_experiment", run_id="run-01"):
+    # Same as train() for the sharded output of preprocess_streaming(), for datasets
+    # that do not fit in memory. Saves the booster in the same format as train()
+
+    import mlflow
+
+    mlflow.set_tracking_uri(os.environ['MLFLOW_TRACKING_ARN'])    
+    mlflow.set_experiment(experiment_name)
+    with mlflow.start_run(run_id=run_id) as run:        
+        with mlflow.start_run(run_name="Train", nested=True), profile_step("train"):
+            mlflow.autolog()
+            train_shards = list_shards(train_dir, 'train')
+            val_shards = list_shards(val_dir, 'val')
+            print(f'Number of train shards: {len(train_shards)}')
+            print(f'Number of validation shards: {len(val_shards)}')
+
+            # External memory DMatrix(es), cached under cache_dir
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            os.makedirs(cache_dir, exist_ok=True)
+            with phase("dmatrix_build"):
+                dtrain = xgboost.DMatrix(get_shard_iter(train_shards, cache_prefix=os.path.join(cache_dir, 'train')))
+                dval = xgboost.DMatrix(get_shard_iter(val_shards, cache_prefix=os.path.join(cache_dir, 'val')))
+                y_val = dval.get_label()
+            print('Train features shape: ({}, {})'.format(dtrain.num_row(), dtrain.num_col()))
+            print('Validation features shape: ({}, {})'.format(dval.num_row(), dval.num_col()))
+
             print('')
-        
-            rounded_predict = np.round(predictions)
-        
-            val_accuracy = accuracy_score(y_val, rounded_predict)
-            val_precision = precision_score(y_val, rounded_predict)
-            val_recall = recall_score(y_val, rounded_predict)
-        
-            print("Accuracy Model A: %.2f%%" % (val_accuracy * 100.0))
-            print("Precision Model A: %.2f" % (val_precision))
-            print("Recall Model A: %.2f" % (val_recall))
-        
-            val_auc = roc_auc_score(y_val, predictions)
-            print("Validation AUC A: %.2f" % (val_auc))
-        
-            model_file_path="/opt/ml/model/xgboost_model.bin"
-            os.makedirs(os.path.dirname(model_file_path), exist_ok=True)
-            xgb.save_model(model_file_path)
+            print (f'===Starting external memory training with max_depth {max_depth}===')
+
+            # External memory is only supported by the hist tree method
+            param_dist = {
+                "max_depth": max_depth,
+                "eta": eta,
+                "gamma": gamma,
+                "min_child_weight": min_child_weight,
+                "verbosity": verbosity,
+                "objective": objective,
+                "eval_metric": eval_metric,
+                "tree_method": "hist"
+            }
+            mlflow.log_dict(param_dist, "xgboost_params.json")
+            xgb = fit_booster(dtrain, dval, y_val, param_dist, num_boost_round)
+            mlflow.log_metric("decision_threshold", float(xgb.attr("decision_threshold")))
+
+            shutil.rmtree(cache_dir, ignore_errors=True)
 
     return xgb
@@ -0,0 +1,140 @@
+import os
+import random
+
+from concurrent.futures import ProcessPoolExecutor
+from steps.lazy_imports import lazy_import
+from steps.metrics import sort_scores, roc_auc
+
+xgboost = lazy_import('xgboost')
+
+# Local hyperparameter search around train(): every worker process builds the
+# train/validation DMatrix(es) once and then trains many configurations with
+# successive halving on the validation AUC. Configurations that survive a rung
+# continue training from their booster instead of starting over.
+
+default_params = {
+    "eta": 0.1,
+    "max_depth": 3,
+    "gamma": 0.0,
+    "min_child_weight": 1,
+    "verbosity": 0,
+    "objective": "binary:logistic",
+    "eval_metric": "auc",
+}
+
+default_search_space = {
+    "eta": (0.01, 0.5),
+    "max_depth": [3, 4, 5, 6, 8, 10],
+    "gamma": (0.0, 5.0),
+    "min_child_weight": [1, 2, 4, 6, 8],
+}
+
+_worker_data = {}
+
+def sample_configs(search_space, num_configs, seed=0):
+    # Lists are sampled as choices, (low, high) tuples uniformly (as integers when both bounds are integers)
+    rng = random.Random(seed)
+    configs = []
+    for _ in range(num_configs):
+        config = {}
+        for name, values in search_space.items():
+            if isinstance(values, tuple):
+                low, high = values
+                config[name] = rng.randint(low, high) if isinstance(low, int) and isinstance(high, int) else rng.uniform(low, high)
+            else:
+                config[name] = rng.choice(values)
+        configs.append(config)
+    return configs
+
+def _init_worker(X_train, y_train, X_val, y_val, nthread):
+    _worker_data["dtrain"] = xgboost.DMatrix(X_train, label=y_train, nthread=nthread)
+    _worker_data["dval"] = xgboost.DMatrix(X_val, label=y_val, nthread=nthread)
+    _worker_data["y_val"] = y_val
+    _worker_data["nthread"] = nthread
+
+def _train_config(config_index, params, num_boost_round, model_raw=None):
+    dtrain, dval = _worker_data["dtrain"], _worker_data["dval"]
+    params = dict(params, nthread=_worker_data["nthread"])
+
+    xgb_model = None
+    if model_raw is not None:
+        xgb_model = xgboost.Booster(params, model_file=bytearray(model_raw))
+        num_boost_round -= xgb_model.num_boosted_rounds()
+
+    booster = xgboost.train(params=params, dtrain=dtrain, num_boost_round=num_boost_round, xgb_model=xgb_model)
+    val_auc = roc_auc(*sort_scores(_worker_data["y_val"], booster.predict(dval)))
+    return config_index, bytes(booster.save_raw()), val_auc
+
+def successive_halving(X_train, y_train, X_val, y_val, configs, min_boost_round=5, max_boost_round=45,
+                       reduction_factor=3, max_workers=None):
+    # Rung r trains the surviving configurations up to min_boost_round * reduction_factor**r
+    # rounds and keeps the best 1/reduction_factor of them for the next rung
+    max_workers = max_workers or os.cpu_count()
+    nthread = max(1, os.cpu_count() // max_workers)
+    num_rungs = 1
+    while min_boost_round * reduction_factor ** num_rungs <= max_boost_round:
+        num_rungs += 1
+
+    results = [{"config": config, "val_auc": float("nan"), "num_boost_round": 0, "history": []} for config in configs]
+    models = {}
+    survivors = list(range(len(configs)))
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(X_train, y_train, X_val, y_val, nthread)) as executor:
+        for rung in range(num_rungs):
+            num_boost_round = min(max_boost_round, min_boost_round * reduction_factor ** rung)
+            futures = [executor.submit(_train_config, i, dict(default_params, **configs[i]),
+                                       num_boost_round, models.get(i))
+                       for i in survivors]
+            for future in futures:
+                i, models[i], val_auc = future.result()
+                results[i].update(val_auc=val_auc, num_boost_round=num_boost_round)
+                results[i]["history"].append((num_boost_round, val_auc))
+
+            survivors.sort(key=lambda i: results[i]["val_auc"], reverse=True)
+            print(f'Rung {rung}: {len(survivors)} configurations trained for {num_boost_round} rounds, '
+                  f'best validation AUC {results[survivors[0]]["val_auc"]:.4f}')
+
+            # Only keep the boosters that can still be promoted
+            survivors = survivors[:max(1, len(survivors) // reduction_factor)]
+            models = {i: models[i] for i in survivors}
+
+    # Configurations that went further are ranked first, then by validation AUC
+    ranked = sorted(results, key=lambda result: (result["num_boost_round"], result["val_auc"]), reverse=True)
+    best_model = xgboost.Booster(model_file=bytearray(models[survivors[0]]))
+    return ranked, best_model
+
+def tune(X_train, y_train, X_val, y_val, search_space=None, num_configs=27,
+         min_boost_round=5, max_boost_round=45, reduction_factor=3, max_workers=None, seed=0,
+         experiment_name="main_experiment", run_id="run-01"):
+
+    import mlflow
+
+    configs = sample_configs(search_space or default_search_space, num_configs, seed)
+
+    mlflow.set_tracking_uri(os.environ['MLFLOW_TRACKING_ARN'])
+    mlflow.set_experiment(experiment_name)
+    with mlflow.start_run(run_id=run_id) as run:
+        with mlflow.start_run(run_name="Tune", nested=True):
+            print(f'===Tuning {num_configs} configurations with successive halving===')
+            mlflow.log_params({"num_configs": num_configs, "min_boost_round": min_boost_round,
+                               "max_boost_round": max_boost_round, "reduction_factor": reduction_factor})
+
+            ranked, best_model = successive_halving(X_train, y_train, X_val, y_val, configs,
+                                                    min_boost_round, max_boost_round, reduction_factor, max_workers)
+
+            for rank, result in enumerate(ranked, start=1):
+                with mlflow.start_run(run_name=f"Tune-{rank:03d}", nested=True):
+                    mlflow.log_params(dict(default_params, **result["config"]))
+                    for num_boost_round, val_auc in result["history"]:
+                        mlflow.log_metric("val_auc", val_auc, step=num_boost_round)
+                    mlflow.log_metric("rank", rank)
+                    mlflow.log_metric("num_boost_round", result["num_boost_round"])
+
+            best = ranked[0]
+            print(f'Best configuration: {best["config"]} with validation AUC {best["val_auc"]:.4f} '
+                  f'after {best["num_boost_round"]} rounds')
+            mlflow.log_params({f"best_{name}": value for name, value in best["config"].items()})
+            mlflow.log_metric("best_val_auc", best["val_auc"])
+
+    return ranked, best_model
@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+mlflow = pytest.importorskip('mlflow')
+pytest.importorskip('sagemaker')
+
+import pipeline
+from step_cache import StepCache
+
+# Runs run_steps_locally twice against a local MLflow store and step cache, with
+# the steps replaced by stubs that record the MLflow run they are given
+
+def preprocess_stub(input_data_s3_uri, experiment_name="main_experiment", run_name="run-01", run_id=None):
+    preprocess_stub.calls += 1
+    return 'X_train', 'y_train', 'X_val', 'y_val', 'X_test', 'y_test', 'featurizer', run_id
+
+def train_stub(X_train, y_train, X_val, y_val, eta=0.1, max_depth=3, experiment_name="main_experiment", run_id="run-01"):
+    return 'booster'
+
+def evaluate_stub(featurizer_model, booster, X_test, y_test, experiment_name="main_experiment", run_id="run-01"):
+    return {"binary_classification_metrics": {}}
+
+@pytest.fixture
+def local_run(tmp_path, monkeypatch):
+    monkeypatch.setenv('MLFLOW_TRACKING_ARN', (tmp_path / 'mlruns').as_uri())
+    monkeypatch.setenv('MODEL_DIR', str(tmp_path / 'model'))
+    preprocess_stub.calls = 0
+    step_run_ids = []
+    monkeypatch.setattr(pipeline, 'preprocess', preprocess_stub)
+    monkeypatch.setattr(pipeline, 'train', train_stub)
+    monkeypatch.setattr(pipeline, 'test', evaluate_stub)
+    monkeypatch.setattr(pipeline, 'register', lambda role, run_id, **kwargs: step_run_ids.append(run_id) or 'arn')
+    monkeypatch.setattr(pipeline, 'deploy', lambda role, project_prefix, run_id, **kwargs: step_run_ids.append(run_id))
+    step_cache = StepCache(str(tmp_path / 'step_cache'))
+    input_data = tmp_path / 'data.csv'
+    input_data.write_text('UDI,Type\n1,L\n')
+
+    def run(run_name):
+        return pipeline.run_steps_locally(step_cache, 'role', str(input_data), 'amzn', 'bucket',
+                                          'group', 'PendingManualApproval', 0.3, 8, False,
+                                          'local-experiment', run_name)
+    return run, step_run_ids
+
+def test_cache_hit_gets_a_new_mlflow_run(local_run):
+    run, step_run_ids = local_run
+    first_run_id = run('first')
+    second_run_id = run('second')
+
+    assert preprocess_stub.calls == 1
+    assert first_run_id != second_run_id
+    assert step_run_ids == [first_run_id, first_run_id, second_run_id, second_run_id]
+    assert mlflow.get_run(second_run_id).info.run_name == 'second'
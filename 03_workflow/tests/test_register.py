@@ -0,0 +1,58 @@
+import os
+import sys
+import json
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+moto = pytest.importorskip('moto')
+boto3 = pytest.importorskip('boto3')
+
+from steps import register
+
+# Runs the concurrent part of register() against moto, with the two
+# ModelBuilder builds replaced by stubs
+
+bucket_name = 'sagemaker-btd-test'
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=bucket_name)
+        yield client
+
+def test_upload_report(s3):
+    report = {"binary_classification_metrics": {"auc": {"value": 0.9, "standard_deviation": 0.01}}}
+    register.upload_report(report, f's3://{bucket_name}/group/evaluation-report/evaluation.json', s3)
+
+    response = s3.get_object(Bucket=bucket_name, Key='group/evaluation-report/evaluation.json')
+    assert response['ContentType'] == 'application/json'
+    assert json.loads(response['Body'].read()) == report
+
+def test_build_models_and_upload_report(s3, monkeypatch):
+    # Both stubs wait for each other, so the call only returns if the builds run in parallel
+    both_building = threading.Barrier(2, timeout=10)
+
+    def build_stub(name):
+        def build(role, model):
+            both_building.wait()
+            return (name, role, model)
+        return build
+
+    monkeypatch.setattr(register, 'build_sklearn_sagemaker_model', build_stub('sklearn'))
+    monkeypatch.setattr(register, 'build_xgboost_sagemaker_model', build_stub('xgboost'))
+
+    report = {"decision_threshold": 0.5}
+    sklearn_model, xgboost_model = register.build_models_and_upload_report(
+        'role', 'featurizer', 'booster', report, f's3://{bucket_name}/group/evaluation-report/evaluation.json')
+
+    assert sklearn_model == ('sklearn', 'role', 'featurizer')
+    assert xgboost_model == ('xgboost', 'role', 'booster')
+    body = s3.get_object(Bucket=bucket_name, Key='group/evaluation-report/evaluation.json')['Body'].read()
+    assert json.loads(body) == report
@@ -0,0 +1,39 @@
+import os
+import argparse
+import tempfile
+
+from steps.preprocess import preprocess
+from steps.tune import tune
+
+# Runs the hyperparameter search locally on the output of the Preprocess step,
+# instead of one pipeline execution per eta/max_depth pair
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input-data', default='/tmp/data/predictive_maintenance_raw_data_header.csv')
+    parser.add_argument('--num-configs', default=27, type=int)
+    parser.add_argument('--min-boost-round', default=5, type=int)
+    parser.add_argument('--max-boost-round', default=45, type=int)
+    parser.add_argument('--reduction-factor', default=3, type=int)
+    parser.add_argument('--max-workers', default=None, type=int)
+    parser.add_argument('--experiment-name', default='amzn-sm-btd-tuning')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    # preprocess writes the featurizer files to MODEL_DIR (/opt/ml/model by default)
+    os.environ.setdefault('MODEL_DIR', tempfile.mkdtemp(prefix='sagemaker-btd-model-'))
+
+    X_train, y_train, X_val, y_val, X_test, y_test, featurizer_model, run_id = preprocess(
+        args.input_data, experiment_name=args.experiment_name, run_name="LocalTuning")
+
+    ranked, best_model = tune(X_train, y_train, X_val, y_val, num_configs=args.num_configs,
+                              min_boost_round=args.min_boost_round, max_boost_round=args.max_boost_round,
+                              reduction_factor=args.reduction_factor, max_workers=args.max_workers,
+                              experiment_name=args.experiment_name, run_id=run_id)
+
+    print('')
+    print('Rank  Rounds  Validation AUC  Configuration')
+    for rank, result in enumerate(ranked, start=1):
+        print(f'{rank:4d}  {result["num_boost_round"]:6d}  {result["val_auc"]:14.4f}  {result["config"]}')
@@ -2,6 +2,7 @@ import argparse
 import os
 import warnings
 
+import numpy as np
 import pandas as pd
 import tarfile
 
@@ -15,6 +16,12 @@ from sagemaker.experiments import load_run
 
 import boto3
 
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+
 from sklearn.exceptions import DataConversionWarning
 warnings.filterwarnings(action='ignore', category=DataConversionWarning)
 
@@ -28,17 +35,123 @@ validation_ratio = 0.1
 test_ratio = 0.1
     
 
-def save_dataframe_to_file(output_path, fileName, df):
+def to_columnar_dataframe(df):
+    # The columnar format stores features as float32 and labels as int8
+    values = np.asarray(df)
+    if values.ndim == 1:
+        return pd.DataFrame({'label': values.astype(np.int8)})
+    return pd.DataFrame(values.astype(np.float32), columns=[str(i) for i in range(values.shape[1])])
+
+
+def get_output_file_path(output_path, fileName, output_format):
     if not os.path.exists(output_path):
             os.makedirs(output_path)
     path = os.path.join(output_path, fileName)
+    if output_format == 'parquet':
+        path = os.path.splitext(path)[0] + '.parquet'
+    return path
+
+
+def save_dataframe_to_file(output_path, fileName, df, output_format='csv'):
+    path = get_output_file_path(output_path, fileName, output_format)
     
     print('Saving to {}'.format(path))
-    pd.DataFrame(df).to_csv(path, header=False, index=False)
+    if output_format == 'parquet':
+        to_columnar_dataframe(df).to_parquet(path, index=False)
+    else:
+        pd.DataFrame(df).to_csv(path, header=False, index=False)
+    
+    return path
+
+
+def append_dataframe_to_file(output_path, fileName, df, output_format='csv', parquet_writers=None):
+    path = get_output_file_path(output_path, fileName, output_format)
+    
+    if output_format == 'parquet':
+        # Parquet files cannot be appended to, so keep one open writer per file
+        table = pyarrow.Table.from_pandas(to_columnar_dataframe(df), preserve_index=False)
+        if path not in parquet_writers:
+            parquet_writers[path] = pq.ParquetWriter(path, table.schema)
+        parquet_writers[path].write_table(table)
+    else:
+        pd.DataFrame(df).to_csv(path, header=False, index=False, mode='a')
     
     return path
 
 
+def hash_split(keys):
+    # Deterministic split membership from a hash of the row key: a row always lands
+    # in the same split regardless of chunking, and since the hash is independent of
+    # the label every class is split in the same train/validation/test proportions
+    # in expectation
+    buckets = (pd.util.hash_pandas_object(keys, index=False).values % 10000) / 10000.0
+    return np.where(buckets < training_ratio, 'train',
+                    np.where(buckets < training_ratio + validation_ratio, 'val', 'test'))
+
+
+def read_csv_chunks(input_data_path, chunk_size, key_column):
+    usecols = columns + [key_column] if key_column else columns
+    for chunk in pd.read_csv(input_data_path, usecols=usecols, chunksize=chunk_size):
+        # Without a key column the chunk index, which continues across chunks, is the row key
+        keys = chunk[key_column] if key_column else chunk.index.to_series()
+        yield chunk[columns], keys
+
+
+def fit_featurizer_streaming(input_data_path, chunk_size, key_column):
+    scaler = StandardScaler()
+    categories = set()
+    for chunk, keys in read_csv_chunks(input_data_path, chunk_size, key_column):
+        train_chunk = chunk[hash_split(keys) == 'train']
+        if len(train_chunk) > 0:
+            scaler.partial_fit(train_chunk[num_columns])
+            categories.update(train_chunk[cat_columns[0]].unique())
+
+    # Fit the usual ColumnTransformer on one row per category, then swap in the
+    # incrementally fitted scaler statistics
+    categories = sorted(categories)
+    seed_df = pd.DataFrame({cat_columns[0]: categories})
+    for i, column in enumerate(num_columns):
+        seed_df[column] = scaler.mean_[i]
+    transformer = ColumnTransformer(transformers=[('numeric', StandardScaler(), num_columns),
+                                                    ('categorical', OneHotEncoder(categories=[categories]), cat_columns)],
+                                    remainder='passthrough')
+    featurizer_model = transformer.fit(seed_df[num_columns + cat_columns])
+    vars(featurizer_model.named_transformers_['numeric']).update(vars(scaler))
+    return featurizer_model
+
+
+def preprocess_streaming(input_data_path, output_data_dir, chunk_size, key_column, output_format='csv'):
+    # Reads the input twice in chunks, first to fit the featurizer and then to
+    # append each chunk to the split files, so memory use does not grow with the input
+    featurizer_model = fit_featurizer_streaming(input_data_path, chunk_size, key_column)
+    parquet_writers = {}
+
+    for file_name in ['train_features.csv', 'train_labels.csv', 'val_features.csv', 'val_labels.csv',
+                      'test_features.csv', 'test_labels.csv']:
+        if os.path.exists(os.path.join(output_data_dir, file_name)):
+            os.remove(os.path.join(output_data_dir, file_name))
+
+    split_rows = {'train': 0, 'val': 0, 'test': 0}
+    for chunk, keys in read_csv_chunks(input_data_path, chunk_size, key_column):
+        splits = hash_split(keys)
+        for split in split_rows:
+            split_chunk = chunk[splits == split]
+            if len(split_chunk) == 0:
+                continue
+            features = featurizer_model.transform(split_chunk.drop(target_column, axis=1))
+            append_dataframe_to_file(output_data_dir, f'{split}_features.csv', features, output_format, parquet_writers)
+            append_dataframe_to_file(output_data_dir, f'{split}_labels.csv', split_chunk[target_column], output_format, parquet_writers)
+            split_rows[split] += len(split_chunk)
+
+    for writer in parquet_writers.values():
+        writer.close()
+
+    for split, num_rows in split_rows.items():
+        print(f'Number of {split} rows after preprocessing: {num_rows}')
+
+    return featurizer_model
+
+
 def parse_args():
 
     parser = argparse.ArgumentParser()
@@ -48,6 +161,9 @@ def parse_args():
     parser.add_argument('--featurizer-model-dir')
     parser.add_argument('--s3-bucket-name')
     parser.add_argument('--s3-key-prefix')
+    parser.add_argument('--chunk-size', type=int, default=None)
+    parser.add_argument('--key-column', default='UDI')
+    parser.add_argument('--output-format', choices=['csv', 'parquet'], default='csv')
 
     return parser.parse_known_args()
 
@@ -64,39 +180,54 @@ if __name__=='__main__':
     
     print(f'Input path is {input_data_path}')
     
-    # Read input data into a Pandas dataframe
-    df = pd.read_csv(input_data_path, usecols=columns)
-    X = df.drop(target_column, axis=1)
-    y = df[target_column]
+    output_format = args.output_format
+    if output_format == 'parquet' and pyarrow is None:
+        print('pyarrow is not installed, falling back to CSV output')
+        output_format = 'csv'
+    
+    if args.chunk_size:
+        print(f'Streaming input data in chunks of {args.chunk_size} rows')
+        print(f'Splitting data training ({training_ratio}), validation ({validation_ratio}), and test ({test_ratio}) sets ')
+        print(f'Output dir is {output_data_dir}')
+        featurizer_model = preprocess_streaming(input_data_path, output_data_dir, args.chunk_size, args.key_column, output_format)
 
-    print(f'Splitting data training ({training_ratio}), validation ({validation_ratio}), and test ({test_ratio}) sets ')
+        train_features_output_path = get_output_file_path(output_data_dir, 'train_features.csv', output_format)
+        val_features_output_path = get_output_file_path(output_data_dir, 'val_features.csv', output_format)
+        test_features_output_path = get_output_file_path(output_data_dir, 'test_features.csv', output_format)
+    else:
+        # Read input data into a Pandas dataframe
+        df = pd.read_csv(input_data_path, usecols=columns)
+        X = df.drop(target_column, axis=1)
+        y = df[target_column]
+
+        print(f'Splitting data training ({training_ratio}), validation ({validation_ratio}), and test ({test_ratio}) sets ')
     
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_ratio, random_state=0, stratify=y)
-    X_train, X_val, y_train, y_val = train_test_split(X_train, y_train, test_size=validation_ratio/(validation_ratio+training_ratio), random_state=2, stratify=y_train)
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_ratio, random_state=0, stratify=y)
+        X_train, X_val, y_train, y_val = train_test_split(X_train, y_train, test_size=validation_ratio/(validation_ratio+training_ratio), random_state=2, stratify=y_train)
     
-    #Apply transformations
-    transformer = ColumnTransformer(transformers=[('numeric', StandardScaler(), num_columns),
-                                                    ('categorical', OneHotEncoder(), cat_columns)],
-                                    remainder='passthrough')
-    featurizer_model = transformer.fit(X_train)
-    X_train = featurizer_model.transform(X_train)
-    X_val = featurizer_model.transform(X_val)
-    X_test = featurizer_model.transform(X_test)
+        #Apply transformations
+        transformer = ColumnTransformer(transformers=[('numeric', StandardScaler(), num_columns),
+                                                        ('categorical', OneHotEncoder(), cat_columns)],
+                                        remainder='passthrough')
+        featurizer_model = transformer.fit(X_train)
+        X_train = featurizer_model.transform(X_train)
+        X_val = featurizer_model.transform(X_val)
+        X_test = featurizer_model.transform(X_test)
     
-    print(f'Shape of train features after preprocessing: {X_train.shape}')
-    print(f'Shape of validation features after preprocessing: {X_val.shape}')
-    print(f'Shape of test features after preprocessing: {X_test.shape}')
+        print(f'Shape of train features after preprocessing: {X_train.shape}')
+        print(f'Shape of validation features after preprocessing: {X_val.shape}')
+        print(f'Shape of test features after preprocessing: {X_test.shape}')
     
-    print(f'Output dir is {output_data_dir}')
+        print(f'Output dir is {output_data_dir}')
                                                                 
-    train_features_output_path = save_dataframe_to_file(output_data_dir, 'train_features.csv', X_train)
-    train_labels_output_path = save_dataframe_to_file(output_data_dir, 'train_labels.csv', y_train)
+        train_features_output_path = save_dataframe_to_file(output_data_dir, 'train_features.csv', X_train, output_format)
+        train_labels_output_path = save_dataframe_to_file(output_data_dir, 'train_labels.csv', y_train, output_format)
 
-    val_features_output_path = save_dataframe_to_file(output_data_dir, 'val_features.csv', X_val)
-    val_labels_output_path = save_dataframe_to_file(output_data_dir, 'val_labels.csv', y_val)
+        val_features_output_path = save_dataframe_to_file(output_data_dir, 'val_features.csv', X_val, output_format)
+        val_labels_output_path = save_dataframe_to_file(output_data_dir, 'val_labels.csv', y_val, output_format)
     
-    test_features_output_path = save_dataframe_to_file(output_data_dir, 'test_features.csv', X_test)
-    test_labels_output_path = save_dataframe_to_file(output_data_dir, 'test_labels.csv', y_test)
+        test_features_output_path = save_dataframe_to_file(output_data_dir, 'test_features.csv', X_test, output_format)
+        test_labels_output_path = save_dataframe_to_file(output_data_dir, 'test_labels.csv', y_test, output_format)
                                                                 
     # Saving model artifacts
     if not os.path.exists(featurizer_model_dir):
@@ -113,6 +244,7 @@ if __name__=='__main__':
     boto_session = boto3.session.Session()
     sagemaker_session = Session(boto_session=boto_session)
     
+    media_type = 'application/x-parquet' if output_format == 'parquet' else 'text/csv'
     with load_run(sagemaker_session=sagemaker_session) as run:
 
         run.log_parameters(
@@ -122,7 +254,7 @@ if __name__=='__main__':
           'test': test_ratio
         })
 
-        run.log_artifact(name="train_data", value=train_features_output_path, media_type="text/csv", is_output=True)
-        run.log_artifact(name="val_data", value=val_features_output_path, media_type="text/csv", is_output=True)
-        run.log_artifact(name="test_data", value=test_features_output_path, media_type="text/csv", is_output=True)
+        run.log_artifact(name="train_data", value=train_features_output_path, media_type=media_type, is_output=True)
+        run.log_artifact(name="val_data", value=val_features_output_path, media_type=media_type, is_output=True)
+        run.log_artifact(name="test_data", value=test_features_output_path, media_type=media_type, is_output=True)
         run.log_artifact(name="featurizer_model", value=model_joblib_path, media_type="text/plain", is_output=True)
\ No newline at end of file
@@ -1,4 +1,5 @@
 import argparse
+import glob
 import os
 import pandas as pd
 import numpy as np
@@ -27,9 +28,73 @@ def parse_args():
     parser.add_argument('--objective', default='binary:logistic')
     parser.add_argument('--eval-metric', default='auc')
     parser.add_argument('--num-boost-round', default=5, type=int)
+    parser.add_argument('--external-memory', default=0, type=int)
+    parser.add_argument('--cache-dir', default='/tmp/xgboost_cache')
+    parser.add_argument('--batch-rows', default=1000000, type=int)
 
     return parser.parse_known_args()
 
+def load_split(data_dir, split):
+    # Prefer the columnar output of the preprocessing step and fall back to CSV
+    features_path = os.path.join(data_dir, f'{split}_features.parquet')
+    labels_path = os.path.join(data_dir, f'{split}_labels.parquet')
+    if os.path.exists(features_path):
+        features = pd.read_parquet(features_path).values
+        labels = pd.read_parquet(labels_path).values.reshape(-1)
+        return features, labels
+
+    features = pd.read_csv(os.path.join(data_dir, f'{split}_features.csv'), header=None).values
+    labels = pd.read_csv(os.path.join(data_dir, f'{split}_labels.csv'), header=None).values.reshape(-1)
+    return features, labels
+
+def list_shards(data_dir, split):
+    for extension in ['parquet', 'csv']:
+        features_paths = sorted(glob.glob(os.path.join(data_dir, f'{split}_features*.{extension}')))
+        if features_paths:
+            return [(path, path.replace(f'{split}_features', f'{split}_labels')) for path in features_paths]
+    return []
+
+def read_shard_batches(features_path, labels_path, batch_rows):
+    # Yields (features, labels) row batches of a shard without reading the whole file
+    if features_path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        features_batches = pq.ParquetFile(features_path).iter_batches(batch_size=batch_rows)
+        labels_batches = pq.ParquetFile(labels_path).iter_batches(batch_size=batch_rows)
+        for features, labels in zip(features_batches, labels_batches):
+            yield features.to_pandas().values, labels.to_pandas().values.reshape(-1)
+    else:
+        features_chunks = pd.read_csv(features_path, header=None, dtype=np.float32, chunksize=batch_rows)
+        labels_chunks = pd.read_csv(labels_path, header=None, chunksize=batch_rows)
+        for features, labels in zip(features_chunks, labels_chunks):
+            yield features.values, labels.values.reshape(-1)
+
+class ShardBatchIter(xgboost.DataIter):
+    # Feeds the preprocessed files to XGBoost in row batches. XGBoost spills the
+    # quantized pages to cache_prefix on local disk (external memory)
+    def __init__(self, shard_paths, batch_rows, cache_prefix):
+        self._shard_paths = shard_paths
+        self._batch_rows = batch_rows
+        self._batches = None
+        super().__init__(cache_prefix=cache_prefix)
+
+    def _read_batches(self):
+        for features_path, labels_path in self._shard_paths:
+            for batch in read_shard_batches(features_path, labels_path, self._batch_rows):
+                yield batch
+
+    def next(self, input_data):
+        if self._batches is None:
+            self._batches = self._read_batches()
+        batch = next(self._batches, None)
+        if batch is None:
+            return 0
+        features, labels = batch
+        input_data(data=features, label=labels)
+        return 1
+
+    def reset(self):
+        self._batches = None
+
 if __name__=='__main__':
 
     args, _ = parse_args()
@@ -47,32 +112,29 @@ if __name__=='__main__':
     eval_metric = args.eval_metric
     num_boost_round = args.num_boost_round
     
-    train_features_path = os.path.join(preprocessed_data_dir, 'train_features.csv')
-    train_labels_path = os.path.join(preprocessed_data_dir, 'train_labels.csv')
-    
-    val_features_path = os.path.join(preprocessed_data_dir, 'val_features.csv')
-    val_labels_path = os.path.join(preprocessed_data_dir, 'val_labels.csv')
-    
-    print('Loading training data...')
-    df_train_features = pd.read_csv(train_features_path, header=None)
-    df_train_labels = pd.read_csv(train_labels_path, header=None)
-    
-    print('Loading validation data...')
-    df_val_features = pd.read_csv(val_features_path, header=None)
-    df_val_labels = pd.read_csv(val_labels_path, header=None)
-
-    train_X = df_train_features.values
-    train_y = df_train_labels.values.reshape(-1)
-    print('Train features shape: {}'.format(X.shape))
-    print('Train labels shape: {}'.format(y.shape))
-    
-    val_X = df_val_features.values
-    val_y = df_val_labels.values.reshape(-1)
-    print('Validation features shape: {}'.format(val_X.shape))
-    print('Validation labels shape: {}'.format(val_y.shape))
+    if args.external_memory:
+        print('Loading training and validation data in external memory mode...')
+        os.makedirs(args.cache_dir, exist_ok=True)
+        dtrain = xgboost.DMatrix(ShardBatchIter(list_shards(preprocessed_data_dir, 'train'), args.batch_rows,
+                                                cache_prefix=os.path.join(args.cache_dir, 'train')))
+        dval = xgboost.DMatrix(ShardBatchIter(list_shards(preprocessed_data_dir, 'val'), args.batch_rows,
+                                              cache_prefix=os.path.join(args.cache_dir, 'val')))
+        val_y = dval.get_label()
+        print('Train features shape: ({}, {})'.format(dtrain.num_row(), dtrain.num_col()))
+        print('Validation features shape: ({}, {})'.format(dval.num_row(), dval.num_col()))
+    else:
+        print('Loading training data...')
+        train_X, train_y = load_split(preprocessed_data_dir, 'train')
+        print('Train features shape: {}'.format(train_X.shape))
+        print('Train labels shape: {}'.format(train_y.shape))
+        
+        print('Loading validation data...')
+        val_X, val_y = load_split(preprocessed_data_dir, 'val')
+        print('Validation features shape: {}'.format(val_X.shape))
+        print('Validation labels shape: {}'.format(val_y.shape))
 
-    dtrain = xgboost.DMatrix(train_X, label=train_y)
-    dval = xgboost.DMatrix(val_X, label=val_y)
+        dtrain = xgboost.DMatrix(train_X, label=train_y)
+        dval = xgboost.DMatrix(val_X, label=val_y)
     watchlist = [(dtrain, "train"), (dval, "validation")]
        
     print('')
@@ -89,6 +151,9 @@ if __name__=='__main__':
             "objective": objective,
             "eval_metric": eval_metric
         }
+        # External memory is only supported by the hist tree method
+        if args.external_memory:
+            param_dist["tree_method"] = "hist"
         
         run.log_parameters(param_dist)
             
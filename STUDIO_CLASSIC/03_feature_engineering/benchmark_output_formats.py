@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Compares the CSV files written by source_dir/preprocessor.py with its columnar
+# (Parquet, float32 features and int8 labels) output format
+
+def write_csv(features, labels, output_dir):
+    pd.DataFrame(features).to_csv(os.path.join(output_dir, 'features.csv'), header=False, index=False)
+    pd.DataFrame(labels).to_csv(os.path.join(output_dir, 'labels.csv'), header=False, index=False)
+    return [os.path.join(output_dir, 'features.csv'), os.path.join(output_dir, 'labels.csv')]
+
+def read_csv(output_dir):
+    features = pd.read_csv(os.path.join(output_dir, 'features.csv'), header=None).values
+    labels = pd.read_csv(os.path.join(output_dir, 'labels.csv'), header=None).values.reshape(-1)
+    return features, labels
+
+def write_parquet(features, labels, output_dir):
+    columns = [str(i) for i in range(features.shape[1])]
+    pd.DataFrame(features.astype(np.float32), columns=columns).to_parquet(os.path.join(output_dir, 'features.parquet'), index=False)
+    pd.DataFrame({'label': labels.astype(np.int8)}).to_parquet(os.path.join(output_dir, 'labels.parquet'), index=False)
+    return [os.path.join(output_dir, 'features.parquet'), os.path.join(output_dir, 'labels.parquet')]
+
+def read_parquet(output_dir):
+    features = pd.read_parquet(os.path.join(output_dir, 'features.parquet')).values
+    labels = pd.read_parquet(os.path.join(output_dir, 'labels.parquet')).values.reshape(-1)
+    return features, labels
+
+def run_benchmark(num_rows):
+    rng = np.random.default_rng(0)
+    features = rng.standard_normal((num_rows, 8))
+    labels = (rng.random(num_rows) < 0.03).astype(int)
+
+    print(f'{num_rows} rows')
+    for name, write, read in [('csv', write_csv, read_csv), ('parquet', write_parquet, read_parquet)]:
+        with tempfile.TemporaryDirectory() as output_dir:
+            start = time.perf_counter()
+            paths = write(features, labels, output_dir)
+            write_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            read(output_dir)
+            read_time = time.perf_counter() - start
+
+            size_mb = sum(os.path.getsize(path) for path in paths) / 1024 ** 2
+            print(f'{name:<8} write: {write_time:8.2f} s   read: {read_time:8.2f} s   size: {size_mb:10.1f} MB')
+    print('')
+
+if __name__ == "__main__":
+    row_counts = [int(arg) for arg in sys.argv[1:]] or [1000000, 10000000]
+    for num_rows in row_counts:
+        run_benchmark(num_rows)
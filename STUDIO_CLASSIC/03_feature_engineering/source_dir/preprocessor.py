@@ -8,6 +8,12 @@ import tarfile
 
 import boto3
 
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+
 from sklearn.externals import joblib
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler, OneHotEncoder
@@ -23,10 +29,121 @@ num_columns = ['Air temperature [K]', 'Process temperature [K]', 'Rotational spe
 target_column = 'Machine failure'
 
 
+def to_columnar_dataframe(data):
+    # The columnar format stores features as float32 and labels as int8
+    values = np.asarray(data)
+    if values.ndim == 1:
+        return pd.DataFrame({'label': values.astype(np.int8)})
+    return pd.DataFrame(values.astype(np.float32), columns=[str(i) for i in range(values.shape[1])])
+
+
+def save_dataframe(data, path, output_format='csv'):
+    if output_format == 'parquet':
+        to_columnar_dataframe(data).to_parquet(path, index=False)
+    elif output_format == 'npy':
+        # Raw arrays that the training script can memory-map
+        values = np.asarray(data)
+        values = values.astype(np.int8) if values.ndim == 1 else np.ascontiguousarray(values, dtype=np.float32)
+        np.save(path, values)
+    else:
+        pd.DataFrame(data).to_csv(path, header=False, index=False)
+
+
+def append_dataframe(data, path, output_format='csv', parquet_writers=None):
+    if output_format == 'parquet':
+        # Parquet files cannot be appended to, so keep one open writer per file
+        table = pyarrow.Table.from_pandas(to_columnar_dataframe(data), preserve_index=False)
+        if path not in parquet_writers:
+            parquet_writers[path] = pq.ParquetWriter(path, table.schema)
+        parquet_writers[path].write_table(table)
+    else:
+        pd.DataFrame(data).to_csv(path, header=False, index=False, mode='a')
+
+
+def hash_split(keys, train_ratio, val_ratio):
+    # Deterministic split membership from a hash of the row key: a row always lands
+    # in the same split regardless of chunking, and since the hash is independent of
+    # the label every class is split in the same train/validation/test proportions
+    # in expectation
+    buckets = (pd.util.hash_pandas_object(keys, index=False).values % 10000) / 10000.0
+    return np.where(buckets < train_ratio, 'train',
+                    np.where(buckets < train_ratio + val_ratio, 'val', 'test'))
+
+
+def read_csv_chunks(input_data_path, chunk_size, key_column):
+    usecols = columns + [key_column] if key_column else columns
+    for chunk in pd.read_csv(input_data_path, usecols=usecols, chunksize=chunk_size):
+        # Without a key column the chunk index, which continues across chunks, is the row key
+        keys = chunk[key_column] if key_column else chunk.index.to_series()
+        yield chunk[columns], keys
+
+
+def fit_featurizer_streaming(input_data_path, chunk_size, key_column, train_ratio, val_ratio):
+    scaler = StandardScaler()
+    categories = set()
+    for chunk, keys in read_csv_chunks(input_data_path, chunk_size, key_column):
+        train_chunk = chunk[hash_split(keys, train_ratio, val_ratio) == 'train']
+        if len(train_chunk) > 0:
+            scaler.partial_fit(train_chunk[num_columns])
+            categories.update(train_chunk[cat_columns[0]].unique())
+
+    # Fit the usual ColumnTransformer on one row per category, then swap in the
+    # incrementally fitted scaler statistics
+    categories = sorted(categories)
+    seed_df = pd.DataFrame({cat_columns[0]: categories})
+    for i, column in enumerate(num_columns):
+        seed_df[column] = scaler.mean_[i]
+    transformer = ColumnTransformer(transformers=[('numeric', StandardScaler(), num_columns),
+                                                  ('categorical', OneHotEncoder(categories=[categories]), cat_columns)],
+                                    remainder='passthrough')
+    featurizer_model = transformer.fit(seed_df[num_columns + cat_columns])
+    vars(featurizer_model.named_transformers_['numeric']).update(vars(scaler))
+    return featurizer_model
+
+
+def preprocess_streaming(input_data_path, chunk_size, key_column, train_ratio, val_ratio, output_format='csv'):
+    # Reads the input twice in chunks, first to fit the featurizer and then to
+    # append each chunk to the split files, so memory use does not grow with the input
+    featurizer_model = fit_featurizer_streaming(input_data_path, chunk_size, key_column, train_ratio, val_ratio)
+    parquet_writers = {}
+
+    split_rows = {'train': 0, 'val': 0, 'test': 0}
+    for shard, (chunk, keys) in enumerate(read_csv_chunks(input_data_path, chunk_size, key_column)):
+        splits = hash_split(keys, train_ratio, val_ratio)
+        for split in split_rows:
+            split_chunk = chunk[splits == split]
+            if len(split_chunk) == 0:
+                continue
+            features = featurizer_model.transform(split_chunk.drop(target_column, axis=1))
+            if output_format == 'npy':
+                # .npy files cannot be appended to, so every chunk is written as its own shard
+                features_output_path = os.path.join('/opt/ml/processing', split, f'{split}_features_{shard:05d}.npy')
+                labels_output_path = os.path.join('/opt/ml/processing', split, f'{split}_labels_{shard:05d}.npy')
+                save_dataframe(features, features_output_path, output_format)
+                save_dataframe(split_chunk[target_column], labels_output_path, output_format)
+            else:
+                features_output_path = os.path.join('/opt/ml/processing', split, f'{split}_features.{output_format}')
+                labels_output_path = os.path.join('/opt/ml/processing', split, f'{split}_labels.{output_format}')
+                append_dataframe(features, features_output_path, output_format, parquet_writers)
+                append_dataframe(split_chunk[target_column], labels_output_path, output_format, parquet_writers)
+            split_rows[split] += len(split_chunk)
+
+    for writer in parquet_writers.values():
+        writer.close()
+
+    for split, num_rows in split_rows.items():
+        print(f'Number of {split} rows after preprocessing: {num_rows}')
+
+    return featurizer_model
+
+
 def parse_args():
     
     parser = argparse.ArgumentParser()
     parser.add_argument('--train-test-split-ratio', type=float, default=0.3)
+    parser.add_argument('--chunk-size', type=int, default=None)
+    parser.add_argument('--key-column', default='UDI')
+    parser.add_argument('--output-format', choices=['csv', 'parquet', 'npy'], default='csv')
     args, _ = parser.parse_known_args()
     return args    
 
@@ -40,62 +157,73 @@ if __name__=='__main__':
     train_ratio = (1 - args.train_test_split_ratio)
     val_ratio = test_ratio = args.train_test_split_ratio / 2
 
-    # Read input data into a Pandas dataframe.
     input_data_path = os.path.join('/opt/ml/processing/input', 'predictive_maintenance_raw_data_header.csv')
-    print('Reading input data from {}'.format(input_data_path))
-    df = pd.read_csv(input_data_path, usecols=columns)
-    
-    X = df.drop(target_column, axis=1)
-    y = df[target_column]
-    
-    print(f'Splitting data training ({train_ratio}), validation ({val_ratio}), and test ({test_ratio}) sets ')
-    
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_ratio, random_state=0, stratify=y)
-    X_train, X_val, y_train, y_val = train_test_split(X_train, y_train, test_size=val_ratio/(val_ratio+train_ratio), random_state=2, stratify=y_train)
+
+    output_format = args.output_format
+    if output_format == 'parquet' and pyarrow is None:
+        print('pyarrow is not installed, falling back to CSV output')
+        output_format = 'csv'
+
+    if args.chunk_size:
+        print(f'Streaming input data from {input_data_path} in chunks of {args.chunk_size} rows')
+        print(f'Splitting data training ({train_ratio}), validation ({val_ratio}), and test ({test_ratio}) sets ')
+        featurizer_model = preprocess_streaming(input_data_path, args.chunk_size, args.key_column, train_ratio, val_ratio, output_format)
+    else:
+        # Read input data into a Pandas dataframe.
+        print('Reading input data from {}'.format(input_data_path))
+        df = pd.read_csv(input_data_path, usecols=columns)
+    
+        X = df.drop(target_column, axis=1)
+        y = df[target_column]
+    
+        print(f'Splitting data training ({train_ratio}), validation ({val_ratio}), and test ({test_ratio}) sets ')
+    
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_ratio, random_state=0, stratify=y)
+        X_train, X_val, y_train, y_val = train_test_split(X_train, y_train, test_size=val_ratio/(val_ratio+train_ratio), random_state=2, stratify=y_train)
         
-    transformer = ColumnTransformer(transformers=[('numeric', StandardScaler(), num_columns),
-                                                  ('categorical', OneHotEncoder(), cat_columns)],
-                                    remainder='passthrough')
-    
-    featurizer_model = transformer.fit(X_train)
-    X_train = featurizer_model.transform(X_train)
-    X_val = featurizer_model.transform(X_val)
-    X_test = featurizer_model.transform(X_test)
-    
-    print(f'Shape of training features after preprocessing: {X_train.shape}')
-    print(f'Shape of training labels after preprocessing: {y_train.shape}')
-    print(f'Shape of validation features after preprocessing: {X_val.shape}')
-    print(f'Shape of validation labels after preprocessing: {y_val.shape}')
-    print(f'Shape of test features after preprocessing: {X_test.shape}')
-    print(f'Shape of test labels after preprocessing: {y_test.shape}')
-    
-    # Save outputs
-    train_features_output_path = os.path.join('/opt/ml/processing/train', 'train_features.csv')
-    train_labels_output_path = os.path.join('/opt/ml/processing/train', 'train_labels.csv')
-    
-    val_features_output_path = os.path.join('/opt/ml/processing/val', 'val_features.csv')
-    val_labels_output_path = os.path.join('/opt/ml/processing/val', 'val_labels.csv')
+        transformer = ColumnTransformer(transformers=[('numeric', StandardScaler(), num_columns),
+                                                      ('categorical', OneHotEncoder(), cat_columns)],
+                                        remainder='passthrough')
+    
+        featurizer_model = transformer.fit(X_train)
+        X_train = featurizer_model.transform(X_train)
+        X_val = featurizer_model.transform(X_val)
+        X_test = featurizer_model.transform(X_test)
+    
+        print(f'Shape of training features after preprocessing: {X_train.shape}')
+        print(f'Shape of training labels after preprocessing: {y_train.shape}')
+        print(f'Shape of validation features after preprocessing: {X_val.shape}')
+        print(f'Shape of validation labels after preprocessing: {y_val.shape}')
+        print(f'Shape of test features after preprocessing: {X_test.shape}')
+        print(f'Shape of test labels after preprocessing: {y_test.shape}')
+    
+        # Save outputs
+        train_features_output_path = os.path.join('/opt/ml/processing/train', f'train_features.{output_format}')
+        train_labels_output_path = os.path.join('/opt/ml/processing/train', f'train_labels.{output_format}')
+    
+        val_features_output_path = os.path.join('/opt/ml/processing/val', f'val_features.{output_format}')
+        val_labels_output_path = os.path.join('/opt/ml/processing/val', f'val_labels.{output_format}')
 
-    test_features_output_path = os.path.join('/opt/ml/processing/test', 'test_features.csv')
-    test_labels_output_path = os.path.join('/opt/ml/processing/test', 'test_labels.csv')
+        test_features_output_path = os.path.join('/opt/ml/processing/test', f'test_features.{output_format}')
+        test_labels_output_path = os.path.join('/opt/ml/processing/test', f'test_labels.{output_format}')
     
-    print(f'Saving training features to {train_features_output_path}')
-    pd.DataFrame(X_train).to_csv(train_features_output_path, header=False, index=False)
+        print(f'Saving training features to {train_features_output_path}')
+        save_dataframe(X_train, train_features_output_path, output_format)
     
-    print(f'Saving validation features to {val_features_output_path}')
-    pd.DataFrame(X_val).to_csv(val_features_output_path, header=False, index=False)
+        print(f'Saving validation features to {val_features_output_path}')
+        save_dataframe(X_val, val_features_output_path, output_format)
     
-    print(f'Saving test features to {test_features_output_path}')
-    pd.DataFrame(X_test).to_csv(test_features_output_path, header=False, index=False)    
+        print(f'Saving test features to {test_features_output_path}')
+        save_dataframe(X_test, test_features_output_path, output_format)    
     
-    print(f'Saving training labels to {train_labels_output_path}')
-    pd.DataFrame(y_train).to_csv(train_labels_output_path, header=False, index=False)
+        print(f'Saving training labels to {train_labels_output_path}')
+        save_dataframe(y_train, train_labels_output_path, output_format)
     
-    print(f'Saving validation labels to {val_labels_output_path}')
-    pd.DataFrame(y_val).to_csv(val_labels_output_path, header=False, index=False)
+        print(f'Saving validation labels to {val_labels_output_path}')
+        save_dataframe(y_val, val_labels_output_path, output_format)
     
-    print(f'Saving test labels to {test_labels_output_path}')
-    pd.DataFrame(y_test).to_csv(test_labels_output_path, header=False, index=False)    
+        print(f'Saving test labels to {test_labels_output_path}')
+        save_dataframe(y_test, test_labels_output_path, output_format)    
     
     # Save the model
     model_path = os.path.join('/opt/ml/processing/model', 'model.joblib')
@@ -0,0 +1,44 @@
+import os
+import re
+import sys
+import tempfile
+import subprocess
+
+import numpy as np
+import pandas as pd
+
+# Runs source_dir/training.py on the same synthetic data stored as CSV and as
+# memory-mapped .npy files, and reports the peak RSS and time to first boost
+# round printed by the script
+
+training_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'source_dir', 'training.py')
+
+def write_dataset(data_dir, num_rows, data_format):
+    rng = np.random.default_rng(0)
+    for split, split_rows in [('train', num_rows), ('val', num_rows // 8)]:
+        features = rng.standard_normal((split_rows, 8)).astype(np.float32)
+        labels = (features[:, 0] + rng.standard_normal(split_rows) > 2.0).astype(np.int8)
+        if data_format == 'npy':
+            np.save(os.path.join(data_dir, f'{split}_features.npy'), features)
+            np.save(os.path.join(data_dir, f'{split}_labels.npy'), labels)
+        else:
+            pd.DataFrame(features).to_csv(os.path.join(data_dir, f'{split}_features.csv'), header=False, index=False)
+            pd.DataFrame(labels).to_csv(os.path.join(data_dir, f'{split}_labels.csv'), header=False, index=False)
+
+def run_training(data_dir, model_dir):
+    env = dict(os.environ, SM_MODEL_DIR=model_dir)
+    output = subprocess.run([sys.executable, training_script, '--train', data_dir, '--validation', data_dir, '--num_round', '1'],
+                            env=env, capture_output=True, text=True, check=True).stdout
+    first_round = re.search(r'Time to first boost round: ([\d.]+) s', output)
+    peak_rss = re.search(r'Peak RSS: ([\d.]+) MB', output)
+    return float(first_round.group(1)) if first_round else float('nan'), float(peak_rss.group(1))
+
+if __name__ == "__main__":
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+
+    print(f'{num_rows} training rows')
+    for data_format in ['csv', 'npy']:
+        with tempfile.TemporaryDirectory() as data_dir, tempfile.TemporaryDirectory() as model_dir:
+            write_dataset(data_dir, num_rows, data_format)
+            first_round, peak_rss = run_training(data_dir, model_dir)
+            print(f'{data_format:<4} time to first boost round: {first_round:8.2f} s   peak RSS: {peak_rss:10.1f} MB')
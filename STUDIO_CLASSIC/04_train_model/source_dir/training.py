@@ -1,13 +1,28 @@
 import argparse
 import json
 import os
+import time
 import random
+import resource
+import numpy as np
 import pandas as pd
 import glob
-import pickle as pkl
 
 import xgboost
 
+# DataIter, QuantileDMatrix and TrainingCallback are not available in older XGBoost versions
+DataIter = getattr(xgboost, 'DataIter', object)
+TrainingCallback = getattr(getattr(xgboost, 'callback', None), 'TrainingCallback', object)
+
+def save_booster(bst, model_dir):
+    # Native model format instead of a pickle of the Booster: UBJSON where the library
+    # supports it (1.6 and later), the binary format of the library otherwise.
+    # model_fn in 05_deploy_model/xgboost_source_dir/inference.py loads either
+    version = tuple(int(part) for part in xgboost.__version__.split('.')[:2])
+    file_name = 'model.ubj' if version >= (1, 6) else 'model.bin'
+    bst.save_model(os.path.join(model_dir, file_name))
+    print('Saved model to {}'.format(file_name))
+
 def parse_args():
 
     parser = argparse.ArgumentParser()
@@ -23,43 +38,171 @@ def parse_args():
     
     parser.add_argument('--train', type=str, default=os.environ.get('SM_CHANNEL_TRAIN'))
     parser.add_argument('--validation', type=str, default=os.environ.get('SM_CHANNEL_VALIDATION'))
+    parser.add_argument('--batch_rows', type=int, default=1000000)
+    parser.add_argument('--external_memory', type=int, default=0)
+    parser.add_argument('--cache_dir', type=str, default='/tmp/xgboost_cache')
 
     args = parser.parse_args()
 
     return args
 
+def load_split(data_dir, split):
+    # Prefer the columnar output of the preprocessing step and fall back to CSV
+    features_path = os.path.join(data_dir, f'{split}_features.parquet')
+    labels_path = os.path.join(data_dir, f'{split}_labels.parquet')
+    if os.path.exists(features_path):
+        features = pd.read_parquet(features_path).values
+        labels = pd.read_parquet(labels_path).values.reshape(-1)
+        return features, labels
+
+    features = pd.read_csv(os.path.join(data_dir, f'{split}_features.csv'), header=None).values
+    labels = pd.read_csv(os.path.join(data_dir, f'{split}_labels.csv'), header=None).values.reshape(-1)
+    return features, labels
+
+def list_shards(data_dir, split, extensions=('npy', 'parquet', 'csv')):
+    # {split}_features.{ext}, or one {split}_features_NNNNN.{ext} per chunk when preprocessed in streaming mode
+    for extension in extensions:
+        features_paths = sorted(glob.glob(os.path.join(data_dir, f'{split}_features*.{extension}')))
+        if features_paths:
+            return [(path, path.replace(f'{split}_features', f'{split}_labels')) for path in features_paths]
+    return []
+
+def list_npy_shards(data_dir, split):
+    return list_shards(data_dir, split, extensions=('npy',))
+
+def read_shard_batches(features_path, labels_path, batch_rows):
+    # Yields (features, labels) row batches of a shard without reading the whole file
+    if features_path.endswith('.npy'):
+        features = np.load(features_path, mmap_mode='r')
+        labels = np.load(labels_path, mmap_mode='r')
+        for start in range(0, features.shape[0], batch_rows):
+            yield features[start:start + batch_rows], labels[start:start + batch_rows]
+    elif features_path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        features_batches = pq.ParquetFile(features_path).iter_batches(batch_size=batch_rows)
+        labels_batches = pq.ParquetFile(labels_path).iter_batches(batch_size=batch_rows)
+        for features, labels in zip(features_batches, labels_batches):
+            yield features.to_pandas().values, labels.to_pandas().values.reshape(-1)
+    else:
+        features_chunks = pd.read_csv(features_path, header=None, dtype=np.float32, chunksize=batch_rows)
+        labels_chunks = pd.read_csv(labels_path, header=None, chunksize=batch_rows)
+        for features, labels in zip(features_chunks, labels_chunks):
+            yield features.values, labels.values.reshape(-1)
+
+class ShardBatchIter(DataIter):
+    # Feeds the shards to XGBoost in row batches, so the dataset is never copied into
+    # the Python heap as a whole. With a cache_prefix XGBoost also spills the
+    # quantized pages to local disk (external memory)
+    def __init__(self, shard_paths, batch_rows, cache_prefix=None):
+        self._shard_paths = shard_paths
+        self._batch_rows = batch_rows
+        self._batches = None
+        if cache_prefix is None:
+            super().__init__()
+        else:
+            super().__init__(cache_prefix=cache_prefix)
+
+    def _read_batches(self):
+        for features_path, labels_path in self._shard_paths:
+            for batch in read_shard_batches(features_path, labels_path, self._batch_rows):
+                yield batch
+
+    def next(self, input_data):
+        if self._batches is None:
+            self._batches = self._read_batches()
+        batch = next(self._batches, None)
+        if batch is None:
+            return 0
+        features, labels = batch
+        input_data(data=features, label=labels)
+        return 1
+
+    def reset(self):
+        self._batches = None
+
+def load_external_memory_dmatrices(train_dir, val_dir, batch_rows, cache_dir):
+    if DataIter is object:
+        raise RuntimeError(f'External memory training requires XGBoost 1.5 or later, found {xgboost.__version__}')
+    os.makedirs(cache_dir, exist_ok=True)
+    dtrain = xgboost.DMatrix(ShardBatchIter(list_shards(train_dir, 'train'), batch_rows,
+                                            cache_prefix=os.path.join(cache_dir, 'train')))
+    dval = xgboost.DMatrix(ShardBatchIter(list_shards(val_dir, 'val'), batch_rows,
+                                          cache_prefix=os.path.join(cache_dir, 'val')))
+    return dtrain, dval
+
+def load_npy_dmatrices(train_dir, val_dir, batch_rows):
+    train_shards = list_npy_shards(train_dir, 'train')
+    val_shards = list_npy_shards(val_dir, 'val')
+
+    if hasattr(xgboost, 'QuantileDMatrix'):
+        dtrain = xgboost.QuantileDMatrix(ShardBatchIter(train_shards, batch_rows))
+        dval = xgboost.QuantileDMatrix(ShardBatchIter(val_shards, batch_rows), ref=dtrain)
+        return dtrain, dval
+
+    # Older XGBoost versions need the data in memory
+    def load(shards):
+        features = np.concatenate([np.load(features_path, mmap_mode='r') for features_path, _ in shards])
+        labels = np.concatenate([np.load(labels_path, mmap_mode='r') for _, labels_path in shards])
+        return xgboost.DMatrix(features, label=labels)
+    return load(train_shards), load(val_shards)
+
+def optimal_f1_threshold(labels, scores):
+    # Sorts the scores once and computes the F1 score of score > threshold for a
+    # threshold between every pair of consecutive distinct scores
+    order = np.argsort(scores)[::-1]
+    sorted_scores = scores[order]
+    true_positives = np.cumsum(labels[order] != 0)
+    last_of_ties = np.r_[np.flatnonzero(sorted_scores[1:] != sorted_scores[:-1]), len(sorted_scores) - 1]
+    tps = true_positives[last_of_ties]
+    f1 = 2.0 * tps / (last_of_ties + 1 + true_positives[-1])
+    distinct_scores = sorted_scores[last_of_ties].astype(np.float64)
+    thresholds = np.r_[(distinct_scores[:-1] + distinct_scores[1:]) / 2.0, np.nextafter(distinct_scores[-1], -np.inf)]
+    best = int(np.argmax(f1))
+    return float(thresholds[best]), float(f1[best])
+
+class FirstRoundTimer(TrainingCallback):
+    def __init__(self, start_time):
+        self.start_time = start_time
+        super().__init__()
+
+    def after_iteration(self, model, epoch, evals_log):
+        if epoch == 0:
+            print('Time to first boost round: {:.2f} s'.format(time.time() - self.start_time))
+        return False
+
 def main():
 
     args = parse_args()
     train_files_path, validation_files_path = args.train, args.validation
     
-    train_features_path = os.path.join(args.train, 'train_features.csv')
-    train_labels_path = os.path.join(args.train, 'train_labels.csv')
-    
-    val_features_path = os.path.join(args.validation, 'val_features.csv')
-    val_labels_path = os.path.join(args.validation, 'val_labels.csv')
+    start_time = time.time()
     
-    print('Loading training dataframes...')
-    df_train_features = pd.read_csv(train_features_path, header=None)
-    df_train_labels = pd.read_csv(train_labels_path, header=None)
-    
-    print('Loading validation dataframes...')
-    df_val_features = pd.read_csv(val_features_path, header=None)
-    df_val_labels = pd.read_csv(val_labels_path, header=None)
-    
-    X = df_train_features.values
-    y = df_train_labels.values.reshape(-1)
-    
-    val_X = df_val_features.values
-    val_y = df_val_labels.values.reshape(-1)
-    
-    print('Train features shape: {}'.format(X.shape))
-    print('Train labels shape: {}'.format(y.shape))
-    print('Validation features shape: {}'.format(val_X.shape))
-    print('Validation labels shape: {}'.format(val_y.shape))
+    if args.external_memory:
+        print('Loading training and validation data in external memory mode...')
+        dtrain, dval = load_external_memory_dmatrices(args.train, args.validation, args.batch_rows, args.cache_dir)
+        
+        print('Train features shape: ({}, {})'.format(dtrain.num_row(), dtrain.num_col()))
+        print('Validation features shape: ({}, {})'.format(dval.num_row(), dval.num_col()))
+    elif list_npy_shards(args.train, 'train'):
+        print('Loading memory-mapped training and validation data...')
+        dtrain, dval = load_npy_dmatrices(args.train, args.validation, args.batch_rows)
+        
+        print('Train features shape: ({}, {})'.format(dtrain.num_row(), dtrain.num_col()))
+        print('Validation features shape: ({}, {})'.format(dval.num_row(), dval.num_col()))
+    else:
+        print('Loading training data...')
+        X, y = load_split(args.train, 'train')
+        
+        print('Loading validation data...')
+        val_X, val_y = load_split(args.validation, 'val')
+        
+        print('Train features shape: {}'.format(X.shape))
+        print('Train labels shape: {}'.format(y.shape))
+        print('Validation features shape: {}'.format(val_X.shape))
+        print('Validation labels shape: {}'.format(val_y.shape))
 
-    dtrain = xgboost.DMatrix(X, label=y)
-    dval = xgboost.DMatrix(val_X, label=val_y)
+        dtrain = xgboost.DMatrix(X, label=y)
+        dval = xgboost.DMatrix(val_X, label=val_y)
 
     watchlist = [(dtrain, "train"), (dval, "validation")]
 
@@ -72,15 +215,28 @@ def main():
         "objective": args.objective,
         "eval_metric": args.eval_metric
     }
+    # QuantileDMatrix and external memory are only supported by the hist tree method
+    if args.external_memory or hasattr(xgboost, 'QuantileDMatrix') and isinstance(dtrain, xgboost.QuantileDMatrix):
+        params["tree_method"] = "hist"
 
+    callbacks = [FirstRoundTimer(start_time)] if TrainingCallback is not object else None
     bst = xgboost.train(
         params=params,
         dtrain=dtrain,
         evals=watchlist,
-        num_boost_round=args.num_round)
+        num_boost_round=args.num_round,
+        callbacks=callbacks)
+    
+    # Decision threshold tuned on the validation set, read by model_fn at inference
+    decision_threshold, val_f1 = optimal_f1_threshold(dval.get_label(), bst.predict(dval))
+    bst.set_attr(decision_threshold=str(decision_threshold))
+    print('Decision threshold: {:.4f} (validation F1 {:.2f})'.format(decision_threshold, val_f1))
+    
+    # ru_maxrss is reported in kilobytes on Linux
+    print('Peak RSS: {:.1f} MB'.format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
     
     model_dir = os.environ.get('SM_MODEL_DIR')
-    pkl.dump(bst, open(model_dir + '/model.bin', 'wb'))
+    save_booster(bst, model_dir)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,70 @@
+import os
+import sys
+import tempfile
+import subprocess
+import pickle as pkl
+
+import numpy as np
+import xgboost
+
+# Load time and memory of the XGBoost model as model_fn loads it: the pickled
+# Booster written by the previous training.py against the native formats written
+# by save_model. Every load runs in a fresh interpreter, after xgboost is imported.
+
+load_script = '''
+import sys, time, pickle
+import xgboost
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+
+rss_before = rss_mb()
+start = time.perf_counter()
+if sys.argv[2] == 'pickle':
+    with open(sys.argv[1], 'rb') as f:
+        model = pickle.load(f)
+else:
+    model = xgboost.Booster()
+    model.load_model(sys.argv[1])
+print(time.perf_counter() - start, rss_mb() - rss_before)
+'''
+
+def train_booster(num_round, max_depth):
+    rng = np.random.default_rng(0)
+    features = rng.standard_normal((20000, 8)).astype(np.float32)
+    labels = (features[:, 0] + 0.5 * features[:, 3] + rng.standard_normal(20000) > 1.5).astype(int)
+    params = {"max_depth": max_depth, "eta": 0.05, "objective": "binary:logistic"}
+    bst = xgboost.train(params, xgboost.DMatrix(features, label=labels), num_boost_round=num_round)
+    bst.set_attr(decision_threshold='0.5')
+    return bst
+
+def time_load(model_file, load_format, repeats=5):
+    results = [[float(value) for value in subprocess.run([sys.executable, '-c', load_script, model_file, load_format],
+                                                         capture_output=True, text=True, check=True).stdout.split()]
+               for _ in range(repeats)]
+    return min(results)
+
+if __name__ == "__main__":
+    num_round = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    max_depth = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+
+    bst = train_booster(num_round, max_depth)
+    with tempfile.TemporaryDirectory() as model_dir:
+        pickle_file = os.path.join(model_dir, 'model.bin')
+        with open(pickle_file, 'wb') as f:
+            pkl.dump(bst, f)
+        ubj_file = os.path.join(model_dir, 'model.ubj')
+        bst.save_model(ubj_file)
+        json_file = os.path.join(model_dir, 'model.json')
+        bst.save_model(json_file)
+
+        print('{} rounds, max_depth {}, XGBoost {}'.format(num_round, max_depth, xgboost.__version__))
+        for name, model_file, load_format in [('pickle (model.bin)', pickle_file, 'pickle'),
+                                              ('UBJSON (model.ubj)', ubj_file, 'native'),
+                                              ('JSON (model.json)', json_file, 'native')]:
+            load_time, rss_growth = time_load(model_file, load_format)
+            print('{:<20} size: {:8.1f} KB   load: {:8.1f} ms   RSS growth: {:7.1f} MB'.format(
+                name, os.path.getsize(model_file) / 1024, load_time * 1000, rss_growth))
@@ -0,0 +1,54 @@
+import os
+import sys
+import json
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'xgboost_source_dir'))
+import response_encoding
+
+# Serialization cost of the output_fn encodings, at 1, 100 and 10k rows: the
+# per-row dict building + json.dumps that output_fn used before, against the
+# row template JSON and the binary application/x-npy and application/x-float32
+# responses. Scores are what xgboost_source_dir returns, features (8 columns after
+# one-hot encoding) what sklearn_source_dir returns.
+
+def predictions_json_per_row(scores, decision_threshold):
+    predictions = []
+    for score in scores:
+        predictions.append({'score': score.astype(float), 'predicted_label': 1 if score > decision_threshold else 0})
+    return json.dumps({'predictions': predictions})
+
+def instances_json_per_row(features):
+    instances = []
+    for row in features.tolist():
+        instances.append({"features": row})
+    return json.dumps({"instances": instances})
+
+def time_encoding(encode, array, repeats):
+    timer = timeit.Timer(lambda: encode(array))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeats, number)) / number, len(encode(array))
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    decision_threshold = 0.5
+
+    for name, make_array, encodings in [
+        ('scores', lambda rows: rng.random(rows, dtype=np.float32), [
+            ('JSON, per-row dicts', lambda scores: predictions_json_per_row(scores, decision_threshold)),
+            ('JSON, row template', lambda scores: response_encoding.encode_predictions_json(scores, decision_threshold)),
+            (response_encoding.NPY, response_encoding.encode_npy),
+            (response_encoding.FLOAT32, response_encoding.encode_float32)]),
+        ('features', lambda rows: rng.standard_normal((rows, 8)), [
+            ('JSON, per-row dicts', instances_json_per_row),
+            ('JSON, row template', response_encoding.encode_instances_json),
+            (response_encoding.NPY, response_encoding.encode_npy),
+            (response_encoding.FLOAT32, response_encoding.encode_float32)])]:
+        for rows in [1, 100, 10000]:
+            array = make_array(rows)
+            print('{} x {} rows'.format(name, rows))
+            for encoding, encode in encodings:
+                seconds, size = time_encoding(encode, array, repeats=5)
+                print('  {:<24} {:10.1f} us   {:9d} bytes'.format(encoding, seconds * 1e6, size))
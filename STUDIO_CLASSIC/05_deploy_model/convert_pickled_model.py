@@ -0,0 +1,90 @@
+import os
+import io
+import shutil
+import tarfile
+import argparse
+import tempfile
+import pickle as pkl
+
+import xgboost
+
+# Converts a model.tar.gz written by an older training.py, which pickled the
+# Booster to model.bin, into the native format that training.py now writes
+# (model.ubj with XGBoost 1.6 and later, the native binary model.bin before).
+# Unpickling needs the XGBoost version the model was trained with, so run this
+# script with that version installed.
+#
+#   python convert_pickled_model.py --model-artifact s3://bucket/prefix/output/model.tar.gz
+#   python convert_pickled_model.py --model-artifact model.tar.gz --output model-native.tar.gz
+
+def read_artifact(uri):
+    if uri.startswith('s3://'):
+        import boto3
+        bucket, key = uri[len('s3://'):].split('/', 1)
+        return boto3.client('s3').get_object(Bucket=bucket, Key=key)['Body'].read()
+    with open(uri, 'rb') as f:
+        return f.read()
+
+def write_artifact(uri, body):
+    if uri.startswith('s3://'):
+        import boto3
+        bucket, key = uri[len('s3://'):].split('/', 1)
+        boto3.client('s3').put_object(Bucket=bucket, Key=key, Body=body)
+    else:
+        with open(uri, 'wb') as f:
+            f.write(body)
+
+def convert_model_dir(model_dir):
+    model_file = os.path.join(model_dir, 'model.bin')
+    if not os.path.exists(model_file):
+        print('No model.bin in the artifact, nothing to convert')
+        return False
+    with open(model_file, 'rb') as f:
+        header = f.read(2)
+    if not (len(header) == 2 and header[0] == 0x80 and 2 <= header[1] <= 5):
+        print('{} is not a pickle, nothing to convert'.format(model_file))
+        return False
+
+    with open(model_file, 'rb') as f:
+        booster = pkl.load(f)
+    os.remove(model_file)
+
+    # Same choice of format as save_booster in 04_train_model/source_dir/training.py
+    version = tuple(int(part) for part in xgboost.__version__.split('.')[:2])
+    file_name = 'model.ubj' if version >= (1, 6) else 'model.bin'
+    booster.save_model(os.path.join(model_dir, file_name))
+    print('Converted pickled model.bin to {}'.format(file_name))
+    return True
+
+def convert_artifact(model_artifact, output):
+    work_dir = tempfile.mkdtemp()
+    try:
+        model_dir = os.path.join(work_dir, 'model')
+        with tarfile.open(fileobj=io.BytesIO(read_artifact(model_artifact)), mode='r:gz') as archive:
+            if hasattr(tarfile, 'data_filter'):
+                archive.extractall(model_dir, filter='data')
+            else:
+                archive.extractall(model_dir)
+
+        if not convert_model_dir(model_dir):
+            return False
+
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+            for name in sorted(os.listdir(model_dir)):
+                archive.add(os.path.join(model_dir, name), arcname=name)
+        write_artifact(output, buffer.getvalue())
+        print('Wrote {}'.format(output))
+        return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model-artifact', type=str, required=True, help='model.tar.gz, local or s3://')
+    parser.add_argument('--output', type=str, default=None, help='Defaults to overwriting --model-artifact')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    convert_artifact(args.model_artifact, args.output or args.model_artifact)
@@ -13,12 +13,44 @@ from sklearn.externals import joblib
 from sagemaker_containers.beta.framework import (
     content_types, encoders, env, modules, transformer, worker)
 
+import response_encoding
+
 feature_columns_names = ['Type', 'Air temperature [K]', 'Process temperature [K]', 'Rotational speed [rpm]', 'Torque [Nm]', 'Tool wear [min]']
 
+def parse_csv_payload(input_data):
+    # Fast path for the fixed schema: one categorical 'Type' followed by five
+    # numeric columns per line. Returns None when the payload does not match
+    # that layout, so the caller can fall back to pandas
+    if isinstance(input_data, bytes):
+        input_data = input_data.decode('utf-8')
+    if '"' in input_data:
+        return None
+    lines = [line for line in input_data.splitlines() if line]
+    num_rows = len(lines)
+    num_columns = len(feature_columns_names)
+    cells = ','.join(lines).split(',')
+    if num_rows == 0 or len(cells) != num_rows * num_columns:
+        return None
+
+    types = np.empty(num_rows, dtype=object)
+    numeric = np.empty((num_rows, num_columns - 1), dtype=np.float64)
+    grid = np.array(cells, dtype=object).reshape((num_rows, num_columns))
+    types[:] = grid[:, 0]
+    try:
+        numeric[:] = grid[:, 1:]
+    except ValueError:
+        return None
+    return types, numeric
+
 def input_fn(input_data, content_type):
     print(input_data)
     
     if content_type == 'text/csv':
+        parsed = parse_csv_payload(input_data)
+        if parsed is not None:
+            types, numeric = parsed
+            return pd.DataFrame(dict(zip(feature_columns_names, [types] + list(numeric.T))))
+
         df = pd.read_csv(StringIO(input_data), header=None)
         if len(df.columns) == len(feature_columns_names):
             df.columns = feature_columns_names 
@@ -31,17 +63,20 @@ def predict_fn(input_data, model):
     return features
 
 def output_fn(prediction, accept):
+    features = np.asarray(prediction)
+    
     if accept == "application/json":
-        instances = []
-        for row in prediction.tolist():
-            instances.append({"features": row})
-        json_output = {"instances": instances}
+        json_output = response_encoding.encode_instances_json(features)
 
-        return worker.Response(json.dumps(json_output), mimetype=accept)
+        return worker.Response(json_output, mimetype=accept)
     elif accept == 'text/csv':
         return worker.Response(encoders.encode(prediction, accept), mimetype=accept)
+    elif accept == response_encoding.NPY:
+        return worker.Response(response_encoding.encode_npy(features), mimetype=accept)
+    elif accept == response_encoding.FLOAT32:
+        return worker.Response(response_encoding.encode_float32(features), mimetype=accept)
     else:
-        raise RuntimeException("{} accept type is not supported.".format(accept))
+        raise ValueError("{} accept type is not supported.".format(accept))
 
 def model_fn(model_dir):
     preprocessor = joblib.load(os.path.join(model_dir, "model.joblib"))
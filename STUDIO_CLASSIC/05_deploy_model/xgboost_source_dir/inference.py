@@ -9,33 +9,69 @@ from sagemaker_containers.beta.framework import (
 
 from sagemaker_xgboost_container import encoder as xgb_encoders
 
+import response_encoding
+
+# Decision threshold tuned on the validation set at training time, read from the
+# model artifact by model_fn (0.5 for models trained without one)
+decision_threshold = 0.5
+
 def input_fn(input_data, content_type):    
     if content_type == content_types.JSON:
         obj = json.loads(input_data)
-        features = obj['instances'][0]['features']
-        array = np.array(features).reshape((1, -1))
+        array = np.array([instance['features'] for instance in obj['instances']], dtype=np.float32)
         return xgb.DMatrix(array)
+    elif content_type in (response_encoding.NPY, response_encoding.FLOAT32):
+        return xgb.DMatrix(response_encoding.decode_array(input_data, content_type))
     else:
         return xgb_encoders.decode(input_data, content_type)
 
+def is_pickle(model_file):
+    # Pickles of protocol 2 and later start with the PROTO opcode, which a native
+    # binary model (starting with its base score or the 'binf' header) does not
+    with open(model_file, 'rb') as f:
+        header = f.read(2)
+    return len(header) == 2 and header[0] == 0x80 and 2 <= header[1] <= 5
+
+def load_model(model_dir):
+    # Native UBJSON or JSON model written by training.py with XGBoost 1.6 and later
+    for file_name in ['model.ubj', 'model.json']:
+        model_file = os.path.join(model_dir, file_name)
+        if os.path.exists(model_file):
+            model = xgb.Booster()
+            model.load_model(model_file)
+            return model
+
+    # Native binary model of older XGBoost versions, or a pickled Booster written
+    # before training.py switched to save_model (see convert_pickled_model.py)
+    model_file = os.path.join(model_dir, 'model.bin')
+    if is_pickle(model_file):
+        print('Loading pickled model {}, convert it with convert_pickled_model.py to load it natively'.format(model_file))
+        with open(model_file, 'rb') as f:
+            return pkl.load(f)
+    model = xgb.Booster()
+    model.load_model(model_file)
+    return model
+
 def model_fn(model_dir):
-    model_file = model_dir + '/model.bin'
-    model = pkl.load(open(model_file, 'rb'))
+    model = load_model(model_dir)
+    
+    global decision_threshold
+    decision_threshold = float(model.attr('decision_threshold') or 0.5)
+    print('Decision threshold: {}'.format(decision_threshold))
     return model
 
 def output_fn(prediction, accept):
-    
-    pred_array_value = np.array(prediction)
-    score = pred_array_value[0]
+    # One score per row of the request
+    scores = np.asarray(prediction, dtype=np.float32).reshape(-1)
     
     if accept == "application/json":
-        predicted_label = 1 if score > 0.5 else 0
-        return_value = {
-            'predictions': [{'score': score.astype(float), 'predicted_label': predicted_label }]
-        }
-        return worker.Response(json.dumps(return_value), mimetype=accept)
+        return_value = response_encoding.encode_predictions_json(scores, decision_threshold)
+        return worker.Response(return_value, mimetype=accept)
     elif accept == 'text/csv':
-        return_value = 'yes' if score > 0.5 else 'no'
-        return worker.Response(encoders.encode(prediction, accept), mimetype=accept)
+        return worker.Response(encoders.encode(scores, accept), mimetype=accept)
+    elif accept == response_encoding.NPY:
+        return worker.Response(response_encoding.encode_npy(scores), mimetype=accept)
+    elif accept == response_encoding.FLOAT32:
+        return worker.Response(response_encoding.encode_float32(scores), mimetype=accept)
     else:
-        raise RuntimeException("{} accept type is not supported.".format(accept))
+        raise ValueError("{} accept type is not supported.".format(accept))
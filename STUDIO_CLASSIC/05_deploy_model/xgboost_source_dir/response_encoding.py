@@ -0,0 +1,74 @@
+import io
+import struct
+
+import numpy as np
+
+# Response encodings shared by the inference scripts of the featurizer
+# (sklearn_source_dir) and of the XGBoost model (xgboost_source_dir):
+#
+# - application/json: every row is formatted by a single % operation on a
+#   template repeated once per row, instead of building a dict per row. Values
+#   are written with 9 significant digits, which round-trips float32, the type
+#   XGBoost reads features as and returns scores in
+# - application/x-npy: the array saved with np.save
+# - application/x-float32: a 12 byte header (b'F32L', number of rows and of
+#   columns as little-endian uint32) followed by the values as little-endian
+#   float32, row by row
+#
+# The same file is copied into both source directories, since each one is
+# packaged on its own.
+
+NPY = 'application/x-npy'
+FLOAT32 = 'application/x-float32'
+
+float32_magic = b'F32L'
+float32_header = struct.Struct('<4sII')
+
+number_format = '%.9g'
+
+def format_rows(row_template, values):
+    # values is 2-D, one row per template
+    values = np.asarray(values)
+    return ', '.join([row_template] * values.shape[0]) % tuple(values.ravel().tolist())
+
+def encode_predictions_json(scores, decision_threshold):
+    # {"predictions": [{"score": ..., "predicted_label": ...}, ...]}, the output of xgboost_source_dir
+    scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+    values = np.column_stack([scores, scores > decision_threshold])
+    row_template = '{"score": ' + number_format + ', "predicted_label": %d}'
+    return '{"predictions": [' + format_rows(row_template, values) + ']}'
+
+def encode_instances_json(features):
+    # {"instances": [{"features": [...]}, ...]}, the output of sklearn_source_dir
+    # and the JSON input of xgboost_source_dir
+    features = np.atleast_2d(np.asarray(features, dtype=np.float64))
+    row_template = '{"features": [' + ', '.join([number_format] * features.shape[1]) + ']}'
+    return '{"instances": [' + format_rows(row_template, features) + ']}'
+
+def encode_npy(array):
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(array, dtype=np.float32))
+    return buffer.getvalue()
+
+def decode_npy(payload):
+    return np.load(io.BytesIO(payload))
+
+def encode_float32(array):
+    array = np.asarray(array, dtype='<f4')
+    rows, columns = (array.shape[0], 1) if array.ndim == 1 else array.shape
+    return float32_header.pack(float32_magic, rows, columns) + array.tobytes()
+
+def decode_float32(payload):
+    magic, rows, columns = float32_header.unpack_from(payload)
+    if magic != float32_magic:
+        raise ValueError('Payload is not application/x-float32')
+    array = np.frombuffer(payload, dtype='<f4', offset=float32_header.size, count=rows * columns)
+    return array.reshape((rows, columns))
+
+def decode_array(payload, content_type):
+    # Feature rows sent in one of the binary encodings, as a 2-D array
+    if content_type == NPY:
+        return np.atleast_2d(decode_npy(payload))
+    if content_type == FLOAT32:
+        return decode_float32(payload)
+    raise ValueError('{} is not a binary array encoding'.format(content_type))